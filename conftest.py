@@ -0,0 +1 @@
+# Root del repo nel sys.path dei test (import etl.*): i test stanno in etl/test accanto ai gate.
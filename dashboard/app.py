@@ -1,5 +1,4 @@
 import streamlit as st
-import duckdb
 import pandas as pd
 import os
 import re
@@ -9,6 +8,8 @@ from dotenv import load_dotenv
 load_dotenv()
 from pathlib import Path
 
+from queries import NamedQuery, run_query, run_sql
+
 # Text-to-SQL (Gemini)
 try:
     from google import genai
@@ -30,68 +31,104 @@ DB_PATH = Path(__file__).resolve().parents[1] / "data" / "warehouse.duckdb"
 # -----------------------------
 # DB HELPERS
 # -----------------------------
-@st.cache_data(ttl=60)
 def read_df(sql: str) -> pd.DataFrame:
-    """Esegue una query e ritorna un pandas DataFrame (cache 60s)."""
-    con = duckdb.connect(str(DB_PATH), read_only=True)
-    try:
-        return con.execute(sql).df()
-    finally:
-        con.close()
+    """SQL libero (Text-to-SQL): cache invalidata quando la pipeline pubblica un gold nuovo."""
+    return run_sql(str(DB_PATH), sql)
 
 
-@st.cache_data(ttl=300)
-def get_filter_options():
-    """Preleva opzioni per i filtri (cache 5 min)."""
-    years = read_df("""
-        SELECT DISTINCT d.year
-        FROM gold.fact_incident f
-        JOIN gold.dim_date d ON d.date_id = f.date_id
-        ORDER BY 1
-    """)["year"].tolist()
+def read_query(query: NamedQuery, **params) -> pd.DataFrame:
+    """Query con nome e parametri bound (prepared sul pool, cache per parametri + versione gold)."""
+    return run_query(str(DB_PATH), query, **params)
 
-    months = list(range(1, 13))
 
-    call_type_groups = read_df("""
-        SELECT DISTINCT it.call_type_group
-        FROM gold.fact_incident f
-        JOIN gold.dim_incident_type it ON it.incident_type_id = f.incident_type_id
-        WHERE it.call_type_group IS NOT NULL AND TRIM(it.call_type_group) <> ''
-        ORDER BY 1
-    """)["call_type_group"].tolist()
+# Filtri dashboard: NULL = "Tutti". Colonne senza alias, valide su gold.kpi_cube e gold.kpi_response_hist.
+FILTERS_SQL = """
+      ($year::INTEGER IS NULL OR year = $year)
+      AND ($month::INTEGER IS NULL OR month = $month)
+      AND ($ctg::VARCHAR IS NULL OR call_type_group = $ctg)
+      AND ($neigh::VARCHAR IS NULL OR neighborhood = $neigh)
+"""
 
-    neighborhoods = read_df("""
-        SELECT DISTINCT l.neighborhood
-        FROM gold.fact_incident f
-        JOIN gold.dim_location l ON l.location_id = f.location_id
-        WHERE l.neighborhood IS NOT NULL AND TRIM(l.neighborhood) <> ''
-        ORDER BY 1
-    """)["neighborhood"].tolist()
+# Valori dei filtri precalcolati dalla pipeline (solo quelli referenziati dalla fact)
+Q_FILTER_OPTIONS = NamedQuery("filter_options", """
+    SELECT filter_name, value
+    FROM gold.filter_options
+    WHERE filter_name IN ('year', 'call_type_group', 'neighborhood')
+    ORDER BY filter_name, value
+""")
 
-    return years, months, call_type_groups, neighborhoods
+# Parametri delle table macro KPI della pipeline (gold.kpi_*): stessi filtri di FILTERS_SQL
+KPI_MACRO_ARGS = "$year::INTEGER, $month::INTEGER, $ctg::VARCHAR, $neigh::VARCHAR"
 
+# KPI numeriche (medie ricomposte dal cube dalla macro creata dalla pipeline)
+Q_KPI = NamedQuery("kpi_totals", f"""
+    SELECT
+      total_incidents,
+      avg_response_time_sec AS avg_resp,
+      avg_dispatch_delay_sec AS avg_dispatch,
+      avg_travel_time_sec AS avg_travel
+    FROM gold.kpi_summary({KPI_MACRO_ARGS})
+""")
+
+# p90 dall'istogramma log-scala (gold.kpi_response_hist) tramite la macro creata dalla pipeline
+Q_P90 = NamedQuery("kpi_p90_response", f"""
+    SELECT p90_response_time_sec AS p90_resp
+    FROM gold.kpi_response_pctl({KPI_MACRO_ARGS})
+""")
+
+Q_RESPONSE_MONTH = NamedQuery("response_time_month", f"""
+    SELECT year, month, avg_response_time_sec
+    FROM gold.kpi_response_time_month({KPI_MACRO_ARGS})
+""")
+
+Q_VOLUME_MONTH = NamedQuery("incident_volume_month", f"""
+    SELECT
+      year,
+      month,
+      SUM(n_incidents) AS incident_count
+    FROM gold.kpi_cube
+    WHERE {FILTERS_SQL}
+    GROUP BY 1,2
+    ORDER BY 1,2
+""")
 
-def escape_sql_literal(value: str) -> str:
-    """Escapa apici singoli per sicurezza nelle stringhe SQL."""
-    return value.replace("'", "''")
+Q_TOP_TYPES = NamedQuery("top_incident_types", f"""
+    SELECT
+      call_type_group,
+      call_type,
+      SUM(n_incidents) AS incident_count
+    FROM gold.kpi_cube
+    WHERE {FILTERS_SQL}
+    GROUP BY 1,2
+    ORDER BY incident_count DESC
+    LIMIT 15
+""")
 
 
-def build_where(year_sel, month_sel, ctg_sel, neigh_sel) -> str:
-    """
-    Costruisce una WHERE dinamica.
-    Nota: usa alias d/it/l che sono coerenti con le query sotto.
-    """
-    clauses = []
-    if year_sel != "Tutti":
-        clauses.append(f"d.year = {int(year_sel)}")
-    if month_sel != "Tutti":
-        clauses.append(f"d.month = {int(month_sel)}")
-    if ctg_sel != "Tutti":
-        clauses.append(f"it.call_type_group = '{escape_sql_literal(ctg_sel)}'")
-    if neigh_sel != "Tutti":
-        clauses.append(f"l.neighborhood = '{escape_sql_literal(neigh_sel)}'")
+def get_filter_options():
+    """Preleva opzioni per i filtri da gold.filter_options (una sola lettura)."""
+    opts = read_query(Q_FILTER_OPTIONS)
+
+    def values(name):
+        return opts.loc[opts["filter_name"] == name, "value"].tolist()
 
-    return ("WHERE " + " AND ".join(clauses)) if clauses else ""
+    years = [int(y) for y in values("year")]
+    months = list(range(1, 13))
+    return years, months, values("call_type_group"), values("neighborhood")
+
+
+def build_filter_params(year_sel, month_sel, ctg_sel, neigh_sel) -> dict:
+    """Parametri di FILTERS_SQL: "Tutti" -> None (nessun filtro su quella colonna)."""
+    def opt(v):
+        return None if v == "Tutti" else v
+
+    year, month = opt(year_sel), opt(month_sel)
+    return {
+        "year": None if year is None else int(year),
+        "month": None if month is None else int(month),
+        "ctg": opt(ctg_sel),
+        "neigh": opt(neigh_sel),
+    }
 
 
 # -----------------------------
@@ -144,6 +181,19 @@ Tabelle GOLD disponibili:
 - gold.dim_location(location_id, address, city, zipcode, neighborhood, battalion, station_area,
   supervisor_district, fire_prevention_district, box, location_point)
 - gold.dim_incident_type(incident_type_id, call_type, call_type_group, primary_situation, final_priority)
+- gold.kpi_cube(year, month, call_type_group, call_type, neighborhood, battalion, n_incidents,
+  n_/sum_/sumsq_ per response_time, dispatch_delay, travel_time)
+  pre-aggregato: media = SUM(sum_x) / SUM(n_x); preferiscilo alla fact per conteggi e medie.
+- gold.filter_options(filter_name, value, n_incidents, first_date, last_date)
+  valori distinti dei filtri (year, call_type_group, neighborhood, battalion, city) presenti nella fact.
+- gold.v_kpi_response_pctl_month(year, month, neighborhood, n_incidents,
+  p50_response_time_sec, p90_response_time_sec, p95_response_time_sec)
+- gold.kpi_response_pctl(p_year, p_month, p_call_type_group, p_neighborhood): table macro, NULL = tutti;
+  stesse colonne (n_incidents, p50/p90/p95_response_time_sec) per una combinazione di filtri.
+- gold.kpi_summary(p_year, p_month, p_call_type_group, p_neighborhood): table macro, NULL = tutti;
+  (total_incidents, avg_response_time_sec, avg_dispatch_delay_sec, avg_travel_time_sec).
+- gold.kpi_response_time_month(p_year, p_month, p_call_type_group, p_neighborhood): table macro,
+  (year, month, avg_response_time_sec, n_incidents) per una combinazione di filtri.
 
 Regole:
 - genera SOLO una query SQL DuckDB di tipo SELECT (o WITH).
@@ -166,7 +216,7 @@ Regole:
 # UI: HEADER CON DEFINIZIONE DASHBOARD
 # -----------------------------
 st.title("San Francisco Fire Dept — KPI Dashboard")
-st.caption("KPI e grafici calcolati sul Gold layer (fact + dimensions).")
+st.caption("KPI e grafici calcolati sul Gold layer (KPI cube pre-aggregato).")
 
 tab_dash, tab_t2s = st.tabs(["Dashboard KPI", "Text-to-SQL (Gemini)"])
 
@@ -184,26 +234,13 @@ with tab_dash:
     ctg_sel = st.sidebar.selectbox("Call Type Group", options=["Tutti"] + call_type_groups, index=0)
     neigh_sel = st.sidebar.selectbox("Neighborhood", options=["Tutti"] + neighborhoods, index=0)
 
-    where = build_where(year_sel, month_sel, ctg_sel, neigh_sel)
+    params = build_filter_params(year_sel, month_sel, ctg_sel, neigh_sel)
 
     # -----------------------------
     # KPI NUMERICHE
     # -----------------------------
-    kpi_sql = f"""
-    SELECT
-      COUNT(*) AS total_incidents,
-      AVG(f.response_time_sec) FILTER (WHERE f.response_time_sec IS NOT NULL) AS avg_resp,
-      AVG(f.dispatch_delay_sec) FILTER (WHERE f.dispatch_delay_sec IS NOT NULL) AS avg_dispatch,
-      AVG(f.travel_time_sec) FILTER (WHERE f.travel_time_sec IS NOT NULL) AS avg_travel,
-      quantile_cont(f.response_time_sec, 0.9) FILTER (WHERE f.response_time_sec IS NOT NULL) AS p90_resp
-    FROM gold.fact_incident f
-    JOIN gold.dim_date d ON d.date_id = f.date_id
-    JOIN gold.dim_incident_type it ON it.incident_type_id = f.incident_type_id
-    JOIN gold.dim_location l ON l.location_id = f.location_id
-    {where};
-    """
-
-    k = read_df(kpi_sql).iloc[0]
+    k = read_query(Q_KPI, **params).iloc[0]
+    k["p90_resp"] = read_query(Q_P90, **params).iloc[0]["p90_resp"]
 
     c1, c2, c3, c4, c5 = st.columns(5)
     c1.metric("Incidenti totali", f"{int(k['total_incidents']):,}")
@@ -218,20 +255,7 @@ with tab_dash:
     # GRAFICO 1: Trend response time mensile (linechart)
     # -----------------------------
     st.subheader("Grafico 1 — Avg Response Time (Monthly)")
-    df_rt = read_df(f"""
-    SELECT
-      d.year,
-      d.month,
-      AVG(f.response_time_sec) AS avg_response_time_sec
-    FROM gold.fact_incident f
-    JOIN gold.dim_date d ON d.date_id = f.date_id
-    JOIN gold.dim_incident_type it ON it.incident_type_id = f.incident_type_id
-    JOIN gold.dim_location l ON l.location_id = f.location_id
-    {where}
-    AND f.response_time_sec IS NOT NULL
-    GROUP BY 1,2
-    ORDER BY 1,2
-    """)
+    df_rt = read_query(Q_RESPONSE_MONTH, **params)
 
     if df_rt.empty:
         st.info("Nessun dato per i filtri selezionati.")
@@ -243,19 +267,7 @@ with tab_dash:
     # GRAFICO 2: Volume incidenti mensile (barchart)
     # -----------------------------
     st.subheader("Grafico 2 — Incident Volume (Monthly)")
-    df_vol = read_df(f"""
-    SELECT
-      d.year,
-      d.month,
-      COUNT(*) AS incident_count
-    FROM gold.fact_incident f
-    JOIN gold.dim_date d ON d.date_id = f.date_id
-    JOIN gold.dim_incident_type it ON it.incident_type_id = f.incident_type_id
-    JOIN gold.dim_location l ON l.location_id = f.location_id
-    {where}
-    GROUP BY 1,2
-    ORDER BY 1,2
-    """)
+    df_vol = read_query(Q_VOLUME_MONTH, **params)
 
     if df_vol.empty:
         st.info("Nessun dato per i filtri selezionati.")
@@ -267,20 +279,7 @@ with tab_dash:
     # GRAFICO 3: Top incident type (barchart)
     # -----------------------------
     st.subheader("Grafico 3 — Top Incident Types (count)")
-    df_top = read_df(f"""
-    SELECT
-      it.call_type_group,
-      it.call_type,
-      COUNT(*) AS incident_count
-    FROM gold.fact_incident f
-    JOIN gold.dim_date d ON d.date_id = f.date_id
-    JOIN gold.dim_incident_type it ON it.incident_type_id = f.incident_type_id
-    JOIN gold.dim_location l ON l.location_id = f.location_id
-    {where}
-    GROUP BY 1,2
-    ORDER BY incident_count DESC
-    LIMIT 15
-    """)
+    df_top = read_query(Q_TOP_TYPES, **params)
 
     if df_top.empty:
         st.info("Nessun dato per i filtri selezionati.")
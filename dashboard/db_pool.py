@@ -0,0 +1,171 @@
+"""Connessioni DuckDB read-only condivise tra le sessioni Streamlit (app.py, streamlit_app.py, mock_up.py).
+
+Una sola connessione per file DuckDB per processo (st.cache_resource): il catalogo del file si
+legge una volta, ogni thread di Streamlit usa un proprio cursor() della stessa istanza.
+
+Config (env):
+  DASHBOARD_DB_POOL_SIZE  query concorrenti massime per file (default 8)
+  DASHBOARD_DB_IDLE_SEC   chiude la connessione dopo N secondi senza query (default 60, 0 = mai).
+                          Una connessione read-only aperta tiene il lock sul file: senza idle close
+                          la pipeline non potrebbe scrivere sul warehouse mentre la dashboard è aperta.
+
+I prepared statement (execute_prepared) vivono nel cursor del thread: si preparano una volta per
+cursor e si rifanno da soli quando la connessione viene riaperta.
+
+Se il file cambia su disco (es. export che rigenera dashboard.duckdb) la connessione viene riaperta
+alla prima query successiva in cui nessun'altra query è in corso.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import duckdb
+import pandas as pd
+import pyarrow as pa
+import streamlit as st
+
+POOL_SIZE = int(os.getenv("DASHBOARD_DB_POOL_SIZE", "8"))
+IDLE_SEC = float(os.getenv("DASHBOARD_DB_IDLE_SEC", "60"))
+
+
+class ReadOnlyPool:
+    def __init__(self, db_path: str | Path, size: int = POOL_SIZE, idle_sec: float = IDLE_SEC):
+        self.db_path = str(Path(db_path).resolve())
+        self.idle_sec = idle_sec
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._con: duckdb.DuckDBPyConnection | None = None
+        self._cursors: list[duckdb.DuckDBPyConnection] = []
+        self._generation = 0
+        self._mtime: int | None = None
+        self._active = 0
+        self._last_used = 0.0
+        self._idle_timer: threading.Timer | None = None
+
+    def _file_mtime(self) -> int | None:
+        try:
+            return os.stat(self.db_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _close_locked(self) -> None:
+        for cur in self._cursors:
+            try:
+                cur.close()
+            except duckdb.Error:
+                pass
+        self._cursors = []
+        if self._con is not None:
+            try:
+                self._con.close()
+            except duckdb.Error:
+                pass
+        self._con = None
+
+    def _acquire(self) -> duckdb.DuckDBPyConnection:
+        """Cursor del thread corrente (riapre la connessione se chiusa o se il file è cambiato)."""
+        with self._lock:
+            now = time.monotonic()
+            if self._con is not None and self._active == 0 and self._file_mtime() != self._mtime:
+                self._close_locked()
+            if self._con is None:
+                self._mtime = self._file_mtime()
+                self._con = duckdb.connect(self.db_path, read_only=True)
+                self._generation += 1
+
+            if getattr(self._local, "generation", None) != self._generation:
+                self._local.cursor = self._con.cursor()
+                self._local.generation = self._generation
+                self._local.prepared = set()
+                self._cursors.append(self._local.cursor)
+
+            self._active += 1
+            self._last_used = now
+            return self._local.cursor
+
+    def _release(self) -> None:
+        with self._lock:
+            self._active -= 1
+            self._last_used = time.monotonic()
+            if self.idle_sec > 0 and self._idle_timer is None:
+                self._schedule_idle_close(self.idle_sec)
+
+    def _schedule_idle_close(self, delay: float) -> None:
+        self._idle_timer = threading.Timer(delay, self._close_if_idle)
+        self._idle_timer.daemon = True
+        self._idle_timer.start()
+
+    def _close_if_idle(self) -> None:
+        """Timer: libera il file (lock) se nessuna query da idle_sec, altrimenti ripianifica."""
+        with self._lock:
+            self._idle_timer = None
+            if self._con is None:
+                return
+            remaining = self.idle_sec - (time.monotonic() - self._last_used)
+            if self._active == 0 and remaining <= 0:
+                self._close_locked()
+            else:
+                self._schedule_idle_close(max(remaining, 0.1))
+
+    def invalidate(self) -> None:
+        """Forza la riapertura alla prossima query (appena non ci sono query in corso)."""
+        with self._lock:
+            self._mtime = -1
+
+    @contextmanager
+    def cursor(self):
+        """Cursor read-only del thread corrente, con health check (SELECT 1) prima dell'uso."""
+        with self._slots:
+            cur = self._acquire()
+            # _active va decrementato una sola volta e solo se lo slot è preso: la riapertura
+            # rilascia prima di riacquisire e può fallire (in quel caso non c'è niente da rilasciare)
+            acquired = True
+            try:
+                try:
+                    cur.execute("SELECT 1").fetchone()
+                except duckdb.Error:
+                    # connessione non più valida: una sola riapertura, poi l'errore risale
+                    self._release()
+                    acquired = False
+                    with self._lock:
+                        if self._active == 0:
+                            self._close_locked()
+                        self._local.generation = None
+                    cur = self._acquire()
+                    acquired = True
+                yield cur
+            finally:
+                if acquired:
+                    self._release()
+
+    def query_df(self, sql: str, params: list | None = None) -> pd.DataFrame:
+        with self.cursor() as cur:
+            return cur.execute(sql, params).df() if params is not None else cur.execute(sql).df()
+
+    def query_arrow(self, sql: str) -> pa.Table:
+        with self.cursor() as cur:
+            return cur.execute(sql).to_arrow_table()
+
+    def execute_prepared(self, name: str, sql: str, params: dict[str, str]) -> pd.DataFrame:
+        """
+        EXECUTE di un prepared statement con parametri nominali ($nome in sql).
+        params: nome -> literal SQL già renderizzato (EXECUTE di DuckDB non accetta bind "?").
+        """
+        with self.cursor() as cur:
+            prepared = self._local.prepared
+            if name not in prepared:
+                cur.execute(f"PREPARE {name} AS {sql}")
+                prepared.add(name)
+            args = ", ".join(f"{k} := {v}" for k, v in params.items())
+            return cur.execute(f"EXECUTE {name}({args})" if args else f"EXECUTE {name}").df()
+
+
+@st.cache_resource(show_spinner=False)
+def get_pool(db_path: str) -> ReadOnlyPool:
+    """Pool condiviso da tutte le sessioni del processo Streamlit per quel file DuckDB."""
+    return ReadOnlyPool(db_path)
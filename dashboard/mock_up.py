@@ -1,9 +1,10 @@
 import streamlit as st
-import duckdb
 import pandas as pd
 import matplotlib.pyplot as plt
 from pathlib import Path
 
+from queries import NamedQuery, run_query
+
 # -----------------------------
 # CONFIG
 # -----------------------------
@@ -12,41 +13,166 @@ st.set_page_config(page_title="SFFD Dashboard (Mock-up)", layout="wide")
 DB_PATH = Path("data/warehouse.duckdb")
 BASE_CALLS = "silver.calls_clean"
 BASE_INC = "silver.incidents_clean"
+FILTER_OPTIONS = "gold.calls_filter_options"
 
 # -----------------------------
 # DB HELPER
 # -----------------------------
-@st.cache_data(ttl=60)
-def q(sql: str) -> pd.DataFrame:
-    con = duckdb.connect(str(DB_PATH), read_only=True)
-    try:
-        return con.execute(sql).df()
-    finally:
-        con.close()
-
-def _make_in_clause(values):
-    """Crea una clausola IN sicura per stringhe SQL (escape ' -> '')."""
-    if not values:
-        return None
-    escaped = [v.replace("'", "''") for v in values]
-    return ",".join(f"'{v}'" for v in escaped)
-
-def make_where_calls(date_from, date_to, selected_groups, selected_cities, selected_battalions):
-    clauses = [f"call_date BETWEEN '{date_from}' AND '{date_to}'"]
-
-    in_groups = _make_in_clause(selected_groups)
-    if in_groups:
-        clauses.append(f"call_type_group IN ({in_groups})")
-
-    in_cities = _make_in_clause(selected_cities)
-    if in_cities:
-        clauses.append(f"city IN ({in_cities})")
-
-    in_bats = _make_in_clause(selected_battalions)
-    if in_bats:
-        clauses.append(f"battalion IN ({in_bats})")
-
-    return "WHERE " + " AND ".join(clauses)
+def q(query: NamedQuery, **params) -> pd.DataFrame:
+    """Query con nome e parametri bound (cache per parametri + versione del warehouse)."""
+    return run_query(str(DB_PATH), query, **params)
+
+# Filtri calls: liste vuote -> NULL (nessun filtro su quella colonna)
+WHERE_CALLS = """
+    call_date BETWEEN $date_from AND $date_to
+    AND ($groups::VARCHAR[] IS NULL OR list_contains($groups, call_type_group))
+    AND ($cities::VARCHAR[] IS NULL OR list_contains($cities, city))
+    AND ($battalions::VARCHAR[] IS NULL OR list_contains($battalions, battalion))
+"""
+
+def make_params_calls(date_from, date_to, selected_groups, selected_cities, selected_battalions) -> dict:
+    return {
+        "date_from": date_from,
+        "date_to": date_to,
+        "groups": list(selected_groups) or None,
+        "cities": list(selected_cities) or None,
+        "battalions": list(selected_battalions) or None,
+    }
+
+# Opzioni dei filtri precalcolate dalla pipeline (gold.calls_filter_options): una lettura invece
+# di quattro scansioni di silver.calls_clean, con gli stessi valori grezzi su cui filtra WHERE_CALLS.
+# L'intervallo di call_date viene dalla riga "all".
+Q_FILTER_OPTIONS = NamedQuery("calls_filter_options", f"""
+    SELECT filter_name, value, first_date, last_date
+    FROM {FILTER_OPTIONS}
+    ORDER BY filter_name, value
+""")
+
+Q_KPI = NamedQuery("calls_kpi", f"""
+    SELECT
+      COUNT(*) AS total_calls,
+      AVG(response_time_sec) AS avg_response_sec,
+      quantile_cont(response_time_sec, 0.5) AS median_response_sec,
+      quantile_cont(response_time_sec, 0.9) AS p90_response_sec,
+      SUM(CASE WHEN response_time_sec IS NULL THEN 1 ELSE 0 END) AS null_response_time
+    FROM {BASE_CALLS}
+    WHERE {WHERE_CALLS}
+""")
+
+Q_DQ = NamedQuery("calls_dq", f"""
+    SELECT
+      COUNT(*) AS total,
+      SUM(CASE WHEN response_time_sec IS NULL THEN 1 ELSE 0 END) AS null_resp,
+      SUM(CASE WHEN dispatch_delay_sec IS NULL THEN 1 ELSE 0 END) AS null_dispatch_delay,
+      SUM(CASE WHEN travel_time_sec IS NULL THEN 1 ELSE 0 END) AS null_travel
+    FROM {BASE_CALLS}
+    WHERE {WHERE_CALLS}
+""")
+
+Q_CALLS_MONTH = NamedQuery("calls_month", f"""
+    SELECT
+      date_trunc('month', call_date) AS month,
+      COUNT(*) AS calls
+    FROM {BASE_CALLS}
+    WHERE {WHERE_CALLS}
+    GROUP BY 1
+    ORDER BY 1
+""")
+
+Q_RESPONSE_SAMPLE = NamedQuery("calls_response_sample", f"""
+    SELECT response_time_sec
+    FROM {BASE_CALLS}
+    WHERE {WHERE_CALLS}
+    AND response_time_sec IS NOT NULL
+    USING SAMPLE 20000
+""")
+
+Q_RESPONSE_MONTH = NamedQuery("calls_response_month", f"""
+    SELECT
+      date_trunc('month', call_date) AS month,
+      AVG(response_time_sec) AS avg_resp
+    FROM {BASE_CALLS}
+    WHERE {WHERE_CALLS}
+    AND response_time_sec IS NOT NULL
+    GROUP BY 1
+    ORDER BY 1
+""")
+
+Q_TOP_CALL_TYPES = NamedQuery("calls_top_call_types", f"""
+    SELECT call_type, COUNT(*) AS n
+    FROM {BASE_CALLS}
+    WHERE {WHERE_CALLS}
+    AND call_type IS NOT NULL
+    GROUP BY 1
+    ORDER BY n DESC
+    LIMIT 15
+""")
+
+Q_NEIGH_RESPONSE = NamedQuery("calls_neighborhood_response", f"""
+    SELECT
+      COALESCE(neighborhoods_analysis_boundaries, 'Unknown') AS neighborhood,
+      AVG(response_time_sec) AS avg_resp
+    FROM {BASE_CALLS}
+    WHERE {WHERE_CALLS}
+    GROUP BY 1
+    HAVING avg_resp IS NOT NULL
+    ORDER BY avg_resp DESC
+    LIMIT 15
+""")
+
+# Subquery: incidenti distinti dalle CALLS con gli stessi filtri
+CALLS_FILTERED = f"""
+    WITH calls_filtered AS (
+      SELECT DISTINCT
+        incident_number
+      FROM {BASE_CALLS}
+      WHERE {WHERE_CALLS}
+      AND incident_number IS NOT NULL
+    )
+"""
+
+Q_SEVERITY = NamedQuery("incidents_severity", f"""
+    {CALLS_FILTERED}
+    SELECT
+      COUNT(*) AS total_incidents,
+      SUM(COALESCE(i.estimated_property_loss, 0)) AS prop_loss,
+      SUM(COALESCE(i.estimated_contents_loss, 0)) AS cont_loss,
+      SUM(COALESCE(i.fire_injuries, 0)) AS fire_injuries,
+      SUM(COALESCE(i.fire_fatalities, 0)) AS fire_fatalities,
+      SUM(COALESCE(i.civilian_injuries, 0)) AS civ_injuries,
+      SUM(COALESCE(i.civilian_fatalities, 0)) AS civ_fatalities
+    FROM {BASE_INC} i
+    INNER JOIN calls_filtered c
+      ON i.incident_number = c.incident_number
+    WHERE i.incident_date BETWEEN $date_from AND $date_to
+""")
+
+Q_PRIMARY_SITUATION = NamedQuery("incidents_primary_situation", f"""
+    {CALLS_FILTERED}
+    SELECT
+      COALESCE(i.primary_situation, 'Unknown') AS primary_situation,
+      COUNT(*) AS n
+    FROM {BASE_INC} i
+    INNER JOIN calls_filtered c
+      ON i.incident_number = c.incident_number
+    WHERE i.incident_date BETWEEN $date_from AND $date_to
+    GROUP BY 1
+    ORDER BY n DESC
+    LIMIT 15
+""")
+
+Q_LOSS_MONTH = NamedQuery("incidents_loss_month", f"""
+    {CALLS_FILTERED}
+    SELECT
+      date_trunc('month', i.incident_date) AS month,
+      SUM(COALESCE(i.estimated_property_loss, 0) + COALESCE(i.estimated_contents_loss, 0)) AS total_loss
+    FROM {BASE_INC} i
+    INNER JOIN calls_filtered c
+      ON i.incident_number = c.incident_number
+    WHERE i.incident_date BETWEEN $date_from AND $date_to
+    GROUP BY 1
+    ORDER BY 1
+""")
 
 # -----------------------------
 # UI: HEADER
@@ -63,8 +189,9 @@ if not DB_PATH.exists():
 with st.sidebar:
     st.header("Filtri (Calls)")
 
-    dmin = q(f"SELECT min(call_date) AS dmin FROM {BASE_CALLS}")["dmin"][0]
-    dmax = q(f"SELECT max(call_date) AS dmax FROM {BASE_CALLS}")["dmax"][0]
+    opts = q(Q_FILTER_OPTIONS)
+    bounds = opts[opts["filter_name"] == "all"].iloc[0]
+    dmin, dmax = bounds["first_date"], bounds["last_date"]
 
     date_range = st.date_input(
         "Intervallo date (call_date)",
@@ -74,12 +201,7 @@ with st.sidebar:
     )
     date_from, date_to = date_range[0], date_range[1]
 
-    ctg = q(f"""
-        SELECT DISTINCT call_type_group
-        FROM {BASE_CALLS}
-        WHERE call_type_group IS NOT NULL
-        ORDER BY 1
-    """)["call_type_group"].tolist()
+    ctg = opts.loc[opts["filter_name"] == "call_type_group", "value"].tolist()
 
     selected_groups = st.multiselect(
         "Call Type Group",
@@ -87,12 +209,7 @@ with st.sidebar:
         default=ctg[:3] if len(ctg) >= 3 else ctg
     )
 
-    cities = q(f"""
-        SELECT DISTINCT city
-        FROM {BASE_CALLS}
-        WHERE city IS NOT NULL
-        ORDER BY 1
-    """)["city"].tolist()
+    cities = opts.loc[opts["filter_name"] == "city", "value"].tolist()
 
     selected_cities = st.multiselect(
         "City",
@@ -100,12 +217,7 @@ with st.sidebar:
         default=["San Francisco"] if "San Francisco" in cities else []
     )
 
-    battalions = q(f"""
-        SELECT DISTINCT battalion
-        FROM {BASE_CALLS}
-        WHERE battalion IS NOT NULL
-        ORDER BY 1
-    """)["battalion"].tolist()
+    battalions = opts.loc[opts["filter_name"] == "battalion", "value"].tolist()
 
     selected_battalions = st.multiselect(
         "Battalion",
@@ -115,7 +227,7 @@ with st.sidebar:
 
     st.caption("Nota: in Severity (Incidents) applichiamo gli stessi filtri via join su incident_number.")
 
-where_calls = make_where_calls(date_from, date_to, selected_groups, selected_cities, selected_battalions)
+params = make_params_calls(date_from, date_to, selected_groups, selected_cities, selected_battalions)
 
 # -----------------------------
 # TABS
@@ -126,16 +238,7 @@ tab_overview, tab_time, tab_geo, tab_sev = st.tabs(["Overview", "Time", "Geograp
 # TAB: OVERVIEW
 # ============================================================
 with tab_overview:
-    kpi = q(f"""
-        SELECT
-          COUNT(*) AS total_calls,
-          AVG(response_time_sec) AS avg_response_sec,
-          quantile_cont(response_time_sec, 0.5) AS median_response_sec,
-          quantile_cont(response_time_sec, 0.9) AS p90_response_sec,
-          SUM(CASE WHEN response_time_sec IS NULL THEN 1 ELSE 0 END) AS null_response_time
-        FROM {BASE_CALLS}
-        {where_calls}
-    """).iloc[0]
+    kpi = q(Q_KPI, **params).iloc[0]
 
     col1, col2, col3, col4, col5 = st.columns(5)
     col1.metric("Calls", f"{int(kpi['total_calls']):,}")
@@ -145,15 +248,7 @@ with tab_overview:
     col5.metric("Response time NULL", f"{int(kpi['null_response_time']):,}")
 
     with st.expander("Data Quality (calls)"):
-        dq = q(f"""
-            SELECT
-              COUNT(*) AS total,
-              SUM(CASE WHEN response_time_sec IS NULL THEN 1 ELSE 0 END) AS null_resp,
-              SUM(CASE WHEN dispatch_delay_sec IS NULL THEN 1 ELSE 0 END) AS null_dispatch_delay,
-              SUM(CASE WHEN travel_time_sec IS NULL THEN 1 ELSE 0 END) AS null_travel
-            FROM {BASE_CALLS}
-            {where_calls}
-        """).iloc[0]
+        dq = q(Q_DQ, **params).iloc[0]
         pct_null = (dq["null_resp"] / dq["total"] * 100.0) if dq["total"] else 0
         st.write(f"- Records nel filtro: **{int(dq['total']):,}**")
         st.write(f"- Response time NULL: **{int(dq['null_resp']):,}** (**{pct_null:.2f}%**)")
@@ -161,15 +256,7 @@ with tab_overview:
     st.divider()
 
     st.subheader("Volume chiamate nel tempo (mensile)")
-    df_month = q(f"""
-        SELECT
-          date_trunc('month', call_date) AS month,
-          COUNT(*) AS calls
-        FROM {BASE_CALLS}
-        {where_calls}
-        GROUP BY 1
-        ORDER BY 1
-    """)
+    df_month = q(Q_CALLS_MONTH, **params)
 
     fig = plt.figure()
     plt.plot(df_month["month"], df_month["calls"])
@@ -183,13 +270,7 @@ with tab_overview:
 with tab_time:
     st.subheader("Distribuzione response time (campione)")
 
-    df_hist = q(f"""
-        SELECT response_time_sec
-        FROM {BASE_CALLS}
-        {where_calls}
-        AND response_time_sec IS NOT NULL
-        USING SAMPLE 20000
-    """)
+    df_hist = q(Q_RESPONSE_SAMPLE, **params)
 
     fig = plt.figure()
     plt.hist(df_hist["response_time_sec"], bins=60)
@@ -197,16 +278,7 @@ with tab_time:
     st.pyplot(fig)
 
     st.subheader("Response time medio per mese")
-    df_rt_month = q(f"""
-        SELECT
-          date_trunc('month', call_date) AS month,
-          AVG(response_time_sec) AS avg_resp
-        FROM {BASE_CALLS}
-        {where_calls}
-        AND response_time_sec IS NOT NULL
-        GROUP BY 1
-        ORDER BY 1
-    """)
+    df_rt_month = q(Q_RESPONSE_MONTH, **params)
 
     fig2 = plt.figure()
     plt.plot(df_rt_month["month"], df_rt_month["avg_resp"])
@@ -219,15 +291,7 @@ with tab_time:
 # ============================================================
 with tab_geo:
     st.subheader("Top Call Type (15)")
-    df_top = q(f"""
-        SELECT call_type, COUNT(*) AS n
-        FROM {BASE_CALLS}
-        {where_calls}
-        AND call_type IS NOT NULL
-        GROUP BY 1
-        ORDER BY n DESC
-        LIMIT 15
-    """)
+    df_top = q(Q_TOP_CALL_TYPES, **params)
 
     fig = plt.figure()
     plt.barh(df_top["call_type"][::-1], df_top["n"][::-1])
@@ -235,17 +299,7 @@ with tab_geo:
     st.pyplot(fig)
 
     st.subheader("Quartieri con response time medio più alto (Top 15)")
-    df_neigh = q(f"""
-        SELECT
-          COALESCE(neighborhoods_analysis_boundaries, 'Unknown') AS neighborhood,
-          AVG(response_time_sec) AS avg_resp
-        FROM {BASE_CALLS}
-        {where_calls}
-        GROUP BY 1
-        HAVING avg_resp IS NOT NULL
-        ORDER BY avg_resp DESC
-        LIMIT 15
-    """)
+    df_neigh = q(Q_NEIGH_RESPONSE, **params)
 
     fig2 = plt.figure()
     plt.barh(df_neigh["neighborhood"][::-1], df_neigh["avg_resp"][::-1])
@@ -258,28 +312,7 @@ with tab_geo:
 with tab_sev:
     st.subheader("Severity (Incidents) — metriche di danno e vittime")
 
-    # Subquery: incidenti distinti dalle CALLS con gli stessi filtri
-    sev = q(f"""
-        WITH calls_filtered AS (
-          SELECT DISTINCT
-            incident_number
-          FROM {BASE_CALLS}
-          {where_calls}
-          AND incident_number IS NOT NULL
-        )
-        SELECT
-          COUNT(*) AS total_incidents,
-          SUM(COALESCE(i.estimated_property_loss, 0)) AS prop_loss,
-          SUM(COALESCE(i.estimated_contents_loss, 0)) AS cont_loss,
-          SUM(COALESCE(i.fire_injuries, 0)) AS fire_injuries,
-          SUM(COALESCE(i.fire_fatalities, 0)) AS fire_fatalities,
-          SUM(COALESCE(i.civilian_injuries, 0)) AS civ_injuries,
-          SUM(COALESCE(i.civilian_fatalities, 0)) AS civ_fatalities
-        FROM {BASE_INC} i
-        INNER JOIN calls_filtered c
-          ON i.incident_number = c.incident_number
-        WHERE i.incident_date BETWEEN '{date_from}' AND '{date_to}'
-    """).iloc[0]
+    sev = q(Q_SEVERITY, **params).iloc[0]
 
     c1, c2, c3, c4, c5, c6, c7 = st.columns(7)
     c1.metric("Incidents", f"{int(sev['total_incidents']):,}")
@@ -291,25 +324,7 @@ with tab_sev:
     c7.metric("Civilian fatalities", f"{int(sev['civ_fatalities']):,}")
 
     st.subheader("Top Primary Situation (15) — con filtri calls")
-    df_ps = q(f"""
-        WITH calls_filtered AS (
-          SELECT DISTINCT
-            incident_number
-          FROM {BASE_CALLS}
-          {where_calls}
-          AND incident_number IS NOT NULL
-        )
-        SELECT
-          COALESCE(i.primary_situation, 'Unknown') AS primary_situation,
-          COUNT(*) AS n
-        FROM {BASE_INC} i
-        INNER JOIN calls_filtered c
-          ON i.incident_number = c.incident_number
-        WHERE i.incident_date BETWEEN '{date_from}' AND '{date_to}'
-        GROUP BY 1
-        ORDER BY n DESC
-        LIMIT 15
-    """)
+    df_ps = q(Q_PRIMARY_SITUATION, **params)
 
     fig = plt.figure()
     plt.barh(df_ps["primary_situation"][::-1], df_ps["n"][::-1])
@@ -317,24 +332,7 @@ with tab_sev:
     st.pyplot(fig)
 
     st.subheader("Loss nel tempo (mensile) — con filtri calls")
-    df_loss_month = q(f"""
-        WITH calls_filtered AS (
-          SELECT DISTINCT
-            incident_number
-          FROM {BASE_CALLS}
-          {where_calls}
-          AND incident_number IS NOT NULL
-        )
-        SELECT
-          date_trunc('month', i.incident_date) AS month,
-          SUM(COALESCE(i.estimated_property_loss, 0) + COALESCE(i.estimated_contents_loss, 0)) AS total_loss
-        FROM {BASE_INC} i
-        INNER JOIN calls_filtered c
-          ON i.incident_number = c.incident_number
-        WHERE i.incident_date BETWEEN '{date_from}' AND '{date_to}'
-        GROUP BY 1
-        ORDER BY 1
-    """)
+    df_loss_month = q(Q_LOSS_MONTH, **params)
 
     fig2 = plt.figure()
     plt.plot(df_loss_month["month"], df_loss_month["total_loss"])
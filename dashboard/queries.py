@@ -0,0 +1,107 @@
+"""Query con nome e parametri per le dashboard (app.py, mock_up.py).
+
+Ogni NamedQuery è un SQL fisso con parametri nominali ($year, $groups, ...):
+  - sul pool viene preparata una volta per cursor (PREPARE) e poi solo eseguita (EXECUTE),
+    quindi DuckDB non ripianifica lo stesso testo a ogni cambio di filtro;
+  - il risultato è in cache per (query, parametri, versione del warehouse), non per testo SQL.
+
+La versione è max(version) di meta.gold_versions, scritta dalla pipeline dopo il gate gold
+(publish_gold_version): la cache si invalida quando arriva un gold nuovo, non a scadenza fissa.
+Se la tabella manca (DB vecchio) si usa l'mtime del file.
+
+Config (env):
+  DASHBOARD_VERSION_CHECK_SEC  ogni quanti secondi rileggere la versione (default 10)
+  DASHBOARD_QUERY_CACHE_SIZE   risultati massimi in cache per processo (default 512)
+"""
+from __future__ import annotations
+
+import hashlib
+import math
+import numbers
+import os
+from dataclasses import dataclass
+from datetime import date, datetime
+
+import duckdb
+import pandas as pd
+import streamlit as st
+
+from db_pool import get_pool
+
+VERSION_CHECK_SEC = float(os.getenv("DASHBOARD_VERSION_CHECK_SEC", "10"))
+QUERY_CACHE_SIZE = int(os.getenv("DASHBOARD_QUERY_CACHE_SIZE", "512"))
+
+
+@dataclass(frozen=True)
+class NamedQuery:
+    name: str
+    sql: str
+
+    @property
+    def prepared_name(self) -> str:
+        # l'hash del testo evita di riusare un PREPARE vecchio se la query cambia nel codice
+        return f"{self.name}_{hashlib.md5(self.sql.encode('utf-8')).hexdigest()[:8]}"
+
+
+def _sql_literal(value) -> str:
+    """Literal SQL tipizzato per EXECUTE (che non accetta bind "?"): stringhe con escape ' -> ''."""
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, numbers.Integral):
+        return str(int(value))
+    if isinstance(value, numbers.Real):
+        v = float(value)
+        return repr(v) if math.isfinite(v) else ("NULL" if math.isnan(v) else f"'{v}'::DOUBLE")
+    if isinstance(value, datetime):
+        return f"TIMESTAMP '{value.isoformat(sep=' ')}'"
+    if isinstance(value, date):
+        return f"DATE '{value.isoformat()}'"
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    if isinstance(value, (list, tuple)):
+        return "[" + ", ".join(_sql_literal(v) for v in value) + "]"
+    raise TypeError(f"Tipo parametro non supportato: {type(value).__name__}")
+
+
+def _freeze(value):
+    # chiave di cache hashabile e stabile: liste -> tuple
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+@st.cache_data(ttl=VERSION_CHECK_SEC, show_spinner=False)
+def data_version(db_path: str) -> str:
+    """Versione del gold pubblicata dalla pipeline (fallback: mtime del file)."""
+    try:
+        v = get_pool(db_path).query_df("SELECT MAX(version) AS v FROM meta.gold_versions")["v"][0]
+        if not pd.isna(v):
+            return f"gold:{int(v)}"
+    except duckdb.CatalogException:
+        pass
+    return f"mtime:{os.stat(db_path).st_mtime_ns}"
+
+
+@st.cache_data(max_entries=QUERY_CACHE_SIZE, show_spinner=False)
+def _cached_run(db_path: str, prepared_name: str, params: tuple, version: str, _sql: str) -> pd.DataFrame:
+    # version entra solo nella chiave di cache
+    literals = {k: _sql_literal(v) for k, v in params}
+    return get_pool(db_path).execute_prepared(prepared_name, _sql, literals)
+
+
+def run_query(db_path: str, query: NamedQuery, **params) -> pd.DataFrame:
+    """Esegue una NamedQuery con parametri nominali, con cache per (query, parametri, versione)."""
+    frozen = tuple(sorted((k, _freeze(v)) for k, v in params.items()))
+    return _cached_run(db_path, query.prepared_name, frozen, data_version(db_path), query.sql)
+
+
+@st.cache_data(max_entries=QUERY_CACHE_SIZE, show_spinner=False)
+def _cached_sql(db_path: str, sql: str, version: str) -> pd.DataFrame:
+    return get_pool(db_path).query_df(sql)
+
+
+def run_sql(db_path: str, sql: str) -> pd.DataFrame:
+    """SQL libero (es. Text-to-SQL): stessa invalidazione per versione, chiave sul testo."""
+    return _cached_sql(db_path, sql, data_version(db_path))
@@ -1,11 +1,15 @@
 # dashboard/streamlit_cloud.py
+import json
 import os
 from pathlib import Path
 
 import duckdb
-import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import streamlit as st
 
+from db_pool import get_pool
+
 
 # -----------------------------
 # PAGE CONFIG
@@ -26,25 +30,29 @@ ENV_DB = os.getenv("DASHBOARD_DB_PATH")
 DB_PATH = Path(ENV_DB) if ENV_DB else DEFAULT_SERVING
 DB_PATH = DB_PATH.resolve()
 
+# Bundle Parquet (export_dashboard_db): se c'è il manifest si legge da lì, altrimenti dal DB serving
+ENV_BUNDLE = os.getenv("DASHBOARD_BUNDLE_DIR")
+BUNDLE_DIR = (Path(ENV_BUNDLE) if ENV_BUNDLE else PROJECT_ROOT / "dashboard_exports" / "bundle").resolve()
+
 
 # -----------------------------
 # HELPERS
 # -----------------------------
-def _streamlit_safe_df(df: pd.DataFrame) -> pd.DataFrame:
+def _arrow_safe(table: pa.Table) -> pa.Table:
     """
     Streamlit Cloud può crashare con Arrow LargeUtf8 (large_string).
-    Forziamo tutte le colonne testuali a stringhe Python (dtype object).
+    Cast dello schema a livello Arrow (large_string -> string, large_binary -> binary):
+    una conversione per colonna, niente Python per cella; tabella invariata se non serve.
     """
-    if df is None or df.empty:
-        return df
-
-    out = df.copy()
-    for c in out.columns:
-        s = out[c]
-        if pd.api.types.is_string_dtype(s) or s.dtype == "object":
-            # converte in stringhe python (evita LargeUtf8 in Arrow)
-            out[c] = s.map(lambda x: None if pd.isna(x) else str(x))
-    return out
+    fields = []
+    for field in table.schema:
+        if pa.types.is_large_string(field.type):
+            field = field.with_type(pa.string())
+        elif pa.types.is_large_binary(field.type):
+            field = field.with_type(pa.binary())
+        fields.append(field)
+    schema = pa.schema(fields, metadata=table.schema.metadata)
+    return table if schema.equals(table.schema) else table.cast(schema)
 
 
 def _find_schema_for(con: duckdb.DuckDBPyConnection, name: str) -> str | None:
@@ -70,7 +78,7 @@ def _find_schema_for(con: duckdb.DuckDBPyConnection, name: str) -> str | None:
     return schemas[0]
 
 
-def _require_db_and_schema() -> tuple[duckdb.DuckDBPyConnection, str]:
+def _require_db_and_schema() -> str:
     if not DB_PATH.exists():
         st.error(
             f"Non trovo il DB serving.\n"
@@ -80,113 +88,189 @@ def _require_db_and_schema() -> tuple[duckdb.DuckDBPyConnection, str]:
         )
         st.stop()
 
-    con = duckdb.connect(str(DB_PATH), read_only=True)
-    schema_kpi = _find_schema_for(con, "v_kpi_incident_volume_month")
+    with get_pool(str(DB_PATH)).cursor() as con:
+        schema_kpi = _find_schema_for(con, "v_kpi_incident_volume_month")
     if not schema_kpi:
-        con.close()
         st.error(
             "DB non riconosciuto: non trovo v_kpi_*.\n"
             "Soluzione: rigenera dashboard_exports/dashboard.duckdb (export) e riprova."
         )
         st.stop()
-    return con, schema_kpi
+    return schema_kpi
 
 
-@st.cache_data(ttl=60)
-def read_df(sql: str) -> pd.DataFrame:
-    con = duckdb.connect(str(DB_PATH), read_only=True)
+@st.cache_data(ttl=10, show_spinner=False)
+def object_versions() -> dict[str, str]:
+    """content_version per oggetto da meta.dashboard_metadata (export); {} se assente o vecchio formato."""
     try:
-        return con.execute(sql).fetchdf()
-    finally:
-        con.close()
+        meta = get_pool(str(DB_PATH)).query_df(
+            "SELECT object_name, content_version FROM meta.dashboard_metadata"
+        )
+    except duckdb.Error:
+        return {}
+    return dict(zip(meta["object_name"], meta["content_version"]))
+
+
+def data_version(name: str) -> str:
+    """Versione dell'oggetto nel DB serving (fallback: mtime del file)."""
+    return object_versions().get(f"gold.{name}") or f"mtime:{DB_PATH.stat().st_mtime_ns}"
+
+
+@st.cache_resource(max_entries=64, show_spinner=False)
+def read_table(sql: str, version: str) -> pa.Table:
+    """
+    Query sul DB serving -> Arrow già convertito per Streamlit.
+    Una tabella per (sql, versione dei dati): la conversione si fa una volta per export,
+    la tabella (immutabile) è condivisa tra sessioni senza copie.
+    """
+    return _arrow_safe(get_pool(str(DB_PATH)).query_arrow(sql))
+
+
+@st.cache_data(ttl=10, show_spinner=False)
+def load_manifest() -> dict | None:
+    """Manifest corrente del bundle (piccolo, riletto ogni 10s per vedere i nuovi export)."""
+    try:
+        manifest = json.loads((BUNDLE_DIR / "manifest.json").read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    return manifest if (BUNDLE_DIR / manifest["root"]).is_dir() else None
+
+
+@st.cache_resource(max_entries=64, show_spinner=False)
+def read_bundle(root: str, rel_path: str, columns: tuple[str, ...] | None = None, limit: int | None = None) -> pa.Table:
+    """
+    Parquet del bundle (memory-mapped), solo le colonne richieste; limit = solo le prime righe.
+    root (versione del bundle) è nella chiave di cache: niente TTL, un export nuovo cambia root.
+    """
+    path = BUNDLE_DIR / root / rel_path
+    cols = list(columns) if columns else None
+    if limit is None:
+        return _arrow_safe(pq.read_table(path, columns=cols, memory_map=True))
+    pf = pq.ParquetFile(path, memory_map=True)
+    batch = next(pf.iter_batches(batch_size=limit, columns=cols), None)
+    table = pa.Table.from_batches([batch]) if batch is not None else pf.schema_arrow.empty_table()
+    return _arrow_safe(table)
+
+
+def read_bundle_object(manifest: dict, name: str, columns: list[str] | None = None, limit: int | None = None):
+    obj = manifest["objects"].get(f"gold.{name}")
+    if obj is None:
+        return None
+    return read_bundle(manifest["root"], obj["path"], tuple(columns) if columns else None, limit)
 
 
 # -----------------------------
 # UI HEADER
 # -----------------------------
 st.title("San Francisco Fire Dept — KPI Dashboard (Serving)")
-st.caption(f"DB in uso: {DB_PATH}")
+
+MANIFEST = load_manifest()
 
 # -----------------------------
 # LOAD KPI + DIMS
 # -----------------------------
-con, DATA_SCHEMA = _require_db_and_schema()
-con.close()
-
-# KPI
-vol = read_df(
-    f"""
-    SELECT
-      year,
-      month,
-      incident_count
-    FROM {DATA_SCHEMA}.v_kpi_incident_volume_month
-    ORDER BY year, month
-    """
-)
-
-rt = read_df(
-    f"""
-    SELECT
-      year,
-      month,
-      avg_response_time_sec
-    FROM {DATA_SCHEMA}.v_kpi_response_time_month
-    ORDER BY year, month
-    """
-)
-
-# Qui facciamo CAST forte a VARCHAR per evitare LargeUtf8
-top = read_df(
-    f"""
-    SELECT
-      CAST(call_type_group AS VARCHAR) AS call_type_group,
-      CAST(call_type AS VARCHAR) AS call_type,
-      incident_count,
-      avg_response_time_sec
-    FROM {DATA_SCHEMA}.v_kpi_top_incident_type
-    ORDER BY incident_count DESC
-    LIMIT 20
-    """
-)
-
-# metadata (se presente)
-con2 = duckdb.connect(str(DB_PATH), read_only=True)
-try:
-    meta_schema = _find_schema_for(con2, "dashboard_metadata")
-finally:
-    con2.close()
-
-meta = read_df(f"SELECT * FROM {meta_schema}.dashboard_metadata") if meta_schema else None
-
-# dimensioni (se presenti nel serving db)
-con3 = duckdb.connect(str(DB_PATH), read_only=True)
-try:
-    dim_date_schema = _find_schema_for(con3, "dim_date")
-    dim_it_schema = _find_schema_for(con3, "dim_incident_type")
-    dim_loc_schema = _find_schema_for(con3, "dim_location")
-finally:
-    con3.close()
-
-dim_date = read_df(f"SELECT * FROM {dim_date_schema}.dim_date") if dim_date_schema else None
-dim_it = read_df(f"SELECT * FROM {dim_it_schema}.dim_incident_type") if dim_it_schema else None
-dim_loc = read_df(f"SELECT * FROM {dim_loc_schema}.dim_location") if dim_loc_schema else None
-
-# Safe conversion (anti LargeUtf8)
-vol = _streamlit_safe_df(vol)
-rt = _streamlit_safe_df(rt)
-top = _streamlit_safe_df(top)
-meta = _streamlit_safe_df(meta) if meta is not None else None
-dim_date = _streamlit_safe_df(dim_date) if dim_date is not None else None
-dim_it = _streamlit_safe_df(dim_it) if dim_it is not None else None
-dim_loc = _streamlit_safe_df(dim_loc) if dim_loc is not None else None
+if MANIFEST is not None:
+    st.caption(f"Bundle in uso: {BUNDLE_DIR / MANIFEST['root']}")
+
+    # solo le colonne usate dalla pagina; dimensioni limitate all'anteprima
+    by_month = [("year", "ascending"), ("month", "ascending")]
+    vol = read_bundle_object(MANIFEST, "v_kpi_incident_volume_month", ["year", "month", "incident_count"])
+    vol = vol.sort_by(by_month)
+
+    rt = read_bundle_object(MANIFEST, "v_kpi_response_time_month", ["year", "month", "avg_response_time_sec"])
+    rt = rt.sort_by(by_month)
+
+    top = read_bundle_object(
+        MANIFEST,
+        "v_kpi_top_incident_type",
+        ["call_type_group", "call_type", "incident_count", "avg_response_time_sec"],
+    )
+    top = top.sort_by([("incident_count", "descending")]).slice(0, 20)
+
+    exported_at = MANIFEST["created_at"]
+
+    dim_date = read_bundle_object(MANIFEST, "dim_date", limit=200)
+    dim_it = read_bundle_object(MANIFEST, "dim_incident_type", limit=200)
+    dim_loc = read_bundle_object(MANIFEST, "dim_location", limit=200)
+else:
+    st.caption(f"DB in uso: {DB_PATH}")
+    DATA_SCHEMA = _require_db_and_schema()
+
+    # KPI
+    vol = read_table(
+        f"""
+        SELECT
+          year,
+          month,
+          incident_count
+        FROM {DATA_SCHEMA}.v_kpi_incident_volume_month
+        ORDER BY year, month
+        """,
+        data_version("v_kpi_incident_volume_month"),
+    )
+
+    rt = read_table(
+        f"""
+        SELECT
+          year,
+          month,
+          avg_response_time_sec
+        FROM {DATA_SCHEMA}.v_kpi_response_time_month
+        ORDER BY year, month
+        """,
+        data_version("v_kpi_response_time_month"),
+    )
+
+    top = read_table(
+        f"""
+        SELECT
+          call_type_group,
+          call_type,
+          incident_count,
+          avg_response_time_sec
+        FROM {DATA_SCHEMA}.v_kpi_top_incident_type
+        ORDER BY incident_count DESC
+        LIMIT 20
+        """,
+        data_version("v_kpi_top_incident_type"),
+    )
+
+    # metadata (se presente)
+    with get_pool(str(DB_PATH)).cursor() as con:
+        meta_schema = _find_schema_for(con, "dashboard_metadata")
+
+    exported_at = None
+    if meta_schema:
+        # una riga per oggetto esportato: l'ultima copia è l'export più recente
+        exported_at = get_pool(str(DB_PATH)).query_df(
+            f"SELECT MAX(exported_at) AS exported_at FROM {meta_schema}.dashboard_metadata"
+        )["exported_at"][0]
+
+    # dimensioni (se presenti nel serving db)
+    with get_pool(str(DB_PATH)).cursor() as con:
+        dim_date_schema = _find_schema_for(con, "dim_date")
+        dim_it_schema = _find_schema_for(con, "dim_incident_type")
+        dim_loc_schema = _find_schema_for(con, "dim_location")
+
+    dim_date = (
+        read_table(f"SELECT * FROM {dim_date_schema}.dim_date", data_version("dim_date"))
+        if dim_date_schema else None
+    )
+    dim_it = (
+        read_table(f"SELECT * FROM {dim_it_schema}.dim_incident_type", data_version("dim_incident_type"))
+        if dim_it_schema else None
+    )
+    dim_loc = (
+        read_table(f"SELECT * FROM {dim_loc_schema}.dim_location", data_version("dim_location"))
+        if dim_loc_schema else None
+    )
 
 
 # -----------------------------
 # RENDER
 # -----------------------------
-if meta is not None and not meta.empty and "exported_at_utc" in meta.columns:
-    st.caption(f"Exported at (UTC): {meta.loc[0, 'exported_at_utc']}")
+if exported_at is not None:
+    st.caption(f"Exported at (UTC): {exported_at}")
 
 c1, c2 = st.columns(2)
 
@@ -204,12 +288,22 @@ st.dataframe(top, use_container_width=True)
 with st.expander("🔎 Dimensioni (opzionale)"):
     if dim_date is not None:
         st.write("dim_date (preview)")
-        st.dataframe(dim_date.head(200), use_container_width=True)
+        st.dataframe(dim_date.slice(0, 200), use_container_width=True)
     if dim_it is not None:
         st.write("dim_incident_type (preview)")
-        st.dataframe(dim_it.head(200), use_container_width=True)
+        st.dataframe(dim_it.slice(0, 200), use_container_width=True)
     if dim_loc is not None:
         st.write("dim_location (preview)")
-        st.dataframe(dim_loc.head(200), use_container_width=True)
+        st.dataframe(dim_loc.slice(0, 200), use_container_width=True)
+
+fact_slice = MANIFEST.get("fact_slice") if MANIFEST is not None else None
+if fact_slice:
+    with st.expander("🔬 Drill-down incidenti (ultimi mesi, dal bundle)"):
+        # si legge solo la partizione year/month scelta
+        labels = {f"{p['year']}-{p['month']:02d}": p["path"] for p in fact_slice["months"]}
+        month_sel = st.selectbox("Mese", options=list(labels)[::-1])
+        drill = read_bundle(MANIFEST["root"], labels[month_sel])
+        st.write(f"Incidenti nel mese: {drill.num_rows:,}")
+        st.dataframe(drill.slice(0, 1000), use_container_width=True)
 
 st.caption("Modalità SERVING: usa solo KPI aggregati + dimensioni esportate (cloud-friendly).")
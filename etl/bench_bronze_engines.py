@@ -0,0 +1,123 @@
+"""Benchmark ingest_bronze: engine polars vs duckdb sul CSV calls (Phase 1).
+
+Ogni engine gira in un sottoprocesso separato con un warehouse temporaneo, così il
+picco di RSS misurato è solo quello dell'ingestione (niente cache del processo padre).
+Alla fine confronta righe e schema (colonne + tipi) tra gli engine: exit code 1 se divergono.
+
+Uso (dalla root del repo):
+    python -m etl.bench_bronze_engines
+    python -m etl.bench_bronze_engines --csv data/raw/Fire_Department_Calls_for_Service.csv --repeat 3
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+CALLS_CSV = "data/raw/Fire_Department_Calls_for_Service.csv"
+
+# stessi override di main_flow (etl/flows/run_pipeline.py) per il CSV calls
+CALLS_OVERRIDE_COLS = ["Box", "Battalion", "Station Area", "Supervisor District", "Fire Prevention District"]
+
+
+def _peak_rss_mb() -> float | None:
+    try:
+        import resource
+    except ImportError:  # Windows
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / 1024 / 1024
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux: KB, macOS: byte
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def _child(engine: str, csv_path: str) -> None:
+    # import qui: WAREHOUSE_DB_PATH è già impostato dal padre prima di etl.utils
+    import polars as pl
+
+    from etl.tasks.bronze import ingest_bronze
+    from etl.utils import get_db_connection
+
+    overrides = {c: pl.Utf8 for c in CALLS_OVERRIDE_COLS}
+    t0 = time.perf_counter()
+    rows = ingest_bronze(source_path=csv_path, table_name="calls", schema_overrides=overrides, engine=engine)
+    wall = time.perf_counter() - t0
+    peak = _peak_rss_mb()
+
+    with get_db_connection(read_only=True) as con:
+        table_rows = con.execute("SELECT COUNT(*) FROM bronze.calls").fetchone()[0]
+        schema = [[r[0], r[1]] for r in con.execute("DESCRIBE bronze.calls").fetchall()]
+    print(json.dumps({
+        "engine": engine, "rows": rows, "table_rows": table_rows, "schema": schema,
+        "wall_s": wall, "peak_rss_mb": peak,
+    }))
+
+
+def _run(engine: str, csv_path: str) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            **os.environ,
+            "WAREHOUSE_DB_PATH": str(Path(tmp) / "bench.duckdb"),
+            "PREFECT_LOGGING_LEVEL": "WARNING",
+        }
+        out = subprocess.run(
+            [sys.executable, "-m", "etl.bench_bronze_engines", "--child", engine, "--csv", csv_path],
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    # ultima riga JSON: prefect può scrivere altro su stdout
+    return json.loads([line for line in out.stdout.splitlines() if line.startswith("{")][-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--csv", default=CALLS_CSV)
+    parser.add_argument("--engines", nargs="+", default=["polars", "duckdb"])
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _child(args.child, args.csv)
+        return
+
+    size_mb = Path(args.csv).stat().st_size / 1024 / 1024
+    print(f"CSV: {args.csv} ({size_mb:,.0f} MB)")
+    print(f"{'engine':<8} {'run':>3} {'rows':>12} {'wall_s':>8} {'peak_rss_mb':>12}")
+    results = {}
+    for engine in args.engines:
+        for i in range(args.repeat):
+            r = _run(engine, args.csv)
+            results[engine] = r
+            rss = f"{r['peak_rss_mb']:,.0f}" if r["peak_rss_mb"] is not None else "n/a"
+            print(f"{engine:<8} {i + 1:>3} {r['rows']:>12,} {r['wall_s']:>8.2f} {rss:>12}")
+
+    # parità tra engine: stesse righe (nessuna riga persa da un engine) e stesso schema bronze
+    ref_engine, ref = next(iter(results.items()))
+    ok = True
+    for engine, r in results.items():
+        if r["table_rows"] != ref["table_rows"]:
+            ok = False
+            print(f"PARITY KO: righe {engine}={r['table_rows']:,} vs {ref_engine}={ref['table_rows']:,}")
+        if r["schema"] != ref["schema"]:
+            ok = False
+            diff = [(a, b) for a, b in zip(r["schema"], ref["schema"]) if a != b]
+            print(f"PARITY KO: schema {engine} vs {ref_engine}: {diff or 'numero colonne diverso'}")
+    if len(results) > 1:
+        print("PARITY OK" if ok else "PARITY KO")
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,9 +4,10 @@ import polars as pl
 from tasks.bronze import ingest_bronze
 from tasks.silver import clean_silver
 from test.gate import validate_silver_quality
-from tasks.gold import build_dim_date, build_dim_incident_type, build_dim_location, build_fact_incident
+from tasks.gold import build_gold_staging, build_gold_dimensions, build_fact_incident, drop_gold_staging
 from test.gate_gold import validate_gold_quality
-from tasks.kpi_gold_view import create_kpi_views
+from tasks.kpi_gold_view import build_kpi_cube, build_filter_options, create_kpi_views
+from tasks.ingestion_meta import publish_gold_version
 
 
 
@@ -26,19 +27,20 @@ def main_flow():
         "Fire Prevention District": pl.Utf8,
     }
 
-    # 1) Bronze - Calls
-    ingest_bronze(
+    # 1-2) Bronze - Calls + Incidents in parallelo: il parsing CSV (CPU) si sovrappone,
+    # le scritture sul warehouse sono serializzate dentro ingest_bronze
+    calls_future = ingest_bronze.submit(
         source_path=CALLS_CSV,
         table_name="calls",
         schema_overrides=calls_overrides
     )
-
-    # 2) Bronze - Incidents 
-    ingest_bronze(
+    incidents_future = ingest_bronze.submit(
         source_path=INCIDENTS_CSV,
         table_name="incidents",
         schema_overrides=None
     )
+    calls_future.result()
+    incidents_future.result()
 
     # 3) Silver - Cleaning
     clean_silver()
@@ -47,19 +49,22 @@ def main_flow():
     validate_silver_quality(sample_n=200_000)
       
 
-    # 5) GOLD - dims
-    build_dim_date()
-    build_dim_incident_type()
-    build_dim_location()
-    
+    # 5) GOLD - staging (join silver una volta sola) + dims (una sessione, una transazione)
+    build_gold_staging()
+    build_gold_dimensions()
+
     # 6) GOLD - fact
     build_fact_incident()
+    drop_gold_staging()
 
-    # 7) GOLD - KPI views
+    # 7) GOLD - KPI cube + opzioni filtri dashboard + views sopra il cube
+    build_kpi_cube()
+    build_filter_options()
     create_kpi_views()
 
     # 8) GOLD - quality gate
     validate_gold_quality()
+    publish_gold_version(note="phase1")
 
     print("Pipeline completata con successo.")
  
@@ -1,18 +1,20 @@
 from prefect import flow
 
-from etl.tasks.ingestion_meta import detect_and_log_client_drop
-from etl.tasks.Lake_writer import write_pending_to_lake
+from etl.utils import shared_db_connection
+
+from etl.tasks.ingestion_meta import detect_and_log_client_drop, publish_gold_version
+from etl.tasks.Lake_writer import LAKE_COMPACTION_ENABLED, compact_lake, write_pending_to_lake
 from etl.tasks.bronze_schedule import ingest_bronze_incremental
-from etl.tasks.silver_phase_2 import clean_silver_phase2
+from etl.tasks.silver_phase_2 import clean_silver_phase2, clear_silver_delta_keys
 from etl.test.gate import validate_silver_quality
 
 from etl.tasks.gold import (
-    build_dim_date,
-    build_dim_incident_type,
-    build_dim_location,
     build_fact_incident,
+    build_gold_dimensions,
+    build_gold_staging,
+    drop_gold_staging,
 )
-from etl.tasks.kpi_gold_view import create_kpi_views
+from etl.tasks.kpi_gold_view import build_kpi_cube, build_filter_options, create_kpi_views
 from etl.test.gate_gold import validate_gold_quality
 
 from etl.tasks.dashboard_export import export_dashboard_db
@@ -20,47 +22,62 @@ from etl.tasks.dashboard_export import export_dashboard_db
 
 @flow(name="San Francisco Fire Dept Pipeline - PHASE 2", log_prints=True)
 def phase2_flow():
-    # STEP1: detect + log
-    info = detect_and_log_client_drop()
-    run_id = info["run_id"]
-
-    # Se non ci sono file PENDING già a monte, no-op completo
-    if info.get("pending", 0) == 0:
-        print("Nessun nuovo contenuto (PENDING=0): no-op.")
-        return info
-
-    # STEP2: lake write (skippa se parquet esiste)
-    write_pending_to_lake(run_id=run_id)
-
-    # STEP3: bronze ingest incrementale (idempotente)
-    bronze_res = ingest_bronze_incremental(run_id=run_id)
-
-    inserted_calls = int(bronze_res.get("inserted_calls", 0))
-    inserted_incidents = int(bronze_res.get("inserted_incidents", 0))
-    inserted_total = inserted_calls + inserted_incidents
-
-    print(
-        f"Bronze summary | inserted_calls={inserted_calls} "
-        f"inserted_incidents={inserted_incidents} inserted_total={inserted_total}"
-    )
-
-    # Se non è entrato nulla di nuovo in bronze, non ha senso rifare silver+gold
-    if inserted_total == 0:
-        print("Nessun nuovo dato inserito in BRONZE: skip SILVER + GOLD (no-op veloce).")
-        return {**info, **bronze_res, "skipped_downstream": True}
-
-    # STEP4: silver + gate
-    clean_silver_phase2()
-    validate_silver_quality()
-
-    # STEP5: gold + views + gate
-    build_dim_date()
-    build_dim_incident_type()
-    build_dim_location()
-    build_fact_incident()
-
-    create_kpi_views()
-    validate_gold_quality()
+    # una sola connessione al warehouse per gli step 1-5 (export escluso: fa ATTACH del file)
+    with shared_db_connection():
+        # STEP1: detect + log
+        info = detect_and_log_client_drop()
+        run_id = info["run_id"]
+
+        # Se non ci sono file PENDING già a monte, no-op completo
+        if info.get("pending", 0) == 0:
+            print("Nessun nuovo contenuto (PENDING=0): no-op.")
+            return info
+
+        # STEP2: lake write (skippa se parquet esiste)
+        write_pending_to_lake(run_id=run_id)
+
+        # STEP3: bronze ingest incrementale (idempotente)
+        bronze_res = ingest_bronze_incremental(run_id=run_id)
+
+        inserted_calls = int(bronze_res.get("inserted_calls", 0))
+        inserted_incidents = int(bronze_res.get("inserted_incidents", 0))
+        inserted_total = inserted_calls + inserted_incidents
+
+        print(
+            f"Bronze summary | inserted_calls={inserted_calls} "
+            f"inserted_incidents={inserted_incidents} inserted_total={inserted_total}"
+        )
+
+        # Nessun file DONE nella run => niente da rileggere per silver+gold. Non basta
+        # inserted_total == 0: un file rimasto PENDING da una run fallita ha già le righe in
+        # bronze (inserted_now=0) ma le sue chiavi arrivano al silver solo con questa run.
+        if int(bronze_res.get("done_files", 0)) == 0:
+            print("Nessun file DONE in BRONZE: skip SILVER + GOLD (no-op veloce).")
+            return {**info, **bronze_res, "skipped_downstream": True}
+
+        # STEP4: silver (incrementale sulle chiavi della run) + gate
+        clean_silver_phase2(run_id=run_id)
+        validate_silver_quality()
+
+        # STEP5: gold (incrementale sulle chiavi delta) + views + gate
+        build_gold_staging(incremental=True)
+        build_gold_dimensions(incremental=True)
+        build_fact_incident(incremental=True)
+        drop_gold_staging()
+
+        build_kpi_cube(incremental=True)
+        build_filter_options()
+        create_kpi_views()
+        validate_gold_quality()
+        # nuova versione gold: la dashboard invalida la cache dei risultati
+        publish_gold_version(note=f"phase2 run {run_id}")
+
+        # chiavi delta consumate da tutto il gold
+        clear_silver_delta_keys()
+
+        # STEP5b (opzionale): compaction dei parquet piccoli del lake
+        if LAKE_COMPACTION_ENABLED:
+            compact_lake()
 
     # STEP6: export serving DB per pubblicazione Streamlit Cloud
     export_dashboard_db(output_path="dashboard_exports/dashboard.duckdb")
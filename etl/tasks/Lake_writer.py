@@ -1,15 +1,54 @@
 import os
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 from datetime import datetime, timezone
 
+import duckdb
 import polars as pl
 from prefect import task, get_run_logger
 
-from etl.utils import get_db_connection, Schemas, sanitize_columns
+from etl.utils import PHASE2_MAX_WORKERS, sanitize_columns
+from etl.tasks.bronze_schedule import BRONZE_MODE, refresh_lake_bronze_views
+from etl.tasks.ingestion_meta import MetaRepository
+from etl.tasks.lake_schema import typed_projection
+from etl.tasks.silver_sql import parse_date_sql, parse_ts_sql
 
 # Root del Data Lake (open-source file-based + parquet colonnare)
 LAKE_ROOT_DIR = os.getenv("LAKE_ROOT_DIR", "data/Data_Lake")
 
+# Writer parquet (DuckDB COPY in streaming): memoria limitata dal memory_limit,
+# non dalla dimensione del CSV. Parametri parquet configurabili da env.
+LAKE_PARQUET_COMPRESSION = os.getenv("LAKE_PARQUET_COMPRESSION", "zstd")
+LAKE_PARQUET_COMPRESSION_LEVEL = os.getenv("LAKE_PARQUET_COMPRESSION_LEVEL")  # None = default del codec
+LAKE_PARQUET_ROW_GROUP_SIZE = int(os.getenv("LAKE_PARQUET_ROW_GROUP_SIZE", "122880"))
+LAKE_PARQUET_DICTIONARY_SIZE_LIMIT = os.getenv("LAKE_PARQUET_DICTIONARY_SIZE_LIMIT")  # None = default DuckDB
+LAKE_WRITER_MEMORY_LIMIT = os.getenv("LAKE_WRITER_MEMORY_LIMIT", "1GB")
+
+# Parquet tipizzato secondo lake_schema.LAKE_SCHEMAS (0 = tutte le colonne dati VARCHAR)
+LAKE_TYPED = os.getenv("LAKE_TYPED", "1") == "1"
+
+# Layout del lake:
+# - ingest_date (default): <dataset>/ingest_date=YYYY-MM-DD/sha256=<sha>/data.parquet (un file per drop)
+#                          compattati in <dataset>/ingest_date=YYYY-MM-DD/compacted_<id>.parquet;
+#                          letto senza hive_partitioning (il lineage è nelle colonne _source_*)
+# - event_month:           <dataset>/event_year=YYYY/event_month=M/<sha>_<i>.parquet (hive, per mese evento)
+LAKE_LAYOUT = os.getenv("LAKE_LAYOUT", "ingest_date")
+LAKE_LAYOUTS = ("ingest_date", "event_month")
+
+# Compaction (opzionale, PHASE2_LAKE_COMPACTION=1 nel flow): i file piccoli di una stessa
+# partizione vengono fusi in file fino a LAKE_COMPACT_TARGET_MB
+LAKE_COMPACTION_ENABLED = os.getenv("PHASE2_LAKE_COMPACTION", "0") == "1"
+LAKE_COMPACT_TARGET_MB = int(os.getenv("LAKE_COMPACT_TARGET_MB", "256"))
+
+# colonna evento (già sanitizzata) da cui derivare anno/mese, per dataset
+_EVENT_COLS = {
+    "fire_calls": (("received_dt_tm", "received_dttm"), parse_ts_sql),
+    "fire_incidents": (("incident_date",), parse_date_sql),
+}
+
 
 def _utcnow_naive() -> datetime:
     return datetime.now(timezone.utc).replace(tzinfo=None)
@@ -21,7 +60,7 @@ def _today_utc_str() -> str:
 
 def _read_header_sanitized(csv_path: str) -> list[str]:
     # leggiamo solo header per non caricare file intero
-    df0 = pl.read_csv(csv_path, n_rows=0)
+    df0 = pl.read_csv(csv_path, n_rows=0, truncate_ragged_lines=True)
     return sanitize_columns(df0.columns)
 
 
@@ -57,35 +96,242 @@ def _detect_dataset_type(cols: list[str], file_path: str = "") -> str:
     return "fire_incidents"
 
 
-def _load_csv_polars(csv_path: str) -> pl.DataFrame:
+def _sql_str(value: str) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _parquet_copy_options() -> str:
+    opts = [
+        "FORMAT parquet",
+        f"COMPRESSION {LAKE_PARQUET_COMPRESSION}",
+        f"ROW_GROUP_SIZE {LAKE_PARQUET_ROW_GROUP_SIZE}",
+    ]
+    if LAKE_PARQUET_COMPRESSION_LEVEL:
+        opts.append(f"COMPRESSION_LEVEL {int(LAKE_PARQUET_COMPRESSION_LEVEL)}")
+    if LAKE_PARQUET_DICTIONARY_SIZE_LIMIT:
+        opts.append(f"DICTIONARY_SIZE_LIMIT {int(LAKE_PARQUET_DICTIONARY_SIZE_LIMIT)}")
+    return ", ".join(opts)
+
+
+# righe scartate da read_csv (tabelle temp della connessione del writer, svuotate prima della COPY)
+_REJECTS_TABLE = "_lake_csv_rejects"
+_REJECTS_SCAN = "_lake_csv_rejects_scan"
+
+
+def _csv_relation(csv_path: str) -> str:
+    # strict_mode=false: righe con campi in più troncate e tenute (come truncate_ragged_lines di
+    # polars), niente colonna fantasma; le righe davvero illeggibili finiscono in _REJECTS_TABLE
+    return (
+        f"read_csv({_sql_str(csv_path)}, all_varchar=true, header=true, "
+        "nullstr=['None', 'NULL', ''], strict_mode=false, store_rejects=true, "
+        f"rejects_table={_sql_str(_REJECTS_TABLE)}, rejects_scan={_sql_str(_REJECTS_SCAN)})"
+    )
+
+
+def _reset_csv_rejects(con) -> None:
+    # il campionamento dei tipi (typed_projection) legge già il CSV: conta solo la COPY
+    con.execute(f"DROP TABLE IF EXISTS temp.{_REJECTS_TABLE}")
+    con.execute(f"DROP TABLE IF EXISTS temp.{_REJECTS_SCAN}")
+
+
+def _csv_rejects(con) -> tuple[int, list]:
+    """(righe scartate, prime 5 come (line, error_type, error_message)) dell'ultima lettura."""
+    if not con.execute(
+        "SELECT 1 FROM duckdb_tables() WHERE temporary AND table_name = ?", [_REJECTS_TABLE]
+    ).fetchone():
+        return 0, []
+    # una riga scartata può avere più errori (es. MISSING COLUMNS per ogni colonna mancante)
+    n = con.execute(f"SELECT COUNT(DISTINCT line) FROM temp.{_REJECTS_TABLE}").fetchone()[0]
+    sample = con.execute(
+        f"""
+        SELECT line, error_type, error_message
+        FROM temp.{_REJECTS_TABLE}
+        QUALIFY row_number() OVER (PARTITION BY line ORDER BY column_idx) = 1
+        ORDER BY line
+        LIMIT 5
+        """
+    ).fetchall()
+    return int(n), sample
+
+
+@contextmanager
+def _writer_connection(threads: int):
+    """Connessione DuckDB in-memory dedicata al writer: non tiene lock sul warehouse."""
+    con = duckdb.connect()
+    try:
+        con.execute(f"PRAGMA memory_limit='{LAKE_WRITER_MEMORY_LIMIT}'")
+        con.execute(f"PRAGMA threads={int(threads)}")
+        con.execute("PRAGMA temp_directory='data/tmp_duckdb'")
+        con.execute("PRAGMA preserve_insertion_order=true")  # row number = ordine nel file
+        con.execute("PRAGMA disable_progress_bar")
+        yield con
+    finally:
+        con.close()
+
+
+def _csv_select_sql(con, csv_path: str, file_sha256: str, dataset: str) -> tuple[str, list[str], dict[str, str]]:
+    """
+    SELECT streaming del CSV: colonne sanitizzate (tipizzate se LAKE_TYPED) + colonne audit.
+    Ritorna (sql, colonne sanitizzate, {colonna: tipo} delle colonne tipizzate).
+    """
+    rel = _csv_relation(csv_path)
+    src_cols = [r[0] for r in con.execute(f"DESCRIBE SELECT * FROM {rel}").fetchall()]
+    new_cols = sanitize_columns(src_cols)
+    select_src = ",\n".join(f'"{c}" AS "{new}"' for c, new in zip(src_cols, new_cols))
+    raw_sql = f"""
+      SELECT
+        CAST(row_number() OVER () - 1 AS BIGINT) AS _source_row_number,
+        {select_src}
+      FROM {rel}
     """
-    Carica CSV in Polars:
-    - legge header
-    - forza tutte le colonne a Utf8 già in parsing
-    - sanitize colonne
-    - collect streaming
+    types: dict[str, str] = {}
+    if LAKE_TYPED:
+        raw_sql, types = typed_projection(
+            con,
+            f"({raw_sql})",
+            dataset,
+            ["_source_row_number", *new_cols],
+            sample_relation=f"(SELECT {select_src} FROM {rel})",
+        )
+
+    sql = f"""
+      SELECT
+        *,
+        CAST({_sql_str(file_sha256)} AS VARCHAR) AS _source_sha256,
+        CAST({_sql_str(csv_path)} AS VARCHAR) AS _source_file_path,
+        CAST({_sql_str(_utcnow_naive())} AS TIMESTAMP) AS _lake_written_at_utc
+      FROM ({raw_sql})
     """
-    df0 = pl.read_csv(csv_path, n_rows=0)
-    old_cols = df0.columns
+    return sql, new_cols, types
 
-    schema_overrides = {c: pl.Utf8 for c in old_cols}
 
-    lazy_df = pl.scan_csv(
-        csv_path,
-        infer_schema_length=10000,
-        schema_overrides=schema_overrides,
-        null_values=["None", "NULL", ""],
-        ignore_errors=True,
-        truncate_ragged_lines=True,
-    )
+def _csv_to_parquet_streaming(
+    csv_path: str, target: Path, dataset: str, file_sha256: str, threads: int = 4
+) -> tuple[int, list]:
+    """
+    CSV -> Parquet con DuckDB COPY (pipeline streaming, niente DataFrame in memoria):
+    - lettura tutta VARCHAR, poi tipi del registry lake_schema (cast non stretti + _rejects)
+    - colonne sanitizzate + colonne audit (_source_row_number BIGINT, sha, path, written_at)
+    - scrittura su file temporaneo e os.replace: mai un parquet parziale sul path definitivo
+    Ritorna le righe scartate da read_csv (vedi _csv_rejects).
+    """
+    tmp = target.with_name(target.name + ".tmp")
+    try:
+        with _writer_connection(threads) as con:
+            select_sql, _, _ = _csv_select_sql(con, csv_path, file_sha256, dataset)
+            _reset_csv_rejects(con)
+            con.execute(f"COPY ({select_sql}) TO {_sql_str(tmp)} ({_parquet_copy_options()})")
+            rejects = _csv_rejects(con)
+        os.replace(tmp, target)
+        return rejects
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+
+def _layout_glob(dataset: str, layout: str, name: str = "*.parquet") -> str:
+    # file di un dataset in un layout (name per restringere, es. "<sha>_*.parquet");
+    # ingest_date: "**" prende sia i file per drop (sha256=<sha>/) sia i compattati (un livello sopra)
+    parts = ("event_year=*", "event_month=*") if layout == "event_month" else ("ingest_date=*", "**")
+    return str(Path(LAKE_ROOT_DIR, dataset, *parts, name))
+
+
+def _lake_path_for(dataset: str, layout: str, file_sha256: str, files: list) -> str:
+    """
+    lake_path di uno sha in meta.ingestion_log:
+    - un solo file -> il file
+    - più file tutti dello sha (<sha>_<i>.parquet) -> glob dello sha
+    - sha sparso in file compattati -> glob del dataset (i reader filtrano per _source_sha256)
+    """
+    if len(files) == 1:
+        return str(files[0])
+    if all(Path(f).name.startswith(f"{file_sha256}_") for f in files):
+        return _layout_glob(dataset, layout, f"{file_sha256}_*.parquet")
+    return _layout_glob(dataset, layout)
 
-    new_cols = sanitize_columns(old_cols)
-    rename_map = dict(zip(old_cols, new_cols))
-    lazy_df = lazy_df.rename(rename_map)
 
-    df = lazy_df.collect(streaming=True)
-    df = df.with_columns([pl.all().cast(pl.Utf8)])
-    return df
+def _csv_to_parquet_event_month(
+    csv_path: str, dataset: str, file_sha256: str, threads: int = 4
+) -> tuple[list[Path], tuple[int, list]]:
+    """
+    CSV -> Parquet partizionato hive per anno/mese evento (COPY ... PARTITION_BY):
+    - righe con data non parsabile in event_year=0/event_month=0
+    - scrittura in staging (_staging/<sha>) poi os.replace file per file nelle partizioni finali;
+      eventuali file residui dello stesso sha (run interrotta) vengono rimossi prima
+    Ritorna (path finali scritti, righe scartate da read_csv).
+    """
+    root = Path(LAKE_ROOT_DIR)
+    staging = root / "_staging" / dataset / file_sha256
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.parent.mkdir(parents=True, exist_ok=True)
+    for old in root.glob(f"{dataset}/event_year=*/event_month=*/{file_sha256}_*.parquet"):
+        old.unlink()
+
+    candidates, parse_sql = _EVENT_COLS[dataset]
+    try:
+        with _writer_connection(threads) as con:
+            select_sql, cols, types = _csv_select_sql(con, csv_path, file_sha256, dataset)
+            event_col = next((c for c in candidates if c in cols), None)
+            event_expr = (
+                parse_sql(event_col, col_type=types.get(event_col)) if event_col else "CAST(NULL AS TIMESTAMP)"
+            )
+            _reset_csv_rejects(con)
+            con.execute(
+                f"""
+                COPY (
+                  SELECT
+                    * EXCLUDE (_event_ts),
+                    COALESCE(year(_event_ts), 0) AS event_year,
+                    COALESCE(month(_event_ts), 0) AS event_month
+                  FROM (
+                    SELECT *, {event_expr} AS _event_ts
+                    FROM ({select_sql})
+                  )
+                ) TO {_sql_str(staging)} (
+                  {_parquet_copy_options()},
+                  PARTITION_BY (event_year, event_month),
+                  FILENAME_PATTERN '{file_sha256}_{{i}}'
+                )
+                """
+            )
+            rejects = _csv_rejects(con)
+
+        written = []
+        for f in sorted(staging.rglob("*.parquet")):
+            final = root / dataset / f.relative_to(staging)
+            final.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(f, final)
+            written.append(final)
+        return written, rejects
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def _manifest_entries(files: list[Path], file_sha256: str, dataset: str, layout: str) -> list[tuple]:
+    """Righe per meta.lake_files: righe per file dal footer parquet (niente scan dei dati)."""
+    if not files:
+        return []
+    con = duckdb.connect()
+    try:
+        counts = dict(
+            con.execute(
+                "SELECT file_name, num_rows FROM parquet_file_metadata(?)",
+                [[str(f) for f in files]],
+            ).fetchall()
+        )
+    finally:
+        con.close()
+
+    entries = []
+    for f in files:
+        year = month = None
+        if layout == "event_month":
+            year = int(f.parent.parent.name.split("=", 1)[1])
+            month = int(f.parent.name.split("=", 1)[1])
+        entries.append(
+            (str(f), file_sha256, dataset, layout, year, month, int(counts[str(f)]), f.stat().st_size)
+        )
+    return entries
 
 
 def _lake_target_path(dataset: str, ingest_date: str, file_sha256: str) -> Path:
@@ -99,93 +345,283 @@ def _lake_target_path(dataset: str, ingest_date: str, file_sha256: str) -> Path:
     )
 
 
+def _write_one(csv_path: str, file_sha256: str, ingest_date: str, threads: int, lake_files: list) -> dict:
+    """Un file PENDING -> parquet nel lake (eseguito nel pool). Ritorna l'esito per l'update batch."""
+    # detect dataset (merged-safe)
+    cols = _read_header_sanitized(csv_path)
+    dataset = _detect_dataset_type(cols, csv_path)
+    res = {"sha": file_sha256, "dataset": dataset, "written": False, "manifest": [], "rejects": (0, [])}
+
+    # SKIP se lo sha è già nel manifest per questo layout (anche se nel frattempo compattato)
+    if lake_files:
+        res["target"] = _lake_path_for(dataset, LAKE_LAYOUT, file_sha256, lake_files)
+        return res
+
+    if LAKE_LAYOUT == "event_month":
+        files, res["rejects"] = _csv_to_parquet_event_month(csv_path, dataset, file_sha256, threads=threads)
+    else:
+        target = _lake_target_path(dataset, ingest_date, file_sha256)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        res["target"] = target
+
+        # SKIP se già esiste: evita overwrite inutili ad ogni run
+        if target.exists():
+            return res
+
+        res["rejects"] = _csv_to_parquet_streaming(csv_path, target, dataset, file_sha256, threads=threads)
+        files = [target]
+
+    res["target"] = _lake_path_for(dataset, LAKE_LAYOUT, file_sha256, files)
+    res["written"] = True
+    res["manifest"] = _manifest_entries(files, file_sha256, dataset, LAKE_LAYOUT)
+    return res
+
+
 @task(name="Phase2 - Write PENDING to Data Lake (Parquet)", retries=0)
 def write_pending_to_lake(run_id: str, pipeline_name: str = "phase2_incremental") -> dict:
     """
     Data Lake:
     - Legge i file PENDING (CSV) rilevati in meta.ingestion_log
-    - Scrive Parquet colonnare in data/Data_Lake/<dataset>/ingest_date=YYYY-MM-DD/sha256=<sha>/
-    - Aggiorna meta.ingestion_log con lake_path e lake_written_at
-
-    NOTE: se il parquet esiste già (path deterministico per sha256), SKIPPA la scrittura.
+    - Scrive Parquet colonnare nel layout LAKE_LAYOUT:
+        ingest_date -> data/Data_Lake/<dataset>/ingest_date=YYYY-MM-DD/sha256=<sha>/data.parquet
+        event_month -> data/Data_Lake/<dataset>/event_year=YYYY/event_month=M/<sha>_<i>.parquet
+    - Aggiorna meta.ingestion_log con lake_path (file o glob dello sha) e lake_written_at
+    - Registra i file scritti nel manifest meta.lake_files
+
+    NOTE:
+    - se il parquet esiste già (path deterministico per sha256 / sha nel manifest), SKIPPA la scrittura.
+    - conversioni in parallelo (PHASE2_MAX_WORKERS), thread DuckDB ripartiti tra i worker;
+      ogni worker ha il proprio LAKE_WRITER_MEMORY_LIMIT.
+    - update di meta.ingestion_log in un unico batch a fine step (anche se un file fallisce:
+      i file riusciti vengono registrati, poi l'errore viene rilanciato).
     """
     logger = get_run_logger()
     ingest_date = _today_utc_str()
+    if LAKE_LAYOUT not in LAKE_LAYOUTS:
+        raise ValueError(f"LAKE_LAYOUT non valido: {LAKE_LAYOUT!r} (ammessi: {LAKE_LAYOUTS})")
 
-    with get_db_connection() as con:
-        rows = con.execute(
-            f"""
-            SELECT file_path, file_sha256
-            FROM {Schemas.META}.ingestion_log
-            WHERE run_id = ? AND pipeline_name = ? AND status = 'PENDING'
-            """,
-            [run_id, pipeline_name],
-        ).fetchall()
+    with MetaRepository.open() as repo:
+        # un file per sha: due copie dello stesso contenuto non scrivono lo stesso parquet in parallelo
+        rows = list({sha: file_path for file_path, sha, _ in repo.pending_files(run_id, pipeline_name)}.items())
+        in_lake = repo.lake_files_by_sha([sha for sha, _ in rows], LAKE_LAYOUT)
 
     if not rows:
         logger.info("Nessun file PENDING da scrivere nel Data Lake.")
         return {"written": 0, "calls": 0, "incidents": 0}
 
-    written = 0
-    calls_n = 0
-    incidents_n = 0
+    workers = max(1, min(PHASE2_MAX_WORKERS, len(rows)))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    logger.info(
+        f"Lake write | layout={LAKE_LAYOUT} files={len(rows)} workers={workers} duckdb_threads/worker={threads}"
+    )
 
-    for file_path, file_sha256 in rows:
-        csv_path = str(file_path)
+    results = []
+    errors = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(
+                _write_one, str(file_path), file_sha256, ingest_date, threads, in_lake.get(file_sha256, [])
+            ): file_path
+            for file_sha256, file_path in rows
+        }
+        for fut, file_path in futures.items():
+            try:
+                results.append(fut.result())
+            except Exception as e:
+                logger.error(f"Lake write fallito per {file_path}: {e}")
+                errors.append(e)
+
+    with MetaRepository.open() as repo:
+        repo.set_lake_paths(
+            run_id, pipeline_name, [(r["sha"], r["target"], r["written"]) for r in results]
+        )
+        repo.register_lake_files([e for r in results for e in r["manifest"]])
+        # parquet scritti prima del manifest (una query, di norma vuota): il manifest resta completo
+        _backfill_manifest(repo)
+
+    for r in results:
+        if not r["written"]:
+            logger.info(f"Parquet già presente, skip write: {r['target']}")
+        n_rejects, sample = r["rejects"]
+        if n_rejects:
+            logger.warning(
+                f"{r['target']}: {n_rejects:,} righe CSV scartate da read_csv "
+                f"(sha={r['sha']}, non contate in _source_row_number). Prime: {sample}"
+            )
 
-        # detect dataset (merged-safe)
-        cols = _read_header_sanitized(csv_path)
-        dataset = _detect_dataset_type(cols, csv_path)
+    written_res = [r for r in results if r["written"]]
+    written = len(written_res)
+    calls_n = sum(1 for r in written_res if r["dataset"] == "fire_calls")
+    incidents_n = written - calls_n
 
-        target = _lake_target_path(dataset, ingest_date, file_sha256)
-        target.parent.mkdir(parents=True, exist_ok=True)
+    if errors:
+        raise errors[0]
 
-        # SKIP se già esiste: evita overwrite inutili ad ogni run
-        if target.exists():
-            logger.info(f"Parquet già presente, skip write: {target}")
-            with get_db_connection() as con:
-                con.execute(
-                    f"""
-                    UPDATE {Schemas.META}.ingestion_log
-                    SET lake_path = ?, lake_written_at = COALESCE(lake_written_at, ?)
-                    WHERE run_id = ? AND pipeline_name = ? AND file_sha256 = ?
-                    """,
-                    [str(target), _utcnow_naive(), run_id, pipeline_name, file_sha256],
-                )
+    logger.info(f"Lake write done | written={written} calls={calls_n} incidents={incidents_n}")
+    return {"written": written, "calls": calls_n, "incidents": incidents_n}
+
+
+# -------------------------
+# Compaction
+# -------------------------
+def _backfill_manifest(repo: MetaRepository) -> int:
+    """Registra nel manifest i parquet ingest_date scritti prima di meta.lake_files (da ingestion_log.lake_path)."""
+    entries = []
+    for sha, lake_path in repo.unregistered_lake_paths():
+        f = Path(lake_path)
+        # solo file singoli esistenti del layout ingest_date (<dataset>/ingest_date=.../sha256=<sha>/data.parquet)
+        if "*" in lake_path or not f.is_file() or f.parent.name != f"sha256={sha}":
             continue
+        entries += _manifest_entries([f], sha, f.parent.parent.parent.name, "ingest_date")
+    repo.register_lake_files(entries)
+    return len(entries)
+
+
+def _remove_empty_dirs(path: Path, stop: Path) -> None:
+    # risale fino a `stop` (escluso) rimuovendo le directory rimaste vuote (es. sha256=<sha>)
+    while path != stop and stop in path.parents:
+        try:
+            path.rmdir()
+        except OSError:
+            return
+        path = path.parent
+
+
+def _compaction_bins(files: list[tuple[str, int]], target_bytes: int) -> list[list[str]]:
+    """First-fit decreasing sui file sotto target: ritorna solo i bin con almeno 2 file."""
+    bins: list[tuple[int, list[str]]] = []
+    for path, size in sorted(files, key=lambda x: -x[1]):
+        if size >= target_bytes:
+            continue
+        for i, (used, paths) in enumerate(bins):
+            if used + size <= target_bytes:
+                bins[i] = (used + size, paths + [path])
+                break
+        else:
+            bins.append((size, [path]))
+    # ordine per path: righe dello stesso sha restano contigue nel file compattato
+    return [sorted(paths) for _, paths in bins if len(paths) > 1]
 
-        # leggi tutto e scrivi parquet
-        df = _load_csv_polars(csv_path)
-
-        # metadati utili nel lake (audit) — non rompe nulla
-        df = df.with_row_index(name="_source_row_number")
-        df = df.with_columns(
-            [
-                pl.lit(file_sha256).cast(pl.Utf8).alias("_source_sha256"),
-                pl.lit(csv_path).cast(pl.Utf8).alias("_source_file_path"),
-                pl.lit(_utcnow_naive()).cast(pl.Utf8).alias("_lake_written_at_utc"),
-            ]
-        )
-        df = df.with_columns([pl.col("_source_row_number").cast(pl.Utf8)])
 
-        logger.info(f"Writing parquet to Data Lake: {target}")
-        df.write_parquet(str(target))
+def _compacted_target(dataset: str, layout: str, partition: tuple) -> Path:
+    name = f"compacted_{uuid.uuid4().hex[:12]}"
+    if layout == "event_month":
+        year, month = partition
+        return Path(LAKE_ROOT_DIR, dataset, f"event_year={year}", f"event_month={month}", f"{name}.parquet")
+    # ingest_date: fuori dal livello sha256= (contiene più sha, il lineage è _source_sha256)
+    return Path(LAKE_ROOT_DIR, dataset, f"ingest_date={_today_utc_str()}", f"{name}.parquet")
+
 
-        with get_db_connection() as con:
+def _merge_parquet(paths: list[str], target: Path, expected_rows: int, threads: int) -> int:
+    """
+    COPY streaming dei file sorgente in un unico parquet (tmp + os.replace).
+    Colonne per nome (union_by_name: drift di schema tra drop), niente colonne hive dal path:
+    in event_month quelle del file compattato vengono dalla sua directory. Verifica le righe dal footer.
+    """
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_name(target.name + ".tmp")
+    try:
+        with _writer_connection(threads) as con:
             con.execute(
                 f"""
-                UPDATE {Schemas.META}.ingestion_log
-                SET lake_path = ?, lake_written_at = ?
-                WHERE run_id = ? AND pipeline_name = ? AND file_sha256 = ?
+                COPY (
+                  SELECT *
+                  FROM read_parquet(?, hive_partitioning=false, union_by_name=true)
+                ) TO {_sql_str(tmp)} ({_parquet_copy_options()})
                 """,
-                [str(target), _utcnow_naive(), run_id, pipeline_name, file_sha256],
+                [paths],
             )
-
-        written += 1
-        if dataset == "fire_calls":
-            calls_n += 1
-        else:
-            incidents_n += 1
-
-    logger.info(f"Lake write done | written={written} calls={calls_n} incidents={incidents_n}")
-    return {"written": written, "calls": calls_n, "incidents": incidents_n}
+            n = con.execute("SELECT SUM(num_rows) FROM parquet_file_metadata(?)", [str(tmp)]).fetchone()[0]
+        if int(n) != int(expected_rows):
+            raise RuntimeError(f"Compaction {target}: righe {n} != attese {expected_rows}")
+        os.replace(tmp, target)
+        return int(n)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+
+@task(name="Phase2 - Compact Data Lake (Parquet)", retries=0)
+def compact_lake(
+    layout: str = LAKE_LAYOUT,
+    target_mb: int = LAKE_COMPACT_TARGET_MB,
+    pipeline_name: str = "phase2_incremental",
+) -> dict:
+    """
+    Fonde i parquet piccoli del lake in file da ~target_mb, per dataset/partizione:
+    - event_month: per (dataset, event_year, event_month)
+    - ingest_date: per dataset (ingest_date è una data di arrivo, non una partizione di query)
+
+    Il lineage resta nelle colonne _source_sha256/_source_row_number (copiate così come sono).
+    Per ogni bin: parquet nuovo scritto e verificato, poi in UNA transazione manifest
+    (meta.lake_files) + ingestion_log.lake_path (righe di pipeline_name), solo dopo il commit
+    si cancellano i vecchi file.
+    Un errore a metà lascia al massimo un file nuovo orfano (fuori manifest), mai riferimenti rotti.
+    Con BRONZE_MODE=lake le view bronze vengono rigenerate dopo ogni swap.
+    """
+    logger = get_run_logger()
+    if layout not in LAKE_LAYOUTS:
+        raise ValueError(f"LAKE_LAYOUT non valido: {layout!r} (ammessi: {LAKE_LAYOUTS})")
+    target_bytes = int(target_mb) * 1024 * 1024
+    threads = os.cpu_count() or 1
+
+    compacted_files = 0
+    written_files = 0
+    with MetaRepository.open() as repo:
+        if layout == "ingest_date":
+            backfilled = _backfill_manifest(repo)
+            if backfilled:
+                logger.info(f"Manifest lake: registrati {backfilled} parquet pre-esistenti.")
+
+        # manifest -> partizioni: {(dataset, partition): {file_path: [size, {sha: rows}]}}
+        partitions: dict[tuple, dict[str, list]] = {}
+        for path, sha, dataset, year, month, rows, size in repo.lake_files(layout):
+            part = (dataset, (year, month) if layout == "event_month" else None)
+            entry = partitions.setdefault(part, {}).setdefault(path, [size, {}])
+            entry[1][sha] = rows
+
+        for (dataset, partition), files in partitions.items():
+            bins = _compaction_bins([(p, v[0]) for p, v in files.items()], target_bytes)
+            for paths in bins:
+                sha_rows: dict[str, int] = {}
+                for p in paths:
+                    for sha, n in files[p][1].items():
+                        sha_rows[sha] = sha_rows.get(sha, 0) + int(n)
+
+                target = _compacted_target(dataset, layout, partition)
+                _merge_parquet(paths, target, sum(sha_rows.values()), threads)
+                size = target.stat().st_size
+                year, month = partition or (None, None)
+                entries = [
+                    (str(target), sha, dataset, layout, year, month, n, size) for sha, n in sha_rows.items()
+                ]
+
+                # lake_path per sha dopo lo swap: file attuali dello sha - vecchi + nuovo
+                current = repo.lake_files_by_sha(list(sha_rows), layout)
+                lake_paths = {
+                    sha: _lake_path_for(
+                        dataset, layout, sha, [f for f in current.get(sha, []) if f not in paths] + [str(target)]
+                    )
+                    for sha in sha_rows
+                }
+
+                try:
+                    repo.replace_lake_files(paths, entries, lake_paths, pipeline_name)
+                except Exception:
+                    target.unlink(missing_ok=True)
+                    raise
+
+                # view bronze sul lake: elencano i file, vanno riallineate prima di cancellare i vecchi
+                if BRONZE_MODE == "lake":
+                    refresh_lake_bronze_views(repo.con, logger)
+
+                for p in paths:
+                    Path(p).unlink(missing_ok=True)
+                    _remove_empty_dirs(Path(p).parent, Path(LAKE_ROOT_DIR, dataset))
+
+                compacted_files += len(paths)
+                written_files += 1
+                logger.info(f"Compaction {dataset} partition={partition}: {len(paths)} file -> {target} ({size} bytes)")
+
+    logger.info(f"Lake compaction done | layout={layout} merged={compacted_files} written={written_files}")
+    return {"merged": compacted_files, "written": written_files}
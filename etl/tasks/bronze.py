@@ -1,7 +1,131 @@
+import os
+
 import polars as pl
 from prefect import task, get_run_logger
 
-from etl.utils import get_db_connection, Schemas, sanitize_columns
+from etl.utils import DB_WRITE_LOCK, get_db_connection, Schemas, sanitize_columns
+from etl.tasks.bronze_schedule import BRONZE_LEDGER, BRONZE_LEDGER_DDL, relation_type
+
+# Motore di ingestione Phase 1 (override per chiamata con engine=...):
+# - polars: scan_csv -> DataFrame -> Arrow -> CREATE TABLE AS (comportamento storico)
+# - duckdb: read_csv parallelo in streaming direttamente nella tabella (nessuna copia in memoria)
+BRONZE_ENGINE = os.getenv("BRONZE_ENGINE", "polars")
+BRONZE_ENGINES = ("polars", "duckdb")
+
+# stessi valori null e stessa finestra di inferenza dello scan polars
+_NULL_VALUES = ["None", "NULL", ""]
+_INFER_ROWS = 10_000
+
+# tipi candidati per l'inferenza DuckDB = tipi che polars inferisce da CSV (niente date/timestamp:
+# il silver Phase 1 parsa le stringhe)
+_DUCKDB_TYPE_CANDIDATES = ["BOOLEAN", "BIGINT", "DOUBLE", "VARCHAR"]
+
+_POLARS_TO_DUCKDB = {
+    pl.Utf8: "VARCHAR",
+    pl.Int64: "BIGINT",
+    pl.Int32: "INTEGER",
+    pl.Float64: "DOUBLE",
+    pl.Boolean: "BOOLEAN",
+    pl.Date: "DATE",
+    pl.Datetime: "TIMESTAMP",
+}
+
+
+def _sql_str(value: str) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+# righe scartate da read_csv (tabelle temp della connessione, ricreate a ogni lettura)
+_REJECTS_TABLE = "_bronze_csv_rejects"
+_REJECTS_SCAN = "_bronze_csv_rejects_scan"
+
+
+def _duckdb_read_csv_sql(con, source_path: str, schema_overrides: dict | None) -> str:
+    """
+    SELECT streaming sul CSV con nomi colonna sanitizzati (stesse opzioni dello scan polars).
+
+    Tipi inferiti sulle prime _INFER_ROWS righe, ma lettura tutta VARCHAR + TRY_CAST: un valore
+    non conforme diventa NULL e la riga resta (come ignore_errors di polars; ignore_errors di
+    read_csv scarterebbe la riga intera). strict_mode=false tronca le righe con colonne in più
+    (truncate_ragged_lines); eventuali righe scartate comunque finiscono in _REJECTS_TABLE.
+    """
+    overrides = {
+        c: _POLARS_TO_DUCKDB.get(t if isinstance(t, type) else type(t), "VARCHAR")
+        for c, t in (schema_overrides or {}).items()
+    }
+    types = ", ".join(f"{_sql_str(c)}: {_sql_str(t)}" for c, t in overrides.items())
+    common = f"""
+        {_sql_str(source_path)},
+        header = true,
+        nullstr = [{", ".join(_sql_str(v) for v in _NULL_VALUES)}],
+        null_padding = true,
+        strict_mode = false
+    """
+    typed_rel = f"""
+    read_csv(
+        {common},
+        sample_size = {_INFER_ROWS},
+        auto_type_candidates = [{", ".join(_sql_str(t) for t in _DUCKDB_TYPE_CANDIDATES)}]
+        {f", types = {{{types}}}" if types else ""}
+    )
+    """
+    varchar_rel = f"""
+    read_csv(
+        {common},
+        all_varchar = true,
+        store_rejects = true,
+        rejects_table = {_sql_str(_REJECTS_TABLE)},
+        rejects_scan = {_sql_str(_REJECTS_SCAN)}
+    )
+    """
+    described = con.execute(f"DESCRIBE SELECT * FROM {typed_rel}").fetchall()
+    old_cols = [r[0] for r in described]
+    new_cols = sanitize_columns(old_cols)
+    select = ",\n".join(
+        f'"{old}" AS "{new}"' if dtype == "VARCHAR" else f'TRY_CAST("{old}" AS {dtype}) AS "{new}"'
+        for (old, dtype, *_), new in zip(described, new_cols)
+    )
+    return f"SELECT {select} FROM {varchar_rel}"
+
+
+def _reset_csv_rejects(con) -> None:
+    con.execute(f"DROP TABLE IF EXISTS temp.{_REJECTS_TABLE}")
+    con.execute(f"DROP TABLE IF EXISTS temp.{_REJECTS_SCAN}")
+
+
+def _log_csv_rejects(con, logger, table_name: str) -> int:
+    """Righe scartate da read_csv (struttura non leggibile): warning con i primi errori."""
+    if not con.execute(
+        "SELECT 1 FROM duckdb_tables() WHERE temporary AND table_name = ?", [_REJECTS_TABLE]
+    ).fetchone():
+        return 0
+    # una riga scartata può avere più errori (es. MISSING COLUMNS per ogni colonna mancante)
+    n = con.execute(f"SELECT COUNT(DISTINCT line) FROM temp.{_REJECTS_TABLE}").fetchone()[0]
+    if n:
+        sample = con.execute(
+            f"""
+            SELECT line, error_type, error_message
+            FROM temp.{_REJECTS_TABLE}
+            QUALIFY row_number() OVER (PARTITION BY line ORDER BY column_idx) = 1
+            ORDER BY line
+            LIMIT 5
+            """
+        ).fetchall()
+        logger.warning(f"{table_name}: {n:,} righe CSV scartate da read_csv. Prime: {sample}")
+    return int(n)
+
+
+def _reset_bronze_table(con, full_table_name: str) -> None:
+    con.execute(f"CREATE SCHEMA IF NOT EXISTS {Schemas.BRONZE}")
+    # in BRONZE_MODE=lake la Phase2 può averla trasformata in view sul lake
+    if relation_type(con, full_table_name) == "VIEW":
+        con.execute(f"DROP VIEW {full_table_name}")
+    con.execute(f"DROP TABLE IF EXISTS {full_table_name}")
+
+    # tabella ricreata da zero: il ledger righe-per-sha della Phase2 non vale più
+    con.execute(BRONZE_LEDGER_DDL)
+    con.execute(f"DELETE FROM {BRONZE_LEDGER} WHERE table_name = ?", [full_table_name])
+
 
 #
 #def _sanitize_column_names(columns: list[str]) -> list[str]:
@@ -16,28 +140,52 @@ from etl.utils import get_db_connection, Schemas, sanitize_columns
 #
 
 @task(name="bronze_ingestion")
-def ingest_bronze(source_path: str, table_name: str, schema_overrides: dict | None = None) -> int:
+def ingest_bronze(
+    source_path: str,
+    table_name: str,
+    schema_overrides: dict | None = None,
+    engine: str | None = None,
+) -> int:
     """
     Ingestione CSV -> DuckDB.
 
     Args:
         source_path: percorso del CSV
         table_name: nome tabella DEST (senza schema), es. "calls"
-        schema_overrides: dict opzionale per forzare dtypes (colonne miste)
+        schema_overrides: dict opzionale per forzare dtypes (colonne miste), chiavi = nomi originali
+        engine: "polars" | "duckdb" (default BRONZE_ENGINE). duckdb legge il CSV in streaming
+            dentro la tabella: picco di memoria indipendente dalla dimensione del file.
     """
     logger = get_run_logger()
     full_table_name = f"{Schemas.BRONZE}.{table_name}"
+    engine = engine or BRONZE_ENGINE
+    if engine not in BRONZE_ENGINES:
+        raise ValueError(f"engine non valido: {engine!r} (ammessi: {BRONZE_ENGINES})")
 
-    logger.info(f"Avvio ingestione Bronze per: {table_name}")
+    logger.info(f"Avvio ingestione Bronze per: {table_name} (engine={engine})")
     logger.info(f"   Source: {source_path}")
 
     try:
+        if engine == "duckdb":
+            # read_csv è già parallelo: tutta l'ingestione sotto lock
+            with DB_WRITE_LOCK, get_db_connection() as con:
+                _reset_bronze_table(con, full_table_name)
+                logger.info(f"   Scrittura in corso su {full_table_name} (read_csv streaming)...")
+                _reset_csv_rejects(con)
+                row_count = con.execute(
+                    f"CREATE TABLE {full_table_name} AS {_duckdb_read_csv_sql(con, source_path, schema_overrides)}"
+                ).fetchone()[0]
+                _log_csv_rejects(con, logger, full_table_name)
+
+            logger.info(f"Completato {table_name}. Righe: {row_count:,}")
+            return int(row_count)
+
         # 1) Scan lazy 
         lazy_df = pl.scan_csv(
             source_path,
-            infer_schema_length=10000,
+            infer_schema_length=_INFER_ROWS,
             schema_overrides=schema_overrides,
-            null_values=["None", "NULL", ""],
+            null_values=_NULL_VALUES,
             ignore_errors=True,
             truncate_ragged_lines=True,
         )
@@ -50,10 +198,9 @@ def ingest_bronze(source_path: str, table_name: str, schema_overrides: dict | No
 
         df = lazy_df.collect(streaming=True)
 
-        # 4) Scrivi su DuckDB
-        with get_db_connection() as con:
-            con.execute(f"CREATE SCHEMA IF NOT EXISTS {Schemas.BRONZE}")
-            con.execute(f"DROP TABLE IF EXISTS {full_table_name}")
+        # 4) Scrivi su DuckDB (il parsing sopra può sovrapporsi ad altre ingestioni, la scrittura no)
+        with DB_WRITE_LOCK, get_db_connection() as con:
+            _reset_bronze_table(con, full_table_name)
 
             con.register("tmp_df", df.to_arrow())
 
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 from datetime import datetime, timezone
 
@@ -8,6 +9,35 @@ from etl.utils import (
     Schemas,
     sanitize_column_name,
 )
+from etl.tasks.ingestion_meta import MetaRepository
+
+
+# Ledger compatto righe-per-sha: evita COUNT(*) / NOT EXISTS sull'intero bronze ad ogni file
+BRONZE_LEDGER = f"{Schemas.META}.bronze_sha_rows"
+
+BRONZE_LEDGER_DDL = f"""
+CREATE SCHEMA IF NOT EXISTS {Schemas.META};
+
+CREATE TABLE IF NOT EXISTS {BRONZE_LEDGER} (
+  table_name        VARCHAR NOT NULL,   -- es. bronze.calls
+  source_sha256     VARCHAR NOT NULL,
+  row_count         BIGINT NOT NULL,    -- righe presenti in bronze per questo sha
+  updated_at        TIMESTAMP NOT NULL,
+  PRIMARY KEY (table_name, source_sha256)
+);
+"""
+
+# colonne tecniche non-VARCHAR
+TECH_COL_TYPES = {"_source_row_number": "BIGINT"}
+
+# Modalità bronze Phase 2:
+# - table (default): i parquet del lake vengono copiati in bronze.calls / bronze.incidents (VARCHAR)
+# - lake: bronze.calls / bronze.incidents sono VIEW sui file del manifest meta.lake_files (nessuna copia)
+BRONZE_MODE = os.getenv("BRONZE_MODE", "table")
+BRONZE_MODES = ("table", "lake")
+
+# dataset del lake -> tabella bronze
+LAKE_DATASETS = {"fire_calls": "calls", "fire_incidents": "incidents"}
 
 
 def _utcnow_naive():
@@ -32,6 +62,19 @@ def _table_exists(con, full_name: str) -> bool:
     return row is not None
 
 
+def relation_type(con, full_name: str) -> str | None:
+    """'BASE TABLE' / 'VIEW' / None se non esiste."""
+    row = con.execute(
+        """
+        SELECT table_type
+        FROM information_schema.tables
+        WHERE table_schema = ? AND table_name = ?
+        """,
+        full_name.split(".", 1),
+    ).fetchone()
+    return row[0] if row else None
+
+
 def _get_table_columns(con, full_name: str) -> list[str]:
     schema, table = full_name.split(".", 1)
     rows = con.execute(
@@ -48,18 +91,200 @@ def _get_table_columns(con, full_name: str) -> list[str]:
 
 def _add_missing_columns(con, full_name: str, cols: list[str]) -> None:
     for c in cols:
-        con.execute(f'ALTER TABLE {full_name} ADD COLUMN "{c}" VARCHAR')
+        con.execute(f'ALTER TABLE {full_name} ADD COLUMN "{c}" {TECH_COL_TYPES.get(c, "VARCHAR")}')
+
+
+def _column_type(con, full_name: str, col: str) -> str | None:
+    schema, table = full_name.split(".", 1)
+    row = con.execute(
+        """
+        SELECT data_type
+        FROM information_schema.columns
+        WHERE table_schema = ? AND table_name = ? AND column_name = ?
+        """,
+        [schema, table, col],
+    ).fetchone()
+    return row[0] if row else None
+
+
+def _migrate_row_number_bigint(con, full_name: str, logger) -> None:
+    """Migrazione one-shot: _source_row_number VARCHAR -> BIGINT (tabelle create prima del ledger)."""
+    if _column_type(con, full_name, "_source_row_number") == "VARCHAR":
+        logger.info(f"Migrazione {full_name}._source_row_number VARCHAR -> BIGINT")
+        con.execute(
+            f"""
+            ALTER TABLE {full_name}
+            ALTER _source_row_number TYPE BIGINT
+            USING try_cast(_source_row_number AS BIGINT)
+            """
+        )
+
+
+def _ensure_ledger(con) -> None:
+    """Crea il ledger; alla prima creazione lo popola dal bronze già esistente (backfill una tantum)."""
+    existed = _table_exists(con, BRONZE_LEDGER)
+    con.execute(BRONZE_LEDGER_DDL)
+    if existed:
+        return
+
+    now = _utcnow_naive()
+    for dataset in ("calls", "incidents"):
+        target = f"{Schemas.BRONZE}.{dataset}"
+        if not _table_exists(con, target) or "_source_sha256" not in _get_table_columns(con, target):
+            continue
+        con.execute(
+            f"""
+            INSERT INTO {BRONZE_LEDGER} (table_name, source_sha256, row_count, updated_at)
+            SELECT ?, _source_sha256, COUNT(*), ?
+            FROM {target}
+            WHERE _source_sha256 IS NOT NULL
+            GROUP BY _source_sha256
+            """,
+            [target, now],
+        )
 
 
-def _source_relation(source_path: str) -> str:
-    # In phase2 ingestiamo dal lake (parquet). Se capita CSV, supportiamolo comunque.
-    return (
-        "read_parquet(?)"
-        if source_path.lower().endswith(".parquet")
-        else "read_csv_auto(?, ALL_VARCHAR=TRUE)"
+def _ledger_rows(con, target: str, file_sha256: str) -> int:
+    row = con.execute(
+        f"SELECT row_count FROM {BRONZE_LEDGER} WHERE table_name = ? AND source_sha256 = ?",
+        [target, file_sha256],
+    ).fetchone()
+    return int(row[0]) if row else 0
+
+
+def _ledger_add(con, target: str, file_sha256: str, n: int) -> None:
+    con.execute(
+        f"""
+        INSERT INTO {BRONZE_LEDGER} (table_name, source_sha256, row_count, updated_at)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (table_name, source_sha256)
+        DO UPDATE SET row_count = row_count + excluded.row_count, updated_at = excluded.updated_at
+        """,
+        [target, file_sha256, int(n), _utcnow_naive()],
     )
 
 
+def _sql_list(values: list[str]) -> str:
+    return "[" + ", ".join("'" + v.replace("'", "''") + "'" for v in values) + "]"
+
+
+def _lake_bronze_view_sql(con, dataset: str) -> str | None:
+    """
+    CREATE VIEW bronze.<tabella> sui file del manifest per il dataset (None se non ci sono file).
+    _lake_written_at_utc esposto come _ingested_at_utc (TIMESTAMP: il silver non lo riparsa).
+    Colonne hive solo se i file sono tutti event_month (vedi _lake_hive_partitioning).
+    Path assoluti: la view resta valida anche aprendo il warehouse da un'altra cwd.
+    """
+    rows = con.execute(
+        f"""
+        SELECT DISTINCT file_path, layout
+        FROM {Schemas.META}.lake_files
+        WHERE dataset = ?
+        ORDER BY file_path
+        """,
+        [dataset],
+    ).fetchall()
+    if not rows:
+        return None
+    hive = "true" if {layout for _, layout in rows} == {"event_month"} else "false"
+    return f"""
+    CREATE OR REPLACE VIEW {Schemas.BRONZE}.{LAKE_DATASETS[dataset]} AS
+    SELECT
+      * EXCLUDE (_lake_written_at_utc),
+      _lake_written_at_utc AS _ingested_at_utc
+    FROM read_parquet({_sql_list([str(Path(r[0]).resolve()) for r in rows])}, hive_partitioning={hive}, union_by_name=true)
+    """
+
+
+def _shas_not_in_lake(con, target: str, dataset: str) -> int:
+    """Sha (NULL inclusi: righe Phase1) presenti nella tabella bronze ma non nel manifest del lake."""
+    if "_source_sha256" not in _get_table_columns(con, target):
+        return -1
+    return con.execute(
+        f"""
+        SELECT COUNT(*)
+        FROM (SELECT DISTINCT _source_sha256 FROM {target}) t
+        WHERE t._source_sha256 IS NULL
+           OR t._source_sha256 NOT IN (
+             SELECT source_sha256 FROM {Schemas.META}.lake_files WHERE dataset = ?
+           )
+        """,
+        [dataset],
+    ).fetchone()[0]
+
+
+def refresh_lake_bronze_views(con, logger) -> set[str]:
+    """
+    BRONZE_MODE=lake: (ri)crea le view bronze sui file del manifest e ritorna le tabelle servite dal lake.
+
+    Va richiamata quando il manifest cambia (nuovi file, compaction): la view elenca i file.
+    Migrazione: una tabella bronze copiata viene droppata SOLO se ogni suo sha è nel lake,
+    altrimenti resta tabella (es. dati Phase1 senza sha) e continua in modalità copia.
+    """
+    served = set()
+    for dataset, table in LAKE_DATASETS.items():
+        target = f"{Schemas.BRONZE}.{table}"
+        view_sql = _lake_bronze_view_sql(con, dataset)
+        if view_sql is None:
+            continue
+
+        if relation_type(con, target) == "BASE TABLE":
+            missing = _shas_not_in_lake(con, target, dataset)
+            if missing:
+                reason = "senza _source_sha256" if missing < 0 else f"{missing} sha non presenti nel lake"
+                logger.warning(f"{target} resta tabella ({reason}): nessuna migrazione a view.")
+                continue
+            logger.info(f"Migrazione {target}: tabella -> view sul lake (tutti gli sha sono nel manifest).")
+            con.execute("BEGIN TRANSACTION")
+            try:
+                con.execute(f"DROP TABLE {target}")
+                con.execute(view_sql)
+                con.execute("COMMIT")
+            except Exception:
+                con.execute("ROLLBACK")
+                raise
+            # rilascia i blocchi della tabella copiata
+            con.execute("CHECKPOINT")
+        else:
+            con.execute(view_sql)
+        served.add(target)
+    return served
+
+
+def _lake_rows_for_sha(con, file_sha256: str) -> dict[str, int]:
+    """{tabella bronze: righe} dello sha secondo il manifest."""
+    rows = con.execute(
+        f"""
+        SELECT dataset, SUM(row_count)
+        FROM {Schemas.META}.lake_files
+        WHERE source_sha256 = ?
+        GROUP BY dataset
+        """,
+        [file_sha256],
+    ).fetchall()
+    return {f"{Schemas.BRONZE}.{LAKE_DATASETS[d]}": int(n) for d, n in rows if d in LAKE_DATASETS}
+
+
+def _lake_hive_partitioning(source_path: str) -> str:
+    """
+    Colonne hive solo per il layout event_month (event_year/event_month valgono anche per i
+    compattati). In ingest_date le directory sono metadati di arrivo già nelle colonne
+    _source_sha256/_lake_written_at_utc, e i compattati stanno un livello sopra sha256=.
+    """
+    return "true" if "event_year=" in source_path else "false"
+
+
+def _source_relation(source_path: str, file_sha256: str | None = None) -> str:
+    # In phase2 ingestiamo dal lake (parquet, file o glob dello sha). Se capita CSV, supportiamolo comunque.
+    if not source_path.lower().endswith(".parquet"):
+        return "read_csv_auto(?, ALL_VARCHAR=TRUE)"
+    rel = f"read_parquet(?, hive_partitioning={_lake_hive_partitioning(source_path)}, union_by_name=true)"
+    # file compattati contengono più sha: solo le righe di questo (sha esadecimale, literal sicuro)
+    if file_sha256:
+        rel = f"(SELECT * FROM {rel} WHERE _source_sha256 = '{file_sha256}')"
+    return rel
+
+
 def _get_source_cols_duckdb(con, source_path: str) -> list[str]:
     rel = _source_relation(source_path)
     rows = con.execute(
@@ -101,75 +326,76 @@ def _detect_dataset_type(cols: list[str], source_path: str) -> str:
     return "incidents"
 
 
-def _mark_done_and_upsert_success(run_id: str, pipeline_name: str, file_sha256: str):
-    """
-    - status DONE in ingestion_log per questa run_id
-    - upsert in ingested_contents (così la prossima detect può fare SKIPPED)
-    """
-    now = _utcnow_naive()
-    with get_db_connection() as con:
-        con.execute(
-            f"""
-            UPDATE {Schemas.META}.ingestion_log
-            SET status = 'DONE', error_message = NULL
-            WHERE run_id = ? AND pipeline_name = ? AND file_sha256 = ?
-            """,
-            [run_id, pipeline_name, file_sha256],
-        )
-
-        # upsert: first_success_at resta il primo, last_success_at si aggiorna
-        con.execute(
-            f"""
-            INSERT INTO {Schemas.META}.ingested_contents
-              (pipeline_name, content_sha256, first_success_at, last_success_at)
-            VALUES (?, ?, ?, ?)
-            ON CONFLICT (pipeline_name, content_sha256)
-            DO UPDATE SET last_success_at = excluded.last_success_at
-            """,
-            [pipeline_name, file_sha256, now, now],
-        )
-
-
 @task(name="Phase2 - Bronze incremental ingest (from Data Lake if available)", retries=0)
 def ingest_bronze_incremental(run_id: str, pipeline_name: str = "phase2_incremental") -> dict:
     """
     Legge i file PENDING della run_id da meta.ingestion_log e li inserisce in bronze.calls / bronze.incidents
     in modo idempotente tramite (_source_sha256, _source_row_number).
 
+    Idempotenza senza scansioni dell'intero bronze: meta.bronze_sha_rows tiene le righe
+    già caricate per sha (file completo -> skip; sha nuovo -> insert diretto; sha caricato
+    a metà -> ANTI JOIN ristretto alle righe di quello sha).
+
     Fonte preferita: Data Lake (lake_path -> parquet).
     Fallback: file_path (csv da Client_drop) se lake_path è NULL.
 
+    BRONZE_MODE=lake: nessuna copia. Le view bronze vengono rigenerate sul manifest del lake
+    e per gli sha della run si aggiorna solo il ledger (inserted_* = righe nuove visibili).
+
     NOTE:
     - Ingest "streaming" lato DuckDB: NON carica l'intero file in memoria.
     - inserted_* conta SOLO le righe effettivamente nuove inserite in questa run.
+    - File processati in serie su UNA connessione (DuckDB ha un solo writer; ogni INSERT
+      è già parallelo internamente). DONE marcato in batch a fine step: se un file fallisce
+      i precedenti restano PENDING e la run successiva li ri-rileva (il ledger evita doppioni)
+      e li marca DONE con inserted_now=0. Per questo a valle si decide su done_files (sha DONE
+      nella run, quelli che il silver incrementale rilegge) e non sulle sole righe inserite.
     """
     logger = get_run_logger()
-
-    # Recupero i PENDING una volta, poi processo file-per-file
-    with get_db_connection() as con:
-        _ensure_schema(con)
-        rows = con.execute(
-            f"""
-            SELECT file_path, file_sha256, lake_path
-            FROM {Schemas.META}.ingestion_log
-            WHERE run_id = ? AND pipeline_name = ? AND status = 'PENDING'
-            """,
-            [run_id, pipeline_name],
-        ).fetchall()
-
-    if not rows:
-        logger.info("Nessun file PENDING da ingerire in bronze.")
-        return {"inserted_calls": 0, "inserted_incidents": 0, "files": 0}
+    if BRONZE_MODE not in BRONZE_MODES:
+        raise ValueError(f"BRONZE_MODE non valido: {BRONZE_MODE!r} (ammessi: {BRONZE_MODES})")
 
     inserted_calls = 0
     inserted_incidents = 0
+    done_shas = []
 
-    for file_path, file_sha256, lake_path in rows:
-        source_path = str(lake_path) if lake_path else str(file_path)
-        logger.info(f"Ingest source: {source_path}")
-
-        with get_db_connection() as con:
-            _ensure_schema(con)
+    # UNA connessione per tutto lo step: PENDING, insert file-per-file, DONE in batch
+    with get_db_connection() as con:
+        _ensure_schema(con)
+        repo = MetaRepository(con)
+        repo.ensure_tables()
+
+        rows = repo.pending_files(run_id, pipeline_name)
+        if not rows:
+            logger.info("Nessun file PENDING da ingerire in bronze.")
+            return {"inserted_calls": 0, "inserted_incidents": 0, "files": 0, "done_files": 0}
+
+        served = set()
+        if BRONZE_MODE == "lake":
+            _ensure_ledger(con)
+            served = refresh_lake_bronze_views(con, logger)
+            logger.info(f"Bronze lake-backed: {sorted(served) or 'nessuna view'}")
+
+        for file_path, file_sha256, lake_path in rows:
+            # BRONZE_MODE=lake: lo sha è già visibile dalla view, si registra solo nel ledger
+            lake_rows = {}
+            if served:
+                lake_rows = {t: n for t, n in _lake_rows_for_sha(con, file_sha256).items() if t in served}
+            if lake_rows:
+                for target, n in lake_rows.items():
+                    inserted_now = max(n - _ledger_rows(con, target, file_sha256), 0)
+                    if inserted_now:
+                        _ledger_add(con, target, file_sha256, inserted_now)
+                    if target.endswith(".calls"):
+                        inserted_calls += inserted_now
+                    else:
+                        inserted_incidents += inserted_now
+                    logger.info(f"Bronze lake view | {target} new_rows={inserted_now} sha={file_sha256}")
+                done_shas.append(file_sha256)
+                continue
+
+            source_path = str(lake_path) if lake_path else str(file_path)
+            logger.info(f"Ingest source: {source_path}")
 
             # 1) Colonne dalla sorgente (NO load in memoria)
             src_cols = _get_source_cols_duckdb(con, source_path)
@@ -178,6 +404,10 @@ def ingest_bronze_incremental(run_id: str, pipeline_name: str = "phase2_incremen
             dataset = _detect_dataset_type(src_cols, source_path)
             target = f"{Schemas.BRONZE}.{dataset}"
 
+            if target in served:
+                logger.warning(f"{target} è una view sul lake ma lo sha {file_sha256} non è nel manifest: resta PENDING.")
+                continue
+
             # 3) Colonne tecniche (idempotenza)
             tech_cols = [
                 "_source_row_number",
@@ -186,18 +416,28 @@ def ingest_bronze_incremental(run_id: str, pipeline_name: str = "phase2_incremen
                 "_ingested_at_utc",
             ]
 
+            rel = _source_relation(source_path, file_sha256 if "_source_sha256" in src_cols else None)
+
+            # row number: dal lake se già presente (stabile), altrimenti posizionale
+            row_number_sql = (
+                'try_cast("_source_row_number" AS BIGINT)'
+                if "_source_row_number" in src_cols
+                else "CAST(row_number() OVER () - 1 AS BIGINT)"
+            )
+
             # 4) Se tabella non esiste, la creo VUOTA ma coerente (VARCHAR) con tutte le colonne attese
             if not _table_exists(con, target):
                 logger.info(f"Tabella {target} non esiste: creazione.")
-                rel = _source_relation(source_path)
-                select_src = ",\n".join([f'CAST("{c}" AS VARCHAR) AS "{c}"' for c in src_cols])
+                select_src = ",\n".join(
+                    [f'CAST("{c}" AS VARCHAR) AS "{c}"' for c in src_cols if c not in tech_cols]
+                )
 
                 con.execute(
                     f"""
                     CREATE TABLE {target} AS
                     SELECT
                       {select_src},
-                      CAST(row_number() OVER () - 1 AS VARCHAR) AS _source_row_number,
+                      {row_number_sql} AS _source_row_number,
                       CAST(? AS VARCHAR) AS _source_sha256,
                       CAST(? AS VARCHAR) AS _source_file_path,
                       CAST(? AS VARCHAR) AS _ingested_at_utc
@@ -210,7 +450,7 @@ def ingest_bronze_incremental(run_id: str, pipeline_name: str = "phase2_incremen
 
             # 5) Schema evolution: aggiungo eventuali colonne nuove (sia src che tech)
             existing_cols = _get_table_columns(con, target)
-            desired_cols = src_cols + tech_cols
+            desired_cols = src_cols + [c for c in tech_cols if c not in src_cols]
 
             new_cols = [c for c in desired_cols if c not in existing_cols]
             if new_cols:
@@ -218,71 +458,95 @@ def ingest_bronze_incremental(run_id: str, pipeline_name: str = "phase2_incremen
                 _add_missing_columns(con, target, new_cols)
                 existing_cols = _get_table_columns(con, target)
 
-            # 6) SELECT che produce esattamente le colonne della tabella (mappa src->VARCHAR + tech)
-            rel = _source_relation(source_path)
-
-            select_map = {c: f'CAST("{c}" AS VARCHAR) AS "{c}"' for c in src_cols}
-            select_map["_source_row_number"] = 'CAST(row_number() OVER () - 1 AS VARCHAR) AS "_source_row_number"'
-            select_map["_source_sha256"] = 'CAST(? AS VARCHAR) AS "_source_sha256"'
-            select_map["_source_file_path"] = 'CAST(? AS VARCHAR) AS "_source_file_path"'
-            select_map["_ingested_at_utc"] = 'CAST(? AS VARCHAR) AS "_ingested_at_utc"'
-
-            # colonne presenti in tabella ma assenti nella sorgente -> NULL
-            for c in existing_cols:
-                if c not in select_map:
-                    select_map[c] = f'CAST(NULL AS VARCHAR) AS "{c}"'
-
-            final_select = ",\n".join([select_map[c] for c in existing_cols])
-
-            # 7) Count PRIMA dell'insert (solo per questo sha)
-            before_for_sha = con.execute(
-                f"SELECT COUNT(*) FROM {target} WHERE _source_sha256 = ?",
-                [file_sha256],
-            ).fetchone()[0]
-
-            # 8) INSERT idempotente
-            con.execute(
-                f"""
-                INSERT INTO {target}
-                SELECT t.*
-                FROM (
-                  SELECT
-                    {final_select}
-                  FROM {rel}
-                ) t
-                WHERE NOT EXISTS (
-                  SELECT 1 FROM {target} b
-                  WHERE b._source_sha256 = t._source_sha256
-                    AND b._source_row_number = t._source_row_number
-                )
-                """,
-                # ordine placeholder: sha256, file_path, ingested_at, source_path
-                [file_sha256, source_path, _utcnow_naive(), source_path],
+            _migrate_row_number_bigint(con, target, logger)
+            _ensure_ledger(con)
+
+            # 6) Short-circuit a livello file: lo sha è già tutto in bronze?
+            already = _ledger_rows(con, target, file_sha256)
+            source_rows = None
+            if already:
+                source_rows = con.execute(f"SELECT COUNT(*) FROM {rel}", [source_path]).fetchone()[0]
+
+            if source_rows is not None and already >= source_rows:
+                inserted_now = 0
+                total_for_sha = already
+                logger.info(f"sha già completo in {target} ({already} righe): skip insert.")
+            else:
+                # 7) SELECT che produce esattamente le colonne della tabella (mappa src->VARCHAR + tech)
+                select_map = {c: f'CAST("{c}" AS VARCHAR) AS "{c}"' for c in src_cols}
+                select_map["_source_row_number"] = f'{row_number_sql} AS "_source_row_number"'
+                select_map["_source_sha256"] = 'CAST(? AS VARCHAR) AS "_source_sha256"'
+                select_map["_source_file_path"] = 'CAST(? AS VARCHAR) AS "_source_file_path"'
+                select_map["_ingested_at_utc"] = 'CAST(? AS VARCHAR) AS "_ingested_at_utc"'
+
+                # colonne presenti in tabella ma assenti nella sorgente -> NULL
+                for c in existing_cols:
+                    if c not in select_map:
+                        select_map[c] = f'CAST(NULL AS VARCHAR) AS "{c}"'
+
+                final_select = ",\n".join([select_map[c] for c in existing_cols])
+
+                # 8) INSERT: sha nuovo -> insert diretto; sha parziale -> ANTI JOIN solo sulle righe di quello sha
+                params = [file_sha256, source_path, _utcnow_naive(), source_path]
+                if already:
+                    anti_join = f"""
+                    ANTI JOIN (
+                      SELECT _source_row_number
+                      FROM {target}
+                      WHERE _source_sha256 = ?
+                    ) b ON b._source_row_number = t._source_row_number
+                    """
+                    params.append(file_sha256)
+                else:
+                    anti_join = ""
+
+                con.execute("BEGIN TRANSACTION")
+                try:
+                    inserted_now = int(
+                        con.execute(
+                            f"""
+                            INSERT INTO {target}
+                            SELECT t.*
+                            FROM (
+                              SELECT
+                                {final_select}
+                              FROM {rel}
+                            ) t
+                            {anti_join}
+                            """,
+                            # ordine placeholder: sha256, file_path, ingested_at, source_path[, sha256]
+                            params,
+                        ).fetchone()[0]
+                    )
+                    _ledger_add(con, target, file_sha256, inserted_now)
+                    con.execute("COMMIT")
+                except Exception:
+                    con.execute("ROLLBACK")
+                    raise
+
+                total_for_sha = already + inserted_now
+
+            # contatori: SOLO righe nuove effettivamente inserite
+            if dataset == "calls":
+                inserted_calls += inserted_now
+            else:
+                inserted_incidents += inserted_now
+
+            logger.info(
+                f"Bronze file done | dataset={dataset} inserted_now={inserted_now} total_for_sha={total_for_sha} sha={file_sha256}"
             )
 
-            # 9) Count DOPO l'insert (solo per questo sha)
-            after_for_sha = con.execute(
-                f"SELECT COUNT(*) FROM {target} WHERE _source_sha256 = ?",
-                [file_sha256],
-            ).fetchone()[0]
-
-            inserted_now = int(after_for_sha - before_for_sha)
-            total_for_sha = int(after_for_sha)
-
-        # contatori: SOLO righe nuove effettivamente inserite
-        if dataset == "calls":
-            inserted_calls += inserted_now
-        else:
-            inserted_incidents += inserted_now
-
-        logger.info(
-            f"Bronze file done | dataset={dataset} inserted_now={inserted_now} total_for_sha={total_for_sha} sha={file_sha256}"
-        )
+            done_shas.append(file_sha256)
 
-        # Marca DONE + upsert in ingested_contents (incrementale vero)
-        _mark_done_and_upsert_success(run_id=run_id, pipeline_name=pipeline_name, file_sha256=file_sha256)
+        # Marca DONE + upsert in ingested_contents in un unico batch (incrementale vero)
+        repo.mark_done(run_id=run_id, pipeline_name=pipeline_name, file_sha256s=done_shas)
 
     logger.info(
         f"Bronze ingest completato | inserted_calls={inserted_calls} inserted_incidents={inserted_incidents} files={len(rows)}"
     )
-    return {"inserted_calls": inserted_calls, "inserted_incidents": inserted_incidents, "files": len(rows)}
+    return {
+        "inserted_calls": inserted_calls,
+        "inserted_incidents": inserted_incidents,
+        "files": len(rows),
+        "done_files": len(done_shas),
+    }
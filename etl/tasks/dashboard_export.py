@@ -1,5 +1,10 @@
 from __future__ import annotations
 
+import hashlib
+import json
+import os
+import shutil
+import uuid
 from pathlib import Path
 from datetime import datetime, timezone
 import duckdb
@@ -7,16 +12,26 @@ import duckdb
 DEFAULT_WAREHOUSE_DB = Path("data/warehouse.duckdb")
 DEFAULT_EXPORT_DB = Path("dashboard_exports/dashboard.duckdb")
 
+# Bundle Parquet di serving (alternativa al .duckdb): una directory per versione + manifest.json.
+# DASHBOARD_BUNDLE_DIR vuoto = bundle disabilitato.
+_BUNDLE_DIR_ENV = os.getenv("DASHBOARD_BUNDLE_DIR", "dashboard_exports/bundle")
+DEFAULT_BUNDLE_DIR = Path(_BUNDLE_DIR_ENV) if _BUNDLE_DIR_ENV else None
+BUNDLE_FACT_MONTHS = int(os.getenv("DASHBOARD_BUNDLE_FACT_MONTHS", "3"))  # ultimi N mesi di fact, 0 = niente
+BUNDLE_KEEP_VERSIONS = int(os.getenv("DASHBOARD_BUNDLE_KEEP", "2"))  # versioni tenute su disco (lettori in corso)
+BUNDLE_MANIFEST = "manifest.json"
+
 KPI_VIEWS = [
     "v_kpi_incident_volume_month",
     "v_kpi_response_time_month",
     "v_kpi_top_incident_type",
+    "v_kpi_response_pctl_month",
 ]
 
 DIM_TABLES = [
     "dim_date",
     "dim_incident_type",
     "dim_location",
+    "filter_options",
 ]
 
 
@@ -29,12 +44,12 @@ def _sql_quote_path(p: Path) -> str:
     return "'" + s.replace("'", "''") + "'"
 
 
-def _exists_in_src(dst: duckdb.DuckDBPyConnection, schema: str, name: str) -> bool:
+def _exists_in_src(con: duckdb.DuckDBPyConnection, schema: str, name: str) -> bool:
     """
     Verifica esistenza oggetto (table/view) dentro al DB attached "src".
     In DuckDB l'information_schema è globale, quindi si filtra per table_catalog='src'.
     """
-    row = dst.execute(
+    row = con.execute(
         """
         SELECT 1
         FROM information_schema.tables
@@ -48,17 +63,337 @@ def _exists_in_src(dst: duckdb.DuckDBPyConnection, schema: str, name: str) -> bo
     return row is not None
 
 
+def _content_version(
+    con: duckdb.DuckDBPyConnection, schema: str, name: str, where: str = ""
+) -> tuple[str, int]:
+    """
+    Versione del contenuto di src.<schema>.<name> (eventualmente filtrato da where):
+    righe + somma degli hash di riga + hash dello schema.
+    Indipendente dall'ordine delle righe; cambia se cambia un valore, una riga o una colonna.
+    """
+    cols = con.execute(
+        """
+        SELECT string_agg(column_name || ' ' || data_type, ', ' ORDER BY ordinal_position)
+        FROM information_schema.columns
+        WHERE table_catalog = 'src' AND table_schema = ? AND table_name = ?
+        """,
+        [schema, name],
+    ).fetchone()[0]
+    n, h = con.execute(
+        f"SELECT COUNT(*), COALESCE(SUM(hash(t)::HUGEINT), 0) FROM src.{schema}.{name} t"
+        f"{f' WHERE {where}' if where else ''}"
+    ).fetchone()
+    cols_hash = hashlib.md5(cols.encode("utf-8")).hexdigest()[:12]
+    return f"{n}:{h}:{cols_hash}", int(n)
+
+
+def _src_gold_version(con: duckdb.DuckDBPyConnection) -> int | None:
+    """max(version) di src.meta.gold_versions; None se la pipeline non pubblica versioni gold."""
+    if not _exists_in_src(con, "meta", "gold_versions"):
+        return None
+    return con.execute("SELECT MAX(version) FROM src.meta.gold_versions").fetchone()[0]
+
+
+def _exported_gold_version(con: duckdb.DuckDBPyConnection, output_path: Path, objects: list[str]) -> int | None:
+    """
+    max(version) di meta.gold_versions copiata nell'ultimo export, se l'export contiene esattamente
+    gli oggetti attesi; None se assente/illeggibile/vecchio formato (=> confronto per content_version).
+    """
+    previous = _previous_versions(con, output_path)
+    if set(previous) != set(objects):
+        return None
+    con.execute(f"ATTACH {_sql_quote_path(output_path.resolve())} AS prev (READ_ONLY)")
+    try:
+        has_versions = con.execute(
+            """
+            SELECT 1
+            FROM information_schema.tables
+            WHERE table_catalog = 'prev' AND table_schema = 'meta' AND table_name = 'gold_versions'
+            """
+        ).fetchone()
+        if not has_versions:
+            return None
+        return con.execute("SELECT MAX(version) FROM prev.meta.gold_versions").fetchone()[0]
+    finally:
+        con.execute("DETACH prev")
+
+
+def _bundled_gold_version(bundle_dir: Path, objects: list[str]) -> int | None:
+    """gold_version del bundle corrente (manifest), se la root esiste e contiene gli oggetti attesi."""
+    current = _read_manifest(bundle_dir / BUNDLE_MANIFEST)
+    if not current or not (bundle_dir / current["root"]).is_dir():
+        return None
+    if set(current.get("objects", {})) != set(objects):
+        return None
+    return current.get("gold_version")
+
+
+def _previous_versions(con: duckdb.DuckDBPyConnection, output_path: Path) -> dict[str, tuple[str, datetime]]:
+    """oggetto -> (content_version, exported_at) dall'export esistente; {} se assente/illeggibile/vecchio formato."""
+    if not output_path.exists():
+        return {}
+    try:
+        con.execute(f"ATTACH {_sql_quote_path(output_path.resolve())} AS prev (READ_ONLY)")
+    except duckdb.Error:
+        return {}
+    try:
+        has_versions = con.execute(
+            """
+            SELECT 1
+            FROM information_schema.columns
+            WHERE table_catalog = 'prev' AND table_schema = 'meta'
+              AND table_name = 'dashboard_metadata' AND column_name = 'content_version'
+            """
+        ).fetchone()
+        if not has_versions:
+            return {}
+        rows = con.execute(
+            "SELECT object_name, content_version, exported_at FROM prev.meta.dashboard_metadata"
+        ).fetchall()
+        return {obj: (version, exported_at) for obj, version, exported_at in rows}
+    finally:
+        con.execute("DETACH prev")
+
+
+def _export_serving_db(
+    con: duckdb.DuckDBPyConnection,
+    output_path: Path,
+    warehouse_db: Path,
+    versions: dict[str, tuple[str, int]],
+    new_gold_version: bool = False,
+) -> None:
+    """
+    dashboard.duckdb: copia del file esistente in un temp, riscrittura dei soli oggetti cambiati, os.replace.
+    new_gold_version: versione gold non ancora esportata => il file si riscrive comunque (meta.gold_versions),
+    così il prossimo export la trova e salta gli hash.
+    """
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    previous = _previous_versions(con, output_path)
+
+    changed = [obj for obj, (version, _) in versions.items() if previous.get(obj, (None,))[0] != version]
+    removed = [obj for obj in previous if obj not in versions]
+    if previous and not changed and not removed and not new_gold_version:
+        print("Export invariato (nessun oggetto cambiato):", output_path.resolve())
+        return
+
+    # temp nella stessa cartella => os.replace atomico (stesso filesystem)
+    tmp_path = output_path.with_name(f".{output_path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        if previous:
+            shutil.copyfile(output_path, tmp_path)
+        else:
+            changed = list(versions)
+
+        con.execute(f"ATTACH {_sql_quote_path(tmp_path.resolve())} AS dst")
+
+        # Schemi target nel DB export
+        con.execute("CREATE SCHEMA IF NOT EXISTS dst.gold")
+        con.execute("CREATE SCHEMA IF NOT EXISTS dst.meta")
+
+        # KPI / dimensioni cambiati -> gold.*
+        for obj in changed:
+            con.execute(f"CREATE OR REPLACE TABLE dst.{obj} AS SELECT * FROM src.{obj}")
+        for obj in removed:
+            con.execute(f"DROP TABLE IF EXISTS dst.{obj}")
+
+        # Versione gold: se manca (pipeline senza publish) la dashboard ripiega sull'mtime del file
+        if _exists_in_src(con, "meta", "gold_versions"):
+            con.execute("CREATE OR REPLACE TABLE dst.meta.gold_versions AS SELECT * FROM src.meta.gold_versions")
+
+        # Metadata nello schema meta: exported_at resta quello dell'ultima copia dell'oggetto
+        now = _utcnow_naive()
+        con.execute(
+            """
+            CREATE OR REPLACE TABLE dst.meta.dashboard_metadata (
+                object_name     VARCHAR,
+                content_version VARCHAR,
+                row_count       BIGINT,
+                exported_at     TIMESTAMP,
+                source_db       VARCHAR,
+                note            VARCHAR
+            )
+            """
+        )
+        con.executemany(
+            "INSERT INTO dst.meta.dashboard_metadata VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                [
+                    obj,
+                    version,
+                    n,
+                    now if obj in changed else previous[obj][1],
+                    str(warehouse_db),
+                    "Serving DB per Streamlit Cloud: KPI + dimensioni (no fact)",
+                ]
+                for obj, (version, n) in versions.items()
+            ],
+        )
+
+        con.execute("DETACH dst")
+        os.replace(tmp_path, output_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+    print(f"Export completato ({len(changed)}/{len(versions)} oggetti aggiornati):", output_path.resolve())
+
+
+def _read_manifest(path: Path) -> dict | None:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _fact_slice_filter(con: duckdb.DuckDBPyConnection) -> str | None:
+    """Filtro sugli ultimi BUNDLE_FACT_MONTHS mesi della fact (date_id = YYYYMMDD); None = niente slice."""
+    if BUNDLE_FACT_MONTHS <= 0:
+        return None
+    max_date_id = con.execute("SELECT MAX(date_id) FROM src.gold.fact_incident").fetchone()[0]
+    if max_date_id is None:
+        return None
+    month_idx = (max_date_id // 10000) * 12 + (max_date_id // 100 % 100 - 1) - (BUNDLE_FACT_MONTHS - 1)
+    return f"date_id >= {(month_idx // 12) * 10000 + (month_idx % 12 + 1) * 100}"
+
+
+def _prune_bundle(bundle_dir: Path, current_root: str) -> None:
+    # le root sono "<timestamp>-<hash>": l'ordine per nome è quello di creazione
+    roots = sorted(p.name for p in bundle_dir.iterdir() if p.is_dir() and not p.name.startswith("."))
+    keep = set(roots[-max(BUNDLE_KEEP_VERSIONS, 1):]) | {current_root}
+    for name in roots:
+        if name not in keep:
+            shutil.rmtree(bundle_dir / name, ignore_errors=True)
+
+
+def _export_bundle(
+    con: duckdb.DuckDBPyConnection,
+    bundle_dir: Path,
+    warehouse_db: Path,
+    versions: dict[str, tuple[str, int]],
+    gold_version: int | None,
+) -> None:
+    """
+    Bundle Parquet versionato (zstd) per la dashboard:
+      <bundle_dir>/<root>/gold/<oggetto>.parquet        KPI + dimensioni
+      <bundle_dir>/<root>/fact_incident/year=/month=/   ultimi BUNDLE_FACT_MONTHS mesi della fact (drill-down)
+      <bundle_dir>/<root>/manifest.json
+      <bundle_dir>/manifest.json                        puntatore alla root corrente (scritto per ultimo)
+    Contenuto invariato (stesse content_version) => bundle saltato.
+    """
+    fact_filter = _fact_slice_filter(con)
+    fact_version = _content_version(con, "gold", "fact_incident", fact_filter) if fact_filter else None
+
+    content = {obj: version for obj, (version, _) in versions.items()}
+    if fact_version:
+        content["gold.fact_incident"] = f"{fact_filter}:{fact_version[0]}"
+    content_hash = hashlib.md5(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+    current = _read_manifest(bundle_dir / BUNDLE_MANIFEST)
+    if current and current.get("content_hash") == content_hash and (bundle_dir / current["root"]).is_dir():
+        if current.get("gold_version") != gold_version:
+            # stesso contenuto, gold ripubblicato: si aggiorna solo il puntatore (prossimo export senza hash)
+            current["gold_version"] = gold_version
+            tmp_manifest = bundle_dir / f".{BUNDLE_MANIFEST}.{uuid.uuid4().hex}.tmp"
+            tmp_manifest.write_text(json.dumps(current, indent=2), encoding="utf-8")
+            os.replace(tmp_manifest, bundle_dir / BUNDLE_MANIFEST)
+        print("Bundle invariato (nessun oggetto cambiato):", (bundle_dir / current["root"]).resolve())
+        return
+
+    now = _utcnow_naive()
+    root = f"{now:%Y%m%dT%H%M%S%f}-{content_hash}"
+    staging = bundle_dir / f".{root}.tmp"
+    try:
+        (staging / "gold").mkdir(parents=True)
+
+        objects = {}
+        for obj, (version, n) in versions.items():
+            schema, name = obj.split(".")
+            rel = f"{schema}/{name}.parquet"
+            con.execute(
+                f"COPY (SELECT * FROM src.{obj}) TO {_sql_quote_path(staging / rel)} (FORMAT PARQUET, COMPRESSION ZSTD)"
+            )
+            objects[obj] = {"path": rel, "rows": n, "content_version": version}
+
+        fact_slice = None
+        if fact_version:
+            con.execute(
+                f"""
+                COPY (
+                  SELECT
+                    *,
+                    CAST(date_id // 10000 AS INTEGER) AS year,
+                    CAST(date_id // 100 % 100 AS INTEGER) AS month
+                  FROM src.gold.fact_incident
+                  WHERE {fact_filter}
+                ) TO {_sql_quote_path(staging / "fact_incident")} (
+                  FORMAT PARQUET,
+                  COMPRESSION ZSTD,
+                  PARTITION_BY (year, month)
+                )
+                """
+            )
+            months = con.execute(
+                f"""
+                SELECT DISTINCT CAST(date_id // 10000 AS INTEGER), CAST(date_id // 100 % 100 AS INTEGER)
+                FROM src.gold.fact_incident
+                WHERE {fact_filter}
+                ORDER BY 1, 2
+                """
+            ).fetchall()
+            fact_slice = {
+                "path": "fact_incident",
+                "partition_by": ["year", "month"],
+                "months": [{"year": y, "month": m, "path": f"fact_incident/year={y}/month={m}"} for y, m in months],
+                "rows": fact_version[1],
+                "content_version": fact_version[0],
+            }
+
+        manifest = {
+            "format": 1,
+            "root": root,
+            "created_at": now.isoformat(),
+            "content_hash": content_hash,
+            "gold_version": gold_version,
+            "source_db": str(warehouse_db),
+            "objects": objects,
+            "fact_slice": fact_slice,
+        }
+        (staging / BUNDLE_MANIFEST).write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+
+        # directory completa prima, puntatore dopo: un lettore vede sempre un bundle intero
+        os.replace(staging, bundle_dir / root)
+        tmp_manifest = bundle_dir / f".{BUNDLE_MANIFEST}.{uuid.uuid4().hex}.tmp"
+        tmp_manifest.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+        os.replace(tmp_manifest, bundle_dir / BUNDLE_MANIFEST)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+    _prune_bundle(bundle_dir, root)
+    print(f"Bundle completato ({len(objects)} oggetti, fact slice: {bool(fact_slice)}):", (bundle_dir / root).resolve())
+
+
 def export_dashboard_db(
     output_path: str | Path = DEFAULT_EXPORT_DB,
     warehouse_db: str | Path = DEFAULT_WAREHOUSE_DB,
+    bundle_dir: str | Path | None = DEFAULT_BUNDLE_DIR,
 ) -> Path:
     """
     Export serving DB cloud-friendly (dashboard.duckdb) con:
       - KPI (gold.v_kpi_*)
-      - Dimensioni (gold.dim_*)
-      - Metadata (meta.dashboard_metadata)
+      - Dimensioni (gold.dim_*) + opzioni dei filtri (gold.filter_options)
+      - Metadata (meta.dashboard_metadata: una riga per oggetto con content_version)
+      - Versioni gold pubblicate (meta.gold_versions, chiave della cache della dashboard)
 
-    Non esporta fact_incident (troppo grande).
+    Incrementale e atomico:
+      - max(version) di meta.gold_versions uguale a quella dell'ultimo export (serving DB / manifest
+        del bundle) => export saltato senza calcolare le content_version (nessun full scan);
+      - content_version per oggetto confrontata con quella dell'export esistente;
+        nessun oggetto cambiato => export saltato (file invariato);
+      - altrimenti copia del file esistente in un temp nella stessa cartella, riscrittura dei soli
+        oggetti cambiati, poi os.replace sul file finale: i lettori vedono sempre un file completo.
+
+    Il .duckdb non contiene fact_incident (troppo grande). Con bundle_dir (default da
+    DASHBOARD_BUNDLE_DIR, None = disabilitato) scrive anche il bundle Parquet versionato,
+    che include gli ultimi mesi della fact per il drill-down (vedi _export_bundle).
     """
     warehouse_db = Path(warehouse_db)
     output_path = Path(output_path)
@@ -66,75 +401,50 @@ def export_dashboard_db(
     if not warehouse_db.exists():
         raise FileNotFoundError(f"Warehouse DB non trovato: {warehouse_db}")
 
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-
-    # rigenera sempre
-    if output_path.exists():
-        output_path.unlink()
-
-    dst = duckdb.connect(str(output_path))
+    objects = [("gold", view) for view in KPI_VIEWS] + [("gold", dim) for dim in DIM_TABLES]
+    object_names = [f"{schema}.{name}" for schema, name in objects]
 
-    # ATTACH sorgente in read-only
-    attached = _sql_quote_path(warehouse_db.resolve())
-    dst.execute(f"ATTACH {attached} AS src (READ_ONLY)")
+    # connessione in-memory: src (warehouse) + prev/dst attaccati quando servono
+    con = duckdb.connect()
+    try:
+        # ATTACH sorgente in read-only
+        con.execute(f"ATTACH {_sql_quote_path(warehouse_db.resolve())} AS src (READ_ONLY)")
 
-    # Schemi target nel DB export
-    dst.execute("CREATE SCHEMA IF NOT EXISTS gold")
-    dst.execute("CREATE SCHEMA IF NOT EXISTS meta")
+        for schema, name in objects:
+            if not _exists_in_src(con, schema, name):
+                raise RuntimeError(
+                    f"Nel warehouse mancano oggetti richiesti: src.{schema}.{name}. "
+                    f"Esegui la pipeline fino al GOLD prima dell'export."
+                )
 
-    # Metadata nello schema meta
-    dst.execute(
-        """
-        CREATE TABLE meta.dashboard_metadata (
-            exported_at TIMESTAMP,
-            source_db   VARCHAR,
-            note        VARCHAR
+        # Gold non ripubblicato dall'ultimo export => niente hash del contenuto
+        gold_version = _src_gold_version(con)
+        serving_current = (
+            gold_version is not None
+            and _exported_gold_version(con, output_path, object_names) == gold_version
         )
-        """
-    )
-    dst.execute(
-        "INSERT INTO meta.dashboard_metadata VALUES (?, ?, ?)",
-        [
-            _utcnow_naive(),
-            str(warehouse_db),
-            "Serving DB per Streamlit Cloud: KPI + dimensioni (no fact)",
-        ],
-    )
-
-    # Export KPI -> gold.*
-    for view in KPI_VIEWS:
-        if not _exists_in_src(dst, "gold", view):
-            raise RuntimeError(
-                f"Nel warehouse mancano oggetti richiesti: src.gold.{view}. "
-                f"Esegui la pipeline fino al GOLD prima dell'export."
-            )
-        dst.execute(f"DROP TABLE IF EXISTS gold.{view}")
-        dst.execute(
-            f"""
-            CREATE TABLE gold.{view} AS
-            SELECT * FROM src.gold.{view}
-            """
+        bundle_current = bundle_dir is None or (
+            gold_version is not None
+            and _bundled_gold_version(Path(bundle_dir), object_names) == gold_version
         )
 
-    # Export dimensions -> gold.*
-    for dim in DIM_TABLES:
-        if not _exists_in_src(dst, "gold", dim):
-            raise RuntimeError(
-                f"Nel warehouse mancano oggetti richiesti: src.gold.{dim}. "
-                f"Esegui la pipeline fino al GOLD prima dell'export."
-            )
-        dst.execute(f"DROP TABLE IF EXISTS gold.{dim}")
-        dst.execute(
-            f"""
-            CREATE TABLE gold.{dim} AS
-            SELECT * FROM src.gold.{dim}
-            """
-        )
+        if serving_current:
+            print(f"Export invariato (gold version {gold_version} già esportata):", output_path.resolve())
+        if bundle_dir is not None and bundle_current:
+            print(f"Bundle invariato (gold version {gold_version} già esportata):", Path(bundle_dir).resolve())
+
+        if not (serving_current and bundle_current):
+            versions = {f"{schema}.{name}": _content_version(con, schema, name) for schema, name in objects}
+
+            if not serving_current:
+                _export_serving_db(con, output_path, warehouse_db, versions, gold_version is not None)
+            if not bundle_current:
+                _export_bundle(con, Path(bundle_dir), warehouse_db, versions, gold_version)
 
-    dst.execute("DETACH src")
-    dst.close()
+        con.execute("DETACH src")
+    finally:
+        con.close()
 
-    print("Export completato:", output_path.resolve())
     return output_path
 
 
@@ -1,349 +1,731 @@
+import os
+
 from prefect import task, get_run_logger
 from etl.utils import get_db_connection, Schemas
 
+# Staging gold: join calls↔incidents + chiave location materializzati una volta per run
+# (build_gold_staging) e letti da dim_incident_type, dim_location e fact_incident.
+# GOLD_KEEP_STAGING=1 la lascia nel warehouse a fine run (debug / ispezione).
+_STG = f"{Schemas.GOLD}._stg_call_incident"
+GOLD_KEEP_STAGING = os.getenv("GOLD_KEEP_STAGING", "0") == "1"
+
+
+# -------------------------
+# SQL condiviso full / incrementale
+# -------------------------
+# Chiavi toccate dall'ultima silver incrementale (vedi clean_silver_phase2)
+_DELTA_CALLS = f"{Schemas.SILVER}._delta_call_number"
+_DELTA_INCIDENTS = f"{Schemas.SILVER}._delta_incident_number"
+
+# Mesi (year, month) della fact riscritti in incrementale, consumati dal KPI cube (kpi_cube.py).
+# Tabella assente = mesi sconosciuti (dopo una full rebuild della fact) => cube in full.
+DELTA_FACT_MONTHS = f"{Schemas.GOLD}._delta_fact_months"
+
+
+def _delta_call_filter(alias: str = "c") -> str:
+    """Call "toccata" se cambia la call stessa o l'incident a cui è agganciata."""
+    return f"""
+    (
+        {alias}.call_number IN (SELECT call_number FROM {_DELTA_CALLS})
+        OR {alias}.incident_number IN (SELECT incident_number FROM {_DELTA_INCIDENTS})
+    )
+    """
+
+
+_DIM_DATE_SELECT = """
+SELECT
+    -- chiave surrogate semplice: YYYYMMDD
+    CAST(strftime(d, '%Y%m%d') AS BIGINT) AS date_id,
+    d AS date,
+    EXTRACT(year FROM d)::INT  AS year,
+    EXTRACT(month FROM d)::INT AS month,
+    EXTRACT(day FROM d)::INT   AS day,
+    EXTRACT(dow FROM d)::INT   AS weekday,
+    EXTRACT(week FROM d)::INT  AS week_of_year,
+    CASE WHEN EXTRACT(dow FROM d) IN (0,6) THEN TRUE ELSE FALSE END AS is_weekend
+FROM all_dates
+"""
+
+# normalizzazione location IDENTICA tra dim_location e fact_incident
+_LOCATION_NORMALIZED_COLS = """
+NULLIF(TRIM(COALESCE(c_address, i_address)), '') AS address,
+NULLIF(TRIM(COALESCE(c_city, i_city)), '') AS city,
+COALESCE(c_zipcode, i_zipcode) AS zipcode,
+NULLIF(TRIM(COALESCE(c_neighborhood, i_neighborhood)), '') AS neighborhood,
+NULLIF(TRIM(COALESCE(c_battalion, i_battalion)), '') AS battalion,
+NULLIF(TRIM(COALESCE(c_station_area, i_station_area)), '') AS station_area,
+COALESCE(c_supervisor_district, i_supervisor_district) AS supervisor_district,
+NULLIF(TRIM(c_fire_prevention_district), '') AS fire_prevention_district,
+
+-- mismatch risolto forzando VARCHAR (patch eseguita dopo gold gate)
+NULLIF(TRIM(COALESCE(CAST(c_box AS VARCHAR), CAST(i_box AS VARCHAR))), '') AS box,
+
+NULLIF(TRIM(COALESCE(c_location_point, i_location_point)), '') AS location_point
+"""
+
+# Chiave per join fact↔dim: hash 64 bit (UBIGINT) sulle colonne normalizzate, join su intero
+# invece che su stringa. hash() di DuckDB non è garantito stabile tra versioni: la versione
+# che ha calcolato le chiavi è nel COMMENT di dim_location e se cambia si rifà dim + fact
+# (vedi _drop_outdated_location_tables). Le collisioni le blocca il gate gold.
+_LOCATION_KEY_COLS = [
+    "address", "city", "zipcode", "neighborhood", "battalion", "station_area",
+    "supervisor_district", "fire_prevention_district", "box", "location_point",
+]
+_LOCATION_KEY_SQL = f"hash({', '.join(_LOCATION_KEY_COLS)})"
+_LOCATION_KEY_TYPE = "UBIGINT"
+
+# md5 esadecimale (vecchia location_key) solo per compatibilità con consumer esterni
+GOLD_LOCATION_KEY_MD5 = os.getenv("GOLD_LOCATION_KEY_MD5", "0") == "1"
+_LOCATION_KEY_MD5_SQL = """
+md5(
+    COALESCE(address,'') || '|' ||
+    COALESCE(city,'') || '|' ||
+    COALESCE(CAST(zipcode AS VARCHAR),'') || '|' ||
+    COALESCE(neighborhood,'') || '|' ||
+    COALESCE(battalion,'') || '|' ||
+    COALESCE(station_area,'') || '|' ||
+    COALESCE(CAST(supervisor_district AS VARCHAR),'') || '|' ||
+    COALESCE(fire_prevention_district,'') || '|' ||
+    COALESCE(box,'') || '|' ||
+    COALESCE(location_point,'')
+)
+"""
+
+
+def _location_key_tag(con) -> str:
+    """Tag salvato come COMMENT di dim_location: identifica chi ha calcolato le location_key."""
+    version = con.execute("SELECT version()").fetchone()[0]
+    return f"location_key {_LOCATION_KEY_TYPE} hash() DuckDB {version}"
+
+
+def _location_dim_cols() -> str:
+    """Colonne di dim_location dopo location_key (location_key_md5 solo se abilitata)."""
+    return ", ".join((["location_key_md5"] if GOLD_LOCATION_KEY_MD5 else []) + _LOCATION_KEY_COLS)
+
+
+_LOCATION_SOURCE_ALIASES = [
+    "c_address", "c_city", "c_zipcode", "c_neighborhood", "c_battalion", "c_station_area",
+    "c_supervisor_district", "c_fire_prevention_district", "c_box", "c_location_point",
+    "i_address", "i_city", "i_zipcode", "i_neighborhood", "i_battalion", "i_station_area",
+    "i_supervisor_district", "i_box", "i_location_point",
+]
+
+_LOCATION_SOURCE_COLS = """
+c.address AS c_address,
+c.city AS c_city,
+c.zipcode_of_incident AS c_zipcode,
+c.neighborhoods_analysis_boundaries AS c_neighborhood,
+c.battalion AS c_battalion,
+c.station_area AS c_station_area,
+c.supervisor_district AS c_supervisor_district,
+c.fire_prevention_district AS c_fire_prevention_district,
+c.box AS c_box,
+c.location AS c_location_point,
+
+i.address AS i_address,
+i.city AS i_city,
+i.zipcode AS i_zipcode,
+i.neighborhood_district AS i_neighborhood,
+i.battalion AS i_battalion,
+i.station_area AS i_station_area,
+i.supervisor_district AS i_supervisor_district,
+i.box AS i_box,
+i.location AS i_location_point
+"""
+
+
+def _table_exists(con, schema: str, table: str) -> bool:
+    row = con.execute(
+        """
+        SELECT 1
+        FROM information_schema.tables
+        WHERE table_schema = ? AND table_name = ?
+        LIMIT 1
+        """,
+        [schema, table],
+    ).fetchone()
+    return row is not None
+
+
+def _use_incremental(con, incremental: bool, table: str) -> bool:
+    """Incrementale solo se richiesto, se la tabella gold esiste e se la silver ha prodotto chiavi delta."""
+    return (
+        incremental
+        and _table_exists(con, Schemas.GOLD, table)
+        and _table_exists(con, Schemas.SILVER, "_delta_call_number")
+        and _table_exists(con, Schemas.SILVER, "_delta_incident_number")
+    )
+
+
+def _run_in_transaction(con, *statements: str) -> None:
+    con.execute("BEGIN TRANSACTION")
+    try:
+        for sql in statements:
+            con.execute(sql)
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+
+
+def _stg_filter(call_filter: str = "", not_null_incident: bool = False) -> str:
+    conds = (["s.incident_number IS NOT NULL"] if not_null_incident else []) + ([call_filter] if call_filter else [])
+    return f"WHERE {' AND '.join(conds)}" if conds else ""
+
+
+def _stg_call_incident_sql(call_filter: str = "") -> str:
+    """Join calls↔incidents + normalizzazione/chiave location, calcolati una volta per run."""
+    return f"""
+    WITH base AS (
+        SELECT
+            c.call_number,
+            c.incident_number,
+
+            -- timestamps principali (calls)
+            c.received_ts,
+            c.dispatch_ts,
+            c.response_ts,
+            c.on_scene_ts,
+
+            -- misure già calcolate in silver
+            c.response_time_sec,
+            c.dispatch_delay_sec,
+            c.travel_time_sec,
+
+            -- severity / risorse (mix calls+incidents)
+            c.number_of_alarms AS c_number_of_alarms,
+            i.number_of_alarms AS i_number_of_alarms,
+            i.suppression_units,
+            i.suppression_personnel,
+            i.ems_units,
+            i.ems_personnel,
+            i.other_units,
+            i.other_personnel,
+            i.estimated_property_loss,
+            i.estimated_contents_loss,
+
+            -- tipo incidente
+            c.call_type,
+            c.call_type_group,
+            i.primary_situation,
+            c.final_priority,
+
+            -- date (per dim_date)
+            c.call_date,
+            i.incident_date,
+
+            -- close (per duration)
+            i.close_ts,
+
+            -- location fields per hash (altrimenti si avevano troppi mismatch)
+            {_LOCATION_SOURCE_COLS}
+        FROM silver.calls_clean c
+        LEFT JOIN silver.incidents_clean i
+          ON i.incident_number = c.incident_number
+        {f"WHERE {call_filter}" if call_filter else ""}
+    ),
+    loc_keys AS (
+        SELECT
+            * EXCLUDE ({", ".join(_LOCATION_SOURCE_ALIASES)}),
+            -- normalizzazione unica per dim_location e fact
+            {_LOCATION_NORMALIZED_COLS}
+        FROM base
+    )
+    SELECT
+        *,
+        {_LOCATION_KEY_SQL} AS location_key,
+        {f"{_LOCATION_KEY_MD5_SQL} AS location_key_md5," if GOLD_LOCATION_KEY_MD5 else ""}
+        COALESCE(incident_date, call_date) AS event_date
+    FROM loc_keys
+    """
+
+
+def _dim_incident_type_cleaned_sql(call_filter: str = "") -> str:
+    return f"""
+    WITH cleaned AS (
+        SELECT DISTINCT
+            NULLIF(TRIM(call_type), '') AS call_type,
+            NULLIF(TRIM(call_type_group), '') AS call_type_group,
+            final_priority,
+            NULLIF(TRIM(primary_situation), '') AS primary_situation
+        FROM {_STG} s
+        {_stg_filter(call_filter, not_null_incident=True)}
+          AND (
+            call_type IS NOT NULL
+            OR call_type_group IS NOT NULL
+            OR final_priority IS NOT NULL
+            OR primary_situation IS NOT NULL
+        )
+    )
+    """
 
-@task(name="gold_dim_date")
-def build_dim_date() -> None:
-    logger = get_run_logger()
-
-    with get_db_connection() as con:
-        con.execute(f"CREATE SCHEMA IF NOT EXISTS {Schemas.GOLD}")
-
-        # Ricostruisco dim_date prendendo TUTTE le date presenti (calls + incidents)
-        con.execute("DROP TABLE IF EXISTS gold.dim_date")
 
-        con.execute("""
-        CREATE TABLE gold.dim_date AS
+def _dim_location_keyed_sql(call_filter: str = "") -> str:
+    return f"""
+    WITH keyed AS (
+        SELECT DISTINCT
+            location_key,
+            {_location_dim_cols()}
+        FROM {_STG} s
+        {_stg_filter(call_filter)}
+    )
+    """
+
+
+def _fact_select_sql(call_filter: str = "") -> str:
+    """SELECT della fact (senza incident_id), opzionalmente limitata alle call toccate."""
+    return f"""
+    WITH d AS (
+        SELECT *
+        FROM {_STG} s
+        {_stg_filter(call_filter, not_null_incident=True)}
+          AND event_date IS NOT NULL
+    )
+    SELECT
+        d.incident_number,
+        d.call_number,
+
+        dd.date_id,
+
+        -- Join su chiave hash => coverage piena
+        dl.location_id,
+
+        dit.incident_type_id,
+
+        d.received_ts,
+        d.dispatch_ts,
+        d.response_ts,
+        d.on_scene_ts,
+        d.close_ts,
+
+        d.response_time_sec,
+        d.dispatch_delay_sec,
+        d.travel_time_sec,
+
+        CASE
+          WHEN d.received_ts IS NOT NULL AND d.close_ts IS NOT NULL
+           AND datediff('second', d.received_ts, d.close_ts) >= 0
+          THEN datediff('second', d.received_ts, d.close_ts)
+          ELSE NULL
+        END AS incident_duration_sec,
+
+        COALESCE(d.c_number_of_alarms, d.i_number_of_alarms) AS number_of_alarms,
+        d.suppression_units,
+        d.suppression_personnel,
+        d.ems_units,
+        d.ems_personnel,
+        d.other_units,
+        d.other_personnel,
+        d.estimated_property_loss,
+        d.estimated_contents_loss,
+
+        d.final_priority
+    FROM d
+    LEFT JOIN gold.dim_date dd
+      ON dd.date = CAST(d.event_date AS DATE)
+    LEFT JOIN gold.dim_location dl
+      ON dl.location_key = d.location_key
+    LEFT JOIN gold.dim_incident_type dit
+      ON dit.call_type IS NOT DISTINCT FROM NULLIF(TRIM(d.call_type), '')
+     AND dit.call_type_group IS NOT DISTINCT FROM NULLIF(TRIM(d.call_type_group), '')
+     AND dit.primary_situation IS NOT DISTINCT FROM NULLIF(TRIM(d.primary_situation), '')
+     AND dit.final_priority IS NOT DISTINCT FROM d.final_priority
+    """
+
+
+def _build_dim_date(con, logger, incremental: bool) -> None:
+    if _use_incremental(con, incremental, "dim_date"):
+        con.execute(f"""
+        INSERT INTO gold.dim_date
         WITH all_dates AS (
             SELECT DISTINCT call_date AS d
             FROM silver.calls_clean
             WHERE call_date IS NOT NULL
+              AND call_number IN (SELECT call_number FROM {_DELTA_CALLS})
 
             UNION
 
             SELECT DISTINCT incident_date AS d
             FROM silver.incidents_clean
             WHERE incident_date IS NOT NULL
+              AND incident_number IN (SELECT incident_number FROM {_DELTA_INCIDENTS})
         )
-        SELECT
-            -- chiave surrogate semplice: YYYYMMDD
-            CAST(strftime(d, '%Y%m%d') AS BIGINT) AS date_id,
-            d AS date,
-            EXTRACT(year FROM d)::INT  AS year,
-            EXTRACT(month FROM d)::INT AS month,
-            EXTRACT(day FROM d)::INT   AS day,
-            EXTRACT(dow FROM d)::INT   AS weekday,          
-            EXTRACT(week FROM d)::INT  AS week_of_year,
-            CASE WHEN EXTRACT(dow FROM d) IN (0,6) THEN TRUE ELSE FALSE END AS is_weekend
-        FROM all_dates
+        {_DIM_DATE_SELECT}
+        WHERE d NOT IN (SELECT date FROM gold.dim_date)
         ORDER BY d
         """)
 
         n = con.execute("SELECT COUNT(*) FROM gold.dim_date").fetchone()[0]
-        logger.info(f"Creata gold.dim_date (righe: {n:,})")
+        logger.info(f"Aggiornata gold.dim_date in incrementale (righe: {n:,})")
+        return
+
+    # Ricostruisco dim_date prendendo TUTTE le date presenti (calls + incidents)
+    con.execute("DROP TABLE IF EXISTS gold.dim_date")
+
+    con.execute(f"""
+    CREATE TABLE gold.dim_date AS
+    WITH all_dates AS (
+        SELECT DISTINCT call_date AS d
+        FROM silver.calls_clean
+        WHERE call_date IS NOT NULL
+
+        UNION
+
+        SELECT DISTINCT incident_date AS d
+        FROM silver.incidents_clean
+        WHERE incident_date IS NOT NULL
+    )
+    {_DIM_DATE_SELECT}
+    ORDER BY d
+    """)
+
+    n = con.execute("SELECT COUNT(*) FROM gold.dim_date").fetchone()[0]
+    logger.info(f"Creata gold.dim_date (righe: {n:,})")
+
+
+def _drop_outdated_location_tables(con, logger) -> None:
+    """
+    dim_location con location_key di altro tipo (es. md5 VARCHAR), con/senza location_key_md5
+    in modo diverso dalla config o calcolata da un'altra versione di DuckDB (hash() può cambiare,
+    le chiavi nuove non farebbero match con le vecchie): non si può aggiornare in incrementale.
+    Drop di dim_location e della fact (i suoi location_id puntano alla dim) => full rebuild.
+    """
+    if not _table_exists(con, Schemas.GOLD, "dim_location"):
+        return
+    cols = dict(
+        con.execute(
+            """
+            SELECT column_name, data_type
+            FROM information_schema.columns
+            WHERE table_schema = ? AND table_name = 'dim_location'
+            """,
+            [Schemas.GOLD],
+        ).fetchall()
+    )
+    tag = con.execute(
+        "SELECT comment FROM duckdb_tables() WHERE schema_name = ? AND table_name = 'dim_location'",
+        [Schemas.GOLD],
+    ).fetchone()[0]
+    expected = _location_key_tag(con)
+    if (
+        cols.get("location_key") == _LOCATION_KEY_TYPE
+        and ("location_key_md5" in cols) == GOLD_LOCATION_KEY_MD5
+        and tag == expected
+    ):
+        return
+
+    if tag != expected:
+        logger.warning(f"location_key calcolate con '{tag}', ora '{expected}': chiavi non confrontabili")
+    logger.warning("Schema location_key cambiato: drop di gold.dim_location e gold.fact_incident (full rebuild)")
+    con.execute("DROP TABLE IF EXISTS gold.fact_incident")
+    con.execute("DROP TABLE gold.dim_location")
+
+
+def _drop_fact_if_dims_rebuilt(con, logger, incremental: bool) -> None:
+    """
+    dim_incident_type / dim_location in full rebuild (tabella mancante, o droppata sopra)
+    rinumerano gli id da 1: le righe della fact non riscritte in incrementale punterebbero
+    alle dimensioni sbagliate. Drop della fact => full rebuild anche per lei.
+    """
+    if not incremental or not _table_exists(con, Schemas.GOLD, "fact_incident"):
+        return
+    rebuilt = [t for t in ("dim_incident_type", "dim_location") if not _use_incremental(con, incremental, t)]
+    if not rebuilt:
+        return
+
+    logger.warning(f"{', '.join(rebuilt)} in full rebuild: drop di gold.fact_incident (full rebuild)")
+    con.execute("DROP TABLE gold.fact_incident")
+
+
+def _require_staging(con) -> None:
+    if not _table_exists(con, Schemas.GOLD, "_stg_call_incident"):
+        raise RuntimeError(f"{_STG} mancante: eseguire build_gold_staging prima di dims/fact.")
+
+
+@task(name="gold_staging")
+def build_gold_staging(incremental: bool = False) -> None:
+    """
+    Materializza gold._stg_call_incident (join silver + location_key) per dims e fact.
+
+    Limitata alle call delta solo se TUTTI i consumer sono in incrementale: se anche uno
+    solo va in full rebuild (es. tabella gold mancante) serve la staging completa.
+    Una dimensione in full rebuild porta in full anche la fact (id della dim rinumerati).
+    """
+    logger = get_run_logger()
 
+    with get_db_connection() as con:
+        con.execute(f"CREATE SCHEMA IF NOT EXISTS {Schemas.GOLD}")
+        _drop_outdated_location_tables(con, logger)
+        _drop_fact_if_dims_rebuilt(con, logger, incremental)
 
-@task(name="gold_dim_incident_type")
-def build_dim_incident_type() -> None:
+        delta_only = all(
+            _use_incremental(con, incremental, t)
+            for t in ("dim_incident_type", "dim_location", "fact_incident")
+        )
+        n = con.execute(f"""
+        CREATE OR REPLACE TABLE {_STG} AS
+        {_stg_call_incident_sql(_delta_call_filter() if delta_only else "")}
+        """).fetchone()[0]
+
+        logger.info(f"Creata {_STG} ({'delta' if delta_only else 'full'}, righe: {n:,})")
+
+
+@task(name="gold_staging_drop")
+def drop_gold_staging() -> None:
+    """Drop della staging a fine gold (se GOLD_KEEP_STAGING non è attivo)."""
     logger = get_run_logger()
 
+    if GOLD_KEEP_STAGING:
+        logger.info(f"GOLD_KEEP_STAGING=1: {_STG} mantenuta")
+        return
+
     with get_db_connection() as con:
-        con.execute(f"CREATE SCHEMA IF NOT EXISTS {Schemas.GOLD}")
-        con.execute("DROP TABLE IF EXISTS gold.dim_incident_type")
+        con.execute(f"DROP TABLE IF EXISTS {_STG}")
 
-        con.execute("""
-        CREATE TABLE gold.dim_incident_type AS
-        WITH base AS (
-            SELECT
-                c.call_type,
-                c.call_type_group,
-                c.final_priority,
-                i.primary_situation
-            FROM silver.calls_clean c
-            LEFT JOIN silver.incidents_clean i
-              ON i.incident_number = c.incident_number
-            WHERE c.incident_number IS NOT NULL
-        ),
-        cleaned AS (
-            SELECT DISTINCT
-                NULLIF(TRIM(call_type), '') AS call_type,
-                NULLIF(TRIM(call_type_group), '') AS call_type_group,
-                final_priority,
-                NULLIF(TRIM(primary_situation), '') AS primary_situation
-            FROM base
-            WHERE
-                call_type IS NOT NULL
-                OR call_type_group IS NOT NULL
-                OR final_priority IS NOT NULL
-                OR primary_situation IS NOT NULL
+
+@task(name="gold_dim_date")
+def build_dim_date(incremental: bool = False) -> None:
+    """
+    dim_date con date_id = YYYYMMDD (già stabile tra le run).
+    Incrementale: aggiunge solo le date nuove delle chiavi delta.
+    Le dimensioni in incrementale sono append-only: righe non più referenziate
+    dalla fact restano fino alla prossima full rebuild.
+    """
+    logger = get_run_logger()
+
+    with get_db_connection() as con:
+        con.execute(f"CREATE SCHEMA IF NOT EXISTS {Schemas.GOLD}")
+        _build_dim_date(con, logger, incremental)
+
+
+def _build_dim_incident_type(con, logger, incremental: bool) -> None:
+    _require_staging(con)
+
+    if _use_incremental(con, incremental, "dim_incident_type"):
+        con.execute(f"""
+        INSERT INTO gold.dim_incident_type
+        {_dim_incident_type_cleaned_sql(_delta_call_filter("s"))},
+        new_types AS (
+            SELECT n.*
+            FROM cleaned n
+            WHERE NOT EXISTS (
+                SELECT 1
+                FROM gold.dim_incident_type t
+                WHERE t.call_type IS NOT DISTINCT FROM n.call_type
+                  AND t.call_type_group IS NOT DISTINCT FROM n.call_type_group
+                  AND t.primary_situation IS NOT DISTINCT FROM n.primary_situation
+                  AND t.final_priority IS NOT DISTINCT FROM n.final_priority
+            )
         )
         SELECT
-            row_number() OVER (ORDER BY
+            (SELECT COALESCE(MAX(incident_type_id), 0) FROM gold.dim_incident_type)
+            + row_number() OVER (ORDER BY
                 call_type, call_type_group, primary_situation, final_priority
             ) AS incident_type_id,
             call_type,
             call_type_group,
             primary_situation,
             final_priority
-        FROM cleaned
-        ;
+        FROM new_types
         """)
 
         n = con.execute("SELECT COUNT(*) FROM gold.dim_incident_type").fetchone()[0]
-        logger.info(f"Creata gold.dim_incident_type (righe: {n:,})")
+        logger.info(f"Aggiornata gold.dim_incident_type in incrementale (righe: {n:,})")
+        return
+
+    con.execute("DROP TABLE IF EXISTS gold.dim_incident_type")
+
+    con.execute(f"""
+    CREATE TABLE gold.dim_incident_type AS
+    {_dim_incident_type_cleaned_sql()}
+    SELECT
+        row_number() OVER (ORDER BY
+            call_type, call_type_group, primary_situation, final_priority
+        ) AS incident_type_id,
+        call_type,
+        call_type_group,
+        primary_situation,
+        final_priority
+    FROM cleaned
+    ;
+    """)
+
+    n = con.execute("SELECT COUNT(*) FROM gold.dim_incident_type").fetchone()[0]
+    logger.info(f"Creata gold.dim_incident_type (righe: {n:,})")
 
 
-@task(name="gold_dim_location")
-def build_dim_location() -> None:
+@task(name="gold_dim_incident_type")
+def build_dim_incident_type(incremental: bool = False) -> None:
+    """
+    Incrementale: le nuove combinazioni ricevono id = max(id) + n, gli id esistenti non cambiano.
+    """
     logger = get_run_logger()
 
     with get_db_connection() as con:
         con.execute(f"CREATE SCHEMA IF NOT EXISTS {Schemas.GOLD}")
-        con.execute("DROP TABLE IF EXISTS gold.dim_location")
+        _build_dim_incident_type(con, logger, incremental)
 
-        con.execute("""
-        CREATE TABLE gold.dim_location AS
-        WITH base AS (
-            SELECT
-                c.address AS c_address,
-                c.city AS c_city,
-                c.zipcode_of_incident AS c_zipcode,
-                c.neighborhoods_analysis_boundaries AS c_neighborhood,
-                c.battalion AS c_battalion,
-                c.station_area AS c_station_area,
-                c.supervisor_district AS c_supervisor_district,
-                c.fire_prevention_district AS c_fire_prevention_district,
-                c.box AS c_box,
-                c.location AS c_location_point,
-
-                i.address AS i_address,
-                i.city AS i_city,
-                i.zipcode AS i_zipcode,
-                i.neighborhood_district AS i_neighborhood,
-                i.battalion AS i_battalion,
-                i.station_area AS i_station_area,
-                i.supervisor_district AS i_supervisor_district,
-                i.box AS i_box,
-                i.location AS i_location_point
-            FROM silver.calls_clean c
-            LEFT JOIN silver.incidents_clean i
-              ON i.incident_number = c.incident_number
-        ),
-        keys AS (
-            SELECT DISTINCT
-                NULLIF(TRIM(COALESCE(c_address, i_address)), '') AS address,
-                NULLIF(TRIM(COALESCE(c_city, i_city)), '') AS city,
-                COALESCE(c_zipcode, i_zipcode) AS zipcode,
-                NULLIF(TRIM(COALESCE(c_neighborhood, i_neighborhood)), '') AS neighborhood,
-                NULLIF(TRIM(COALESCE(c_battalion, i_battalion)), '') AS battalion,
-                NULLIF(TRIM(COALESCE(c_station_area, i_station_area)), '') AS station_area,
-                COALESCE(c_supervisor_district, i_supervisor_district) AS supervisor_district,
-                NULLIF(TRIM(c_fire_prevention_district), '') AS fire_prevention_district,
-
-                -- mismatch risolto forzando VARCHAR (patch eseguita dopo gold gate)
-                NULLIF(TRIM(COALESCE(CAST(c_box AS VARCHAR), CAST(i_box AS VARCHAR))), '') AS box,
-
-                NULLIF(TRIM(COALESCE(c_location_point, i_location_point)), '') AS location_point
-            FROM base
-        ),
-        keyed AS (
-            SELECT
-                -- Chiave stabile per join fact↔dim (evita mismatch su molte colonne dopo anche qui blocco del gate gold)
-                md5(
-                    COALESCE(address,'') || '|' ||
-                    COALESCE(city,'') || '|' ||
-                    COALESCE(CAST(zipcode AS VARCHAR),'') || '|' ||
-                    COALESCE(neighborhood,'') || '|' ||
-                    COALESCE(battalion,'') || '|' ||
-                    COALESCE(station_area,'') || '|' ||
-                    COALESCE(CAST(supervisor_district AS VARCHAR),'') || '|' ||
-                    COALESCE(fire_prevention_district,'') || '|' ||
-                    COALESCE(box,'') || '|' ||
-                    COALESCE(location_point,'')
-                ) AS location_key,
-                *
-            FROM keys
-        )
+
+def _build_dim_location(con, logger, incremental: bool) -> None:
+    _require_staging(con)
+
+    if _use_incremental(con, incremental, "dim_location"):
+        con.execute(f"""
+        INSERT INTO gold.dim_location
+        {_dim_location_keyed_sql(_delta_call_filter("s"))}
         SELECT
-            row_number() OVER (ORDER BY location_key) AS location_id,
+            (SELECT COALESCE(MAX(location_id), 0) FROM gold.dim_location)
+            + row_number() OVER (ORDER BY location_key) AS location_id,
             location_key,
-            address, city, zipcode, neighborhood, battalion, station_area, supervisor_district,
-            fire_prevention_district, box, location_point
-        FROM keyed
-        ;
+            {_location_dim_cols()}
+        FROM keyed k
+        -- match su chiave + colonne: una collisione di hash entra come seconda riga con
+        -- la stessa location_key e viene bloccata dal gate gold (invece di finire
+        -- silenziosamente sulla location sbagliata)
+        WHERE NOT EXISTS (
+            SELECT 1
+            FROM gold.dim_location l
+            WHERE l.location_key = k.location_key
+              AND {" AND ".join(f"l.{c} IS NOT DISTINCT FROM k.{c}" for c in _LOCATION_KEY_COLS)}
+        )
         """)
 
-        logger.info("Creato gold.dim_location")
+        logger.info("Aggiornato gold.dim_location in incrementale")
+        return
+
+    con.execute("DROP TABLE IF EXISTS gold.dim_location")
+
+    con.execute(f"""
+    CREATE TABLE gold.dim_location AS
+    {_dim_location_keyed_sql()}
+    SELECT
+        row_number() OVER (ORDER BY location_key) AS location_id,
+        location_key,
+        {_location_dim_cols()}
+    FROM keyed
+    ;
+    """)
+    con.execute(f"COMMENT ON TABLE gold.dim_location IS '{_location_key_tag(con)}'")
+
+    logger.info("Creato gold.dim_location")
+
+
+@task(name="gold_dim_location")
+def build_dim_location(incremental: bool = False) -> None:
+    """
+    Incrementale: solo le location_key nuove vengono aggiunte (location_id = max + n).
+    """
+    logger = get_run_logger()
+
+    with get_db_connection() as con:
+        con.execute(f"CREATE SCHEMA IF NOT EXISTS {Schemas.GOLD}")
+        _build_dim_location(con, logger, incremental)
+
+
+@task(name="gold_dimensions")
+def build_gold_dimensions(incremental: bool = False) -> None:
+    """
+    dim_date, dim_incident_type e dim_location in una sola sessione e una sola transazione:
+    niente riapertura del warehouse tra una dim e l'altra, e la fact trova sempre
+    le tre dimensioni nello stesso stato (o tutte aggiornate o nessuna).
+    """
+    logger = get_run_logger()
+
+    with get_db_connection() as con:
+        con.execute(f"CREATE SCHEMA IF NOT EXISTS {Schemas.GOLD}")
+
+        con.execute("BEGIN TRANSACTION")
+        try:
+            _build_dim_date(con, logger, incremental)
+            _build_dim_incident_type(con, logger, incremental)
+            _build_dim_location(con, logger, incremental)
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+
 
 @task(name="gold_fact_incident")
-def build_fact_incident() -> None:
+def build_fact_incident(incremental: bool = False) -> None:
+    """
+    Incrementale: sostituisce solo le righe delle call toccate (call_number o incident_number delta).
+    Le righe riscritte conservano il loro incident_id (match su call_number + ordinale),
+    le nuove ricevono id = max(incident_id) + n.
+    """
     logger = get_run_logger()
 
     with get_db_connection() as con:
         con.execute(f"CREATE SCHEMA IF NOT EXISTS {Schemas.GOLD}")
-        con.execute("DROP TABLE IF EXISTS gold.fact_incident")
+        _require_staging(con)
 
-        con.execute("""
-        CREATE TABLE gold.fact_incident AS
-        WITH base AS (
+        if _use_incremental(con, incremental, "fact_incident"):
+            fact_delta_filter = _delta_call_filter("f")
+
+            con.execute("""
+            CREATE OR REPLACE TEMP TABLE _fact_id_base AS
+            SELECT COALESCE(MAX(incident_id), 0) AS max_id FROM gold.fact_incident
+            """)
+            con.execute(f"""
+            CREATE OR REPLACE TEMP TABLE _fact_old_ids AS
             SELECT
-                c.call_number,
-                c.incident_number,
-
-                -- timestamps principali (calls)
-                c.received_ts,
-                c.dispatch_ts,
-                c.response_ts,
-                c.on_scene_ts,
-
-                -- misure già calcolate in silver
-                c.response_time_sec,
-                c.dispatch_delay_sec,
-                c.travel_time_sec,
-
-                -- severity / risorse (mix calls+incidents)
-                c.number_of_alarms AS c_number_of_alarms,
-                i.number_of_alarms AS i_number_of_alarms,
-                i.suppression_units,
-                i.suppression_personnel,
-                i.ems_units,
-                i.ems_personnel,
-                i.other_units,
-                i.other_personnel,
-                i.estimated_property_loss,
-                i.estimated_contents_loss,
-
-                -- tipo incidente
-                c.call_type,
-                c.call_type_group,
-                i.primary_situation,
-                c.final_priority,
-
-                -- date (per dim_date)
-                c.call_date,
-                i.incident_date,
-
-                -- close (per duration)
-                i.close_ts,
-
-                -- location fields per hash (altrimenti si avevano troppi mismatch)
-                c.address AS c_address,
-                c.city AS c_city,
-                c.zipcode_of_incident AS c_zipcode,
-                c.neighborhoods_analysis_boundaries AS c_neighborhood,
-                c.battalion AS c_battalion,
-                c.station_area AS c_station_area,
-                c.supervisor_district AS c_supervisor_district,
-                c.fire_prevention_district AS c_fire_prevention_district,
-                c.box AS c_box,
-                c.location AS c_location_point,
-
-                i.address AS i_address,
-                i.city AS i_city,
-                i.zipcode AS i_zipcode,
-                i.neighborhood_district AS i_neighborhood,
-                i.battalion AS i_battalion,
-                i.station_area AS i_station_area,
-                i.supervisor_district AS i_supervisor_district,
-                i.box AS i_box,
-                i.location AS i_location_point
-            FROM silver.calls_clean c
-            LEFT JOIN silver.incidents_clean i
-              ON i.incident_number = c.incident_number
-            WHERE c.incident_number IS NOT NULL
-        ),
-        loc_keys AS (
+                call_number,
+                incident_id,
+                row_number() OVER (PARTITION BY call_number ORDER BY incident_id) AS k
+            FROM gold.fact_incident f
+            WHERE {fact_delta_filter}
+            """)
+            con.execute(f"""
+            CREATE OR REPLACE TEMP TABLE _fact_new AS
             SELECT
                 *,
-                -- normalizzazione IDENTICA a dim_location
-                NULLIF(TRIM(COALESCE(c_address, i_address)), '') AS address,
-                NULLIF(TRIM(COALESCE(c_city, i_city)), '') AS city,
-                COALESCE(c_zipcode, i_zipcode) AS zipcode,
-                NULLIF(TRIM(COALESCE(c_neighborhood, i_neighborhood)), '') AS neighborhood,
-                NULLIF(TRIM(COALESCE(c_battalion, i_battalion)), '') AS battalion,
-                NULLIF(TRIM(COALESCE(c_station_area, i_station_area)), '') AS station_area,
-                COALESCE(c_supervisor_district, i_supervisor_district) AS supervisor_district,
-                NULLIF(TRIM(c_fire_prevention_district), '') AS fire_prevention_district,
-                NULLIF(TRIM(COALESCE(CAST(c_box AS VARCHAR), CAST(i_box AS VARCHAR))), '') AS box,
-                NULLIF(TRIM(COALESCE(c_location_point, i_location_point)), '') AS location_point
-            FROM base
-        ),
-        keyed AS (
-            SELECT
-                *,
-                md5(
-                    COALESCE(address,'') || '|' ||
-                    COALESCE(city,'') || '|' ||
-                    COALESCE(CAST(zipcode AS VARCHAR),'') || '|' ||
-                    COALESCE(neighborhood,'') || '|' ||
-                    COALESCE(battalion,'') || '|' ||
-                    COALESCE(station_area,'') || '|' ||
-                    COALESCE(CAST(supervisor_district AS VARCHAR),'') || '|' ||
-                    COALESCE(fire_prevention_district,'') || '|' ||
-                    COALESCE(box,'') || '|' ||
-                    COALESCE(location_point,'')
-                ) AS location_key
-            FROM loc_keys
-        ),
-        d AS (
-            SELECT
-                k.*,
-                COALESCE(k.incident_date, k.call_date) AS event_date
-            FROM keyed k
-            WHERE COALESCE(k.incident_date, k.call_date) IS NOT NULL
-        )
+                row_number() OVER (PARTITION BY call_number ORDER BY incident_number, close_ts) AS k
+            FROM ({_fact_select_sql(_delta_call_filter("s"))})
+            """)
+
+            # mesi toccati: vecchie righe (prima della delete) + nuove righe
+            con.execute(f"CREATE TABLE IF NOT EXISTS {DELTA_FACT_MONTHS} (year INTEGER, month INTEGER)")
+            _run_in_transaction(
+                con,
+                f"""
+                INSERT INTO {DELTA_FACT_MONTHS}
+                SELECT DISTINCT CAST(date_id // 10000 AS INTEGER), CAST(date_id // 100 % 100 AS INTEGER)
+                FROM (
+                    SELECT date_id FROM gold.fact_incident f WHERE {fact_delta_filter}
+                    UNION ALL
+                    SELECT date_id FROM _fact_new
+                )
+                WHERE date_id IS NOT NULL
+                """,
+                f"DELETE FROM gold.fact_incident f WHERE {fact_delta_filter}",
+                """
+                INSERT INTO gold.fact_incident BY NAME
+                SELECT
+                    COALESCE(
+                        o.incident_id,
+                        (SELECT max_id FROM _fact_id_base)
+                        + row_number() OVER (ORDER BY n.call_number, n.k)
+                    ) AS incident_id,
+                    n.* EXCLUDE (k)
+                FROM _fact_new n
+                LEFT JOIN _fact_old_ids o
+                  ON o.call_number = n.call_number AND o.k = n.k
+                """,
+            )
+
+            n_delta = con.execute("SELECT COUNT(*) FROM _fact_new").fetchone()[0]
+            logger.info(f"Aggiornato gold.fact_incident in incrementale (righe riscritte: {n_delta:,})")
+            return
+
+        con.execute("DROP TABLE IF EXISTS gold.fact_incident")
+        con.execute(f"DROP TABLE IF EXISTS {DELTA_FACT_MONTHS}")
+
+        con.execute(f"""
+        CREATE TABLE gold.fact_incident AS
         SELECT
             row_number() OVER () AS incident_id,
-
-            d.incident_number,
-            d.call_number,
-
-            dd.date_id,
-
-            -- Join su chiave hash => coverage piena
-            dl.location_id,
-
-            dit.incident_type_id,
-
-            d.received_ts,
-            d.dispatch_ts,
-            d.response_ts,
-            d.on_scene_ts,
-            d.close_ts,
-
-            d.response_time_sec,
-            d.dispatch_delay_sec,
-            d.travel_time_sec,
-
-            CASE
-              WHEN d.received_ts IS NOT NULL AND d.close_ts IS NOT NULL
-               AND datediff('second', d.received_ts, d.close_ts) >= 0
-              THEN datediff('second', d.received_ts, d.close_ts)
-              ELSE NULL
-            END AS incident_duration_sec,
-
-            COALESCE(d.c_number_of_alarms, d.i_number_of_alarms) AS number_of_alarms,
-            d.suppression_units,
-            d.suppression_personnel,
-            d.ems_units,
-            d.ems_personnel,
-            d.other_units,
-            d.other_personnel,
-            d.estimated_property_loss,
-            d.estimated_contents_loss,
-
-            d.final_priority
-        FROM d
-        LEFT JOIN gold.dim_date dd
-          ON dd.date = CAST(d.event_date AS DATE)
-        LEFT JOIN gold.dim_location dl
-          ON dl.location_key = d.location_key
-        LEFT JOIN gold.dim_incident_type dit
-          ON dit.call_type IS NOT DISTINCT FROM NULLIF(TRIM(d.call_type), '')
-         AND dit.call_type_group IS NOT DISTINCT FROM NULLIF(TRIM(d.call_type_group), '')
-         AND dit.primary_situation IS NOT DISTINCT FROM NULLIF(TRIM(d.primary_situation), '')
-         AND dit.final_priority IS NOT DISTINCT FROM d.final_priority
+            *
+        FROM ({_fact_select_sql()})
         ;
         """)
 
-        logger.info("Creato gold.fact_incident")
\ No newline at end of file
+        logger.info("Creato gold.fact_incident")
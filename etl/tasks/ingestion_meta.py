@@ -1,5 +1,8 @@
 import hashlib
+import os
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from pathlib import Path
@@ -7,7 +10,11 @@ from typing import Optional, List, Dict
 
 from prefect import task, get_run_logger
 
-from etl.utils import get_db_connection, CLIENT_DROP_DIR, Schemas
+from etl.utils import get_db_connection, CLIENT_DROP_DIR, DB_PATH, PHASE2_MAX_WORKERS, Schemas
+
+
+# True => ignora il pre-check size+mtime e ricalcola sempre lo SHA-256 (es. file copiati con mtime preservato)
+DROP_FORCE_REHASH = os.getenv("DROP_FORCE_REHASH", "0").lower() in ("1", "true", "yes")
 
 
 META_DDL = f"""
@@ -56,6 +63,28 @@ CREATE TABLE IF NOT EXISTS {Schemas.META}.ingested_contents (
   PRIMARY KEY (pipeline_name, content_sha256)
 );
 
+-- Manifest dei file parquet nel Data Lake (una riga per file x sha contenuto)
+CREATE TABLE IF NOT EXISTS {Schemas.META}.lake_files (
+  file_path         VARCHAR NOT NULL,
+  source_sha256     VARCHAR NOT NULL,
+  dataset           VARCHAR NOT NULL,   -- fire_calls / fire_incidents
+  layout            VARCHAR NOT NULL,   -- ingest_date / event_month
+  event_year        INTEGER,            -- solo layout event_month (0 = data non parsabile)
+  event_month       INTEGER,
+  row_count         BIGINT NOT NULL,    -- righe di questo sha nel file
+  size_bytes        BIGINT NOT NULL,
+  written_at        TIMESTAMP NOT NULL,
+  PRIMARY KEY (file_path, source_sha256)
+);
+
+-- Versioni del gold pubblicate (una riga per run che ha superato il gate gold):
+-- la dashboard invalida la cache dei risultati quando cambia max(version)
+CREATE TABLE IF NOT EXISTS {Schemas.META}.gold_versions (
+  version           BIGINT PRIMARY KEY,
+  published_at      TIMESTAMP NOT NULL,
+  note              VARCHAR
+);
+
 CREATE INDEX IF NOT EXISTS ix_ingestion_log_run ON {Schemas.META}.ingestion_log(run_id);
 CREATE INDEX IF NOT EXISTS ix_ingestion_log_sha ON {Schemas.META}.ingestion_log(pipeline_name, file_sha256);
 """
@@ -74,12 +103,6 @@ def _utcnow_naive() -> datetime:
     return datetime.now(timezone.utc).replace(tzinfo=None)
 
 
-def _ensure_meta_tables() -> None:
-    # crea schema+tabelle se non esistono
-    with get_db_connection() as con:
-        con.execute(META_DDL)
-
-
 def _sha256_of_file(path: Path, chunk_size: int = 8 * 1024 * 1024) -> str:
     h = hashlib.sha256()
     with path.open("rb") as f:
@@ -91,15 +114,29 @@ def _sha256_of_file(path: Path, chunk_size: int = 8 * 1024 * 1024) -> str:
     return h.hexdigest()
 
 
-def _fingerprint_file(path: Path) -> FileFingerprint:
+def _fingerprint_file(path: Path, known: Optional[Dict[str, tuple]] = None) -> FileFingerprint:
+    """
+    Fingerprint a due livelli:
+    - (path, size, mtime) uguali all'ultima riga loggata per quel path -> riuso lo sha loggato
+    - altrimenti SHA-256 completo del file
+    `known` = {file_path: (size, mtime_utc, sha256)} da _last_logged_fingerprints().
+    """
     st = path.stat()
     mtime_utc = datetime.fromtimestamp(st.st_mtime, tz=timezone.utc).replace(tzinfo=None)
+    file_path = str(path.resolve())
+
+    prev = (known or {}).get(file_path)
+    if prev is not None and prev[2] and prev[0] == st.st_size and prev[1] == mtime_utc:
+        sha256 = prev[2]
+    else:
+        sha256 = _sha256_of_file(path)
+
     return FileFingerprint(
         file_name=path.name,
-        file_path=str(path.resolve()),
+        file_path=file_path,
         file_size_bytes=st.st_size,
         file_mtime_utc=mtime_utc,
-        sha256=_sha256_of_file(path),
+        sha256=sha256,
     )
 
 
@@ -109,11 +146,52 @@ def _scan_drop_zone(drop_dir: Path) -> List[Path]:
     return sorted([p for p in drop_dir.glob("*.csv") if p.is_file()])
 
 
-def _start_run(pipeline_name: str, trigger_type: str, notes: Optional[str]) -> uuid.UUID:
-    run_id = uuid.uuid4()
-    _ensure_meta_tables()
-    with get_db_connection() as con:
-        con.execute(
+class MetaRepository:
+    """
+    Accesso a meta.* con UNA connessione (per task / flow run):
+    - DDL applicato una sola volta per processo e per DB (cache _ddl_applied)
+    - scritture in batch (executemany) e lookup per tutti gli sha in una query
+
+    Uso:
+        with MetaRepository.open() as repo:
+            repo.insert_logs(...)
+    """
+
+    _ddl_applied: set = set()
+
+    def __init__(self, con):
+        self.con = con
+
+    @classmethod
+    @contextmanager
+    def open(cls, read_only: bool = False):
+        with get_db_connection(read_only=read_only) as con:
+            repo = cls(con)
+            if not read_only:
+                repo.ensure_tables()
+            yield repo
+
+    def ensure_tables(self) -> None:
+        # crea schema+tabelle se non esistono (una volta sola per DB_PATH nel processo)
+        if DB_PATH in MetaRepository._ddl_applied:
+            return
+        self.con.execute(META_DDL)
+        MetaRepository._ddl_applied.add(DB_PATH)
+
+    @contextmanager
+    def transaction(self):
+        self.con.execute("BEGIN TRANSACTION")
+        try:
+            yield
+            self.con.execute("COMMIT")
+        except Exception:
+            self.con.execute("ROLLBACK")
+            raise
+
+    # ---- runs ----
+    def start_run(self, pipeline_name: str, trigger_type: str, notes: Optional[str]) -> uuid.UUID:
+        run_id = uuid.uuid4()
+        self.con.execute(
             f"""
             INSERT INTO {Schemas.META}.ingestion_runs(
               run_id, pipeline_name, started_at, status, trigger_type, notes
@@ -122,12 +200,10 @@ def _start_run(pipeline_name: str, trigger_type: str, notes: Optional[str]) -> u
             """,
             [str(run_id), pipeline_name, _utcnow_naive(), trigger_type, notes],
         )
-    return run_id
-
+        return run_id
 
-def _finish_run(run_id: uuid.UUID, status: str) -> None:
-    with get_db_connection() as con:
-        con.execute(
+    def finish_run(self, run_id: uuid.UUID, status: str) -> None:
+        self.con.execute(
             f"""
             UPDATE {Schemas.META}.ingestion_runs
             SET finished_at = ?, status = ?
@@ -136,36 +212,62 @@ def _finish_run(run_id: uuid.UUID, status: str) -> None:
             [_utcnow_naive(), status, str(run_id)],
         )
 
-
-def _is_already_successfully_ingested(pipeline_name: str, sha256: str) -> bool:
-    """
-    True se quel contenuto (sha) è già stato processato con successo in passato
-    (presente in meta.ingested_contents).
-    """
-    _ensure_meta_tables()
-    with get_db_connection(read_only=True) as con:
-        row = con.execute(
+    # ---- lookup ----
+    def last_logged_fingerprints(self, pipeline_name: str) -> Dict[str, tuple]:
+        """Ultima riga di meta.ingestion_log per file_path: {file_path: (size, mtime_utc, sha256)}."""
+        rows = self.con.execute(
+            f"""
+            SELECT file_path, file_size_bytes, file_mtime_utc, file_sha256
+            FROM {Schemas.META}.ingestion_log
+            WHERE pipeline_name = ?
+            QUALIFY ROW_NUMBER() OVER (PARTITION BY file_path ORDER BY detected_at DESC) = 1
+            """,
+            [pipeline_name],
+        ).fetchall()
+        return {r[0]: (r[1], r[2], r[3]) for r in rows}
+
+    def already_ingested_shas(self, pipeline_name: str, shas: List[str]) -> set:
+        """
+        Sottoinsieme degli sha già processati con successo in passato
+        (presenti in meta.ingested_contents). Una sola query per tutta la drop zone.
+        """
+        if not shas:
+            return set()
+        rows = self.con.execute(
             f"""
-            SELECT 1
+            SELECT content_sha256
             FROM {Schemas.META}.ingested_contents
-            WHERE pipeline_name = ? AND content_sha256 = ?
-            LIMIT 1
+            WHERE pipeline_name = ?
+              AND content_sha256 IN (SELECT unnest(?::VARCHAR[]))
             """,
-            [pipeline_name, sha256],
-        ).fetchone()
-    return row is not None
-
-
-def _insert_log(
-    run_id: uuid.UUID,
-    pipeline_name: str,
-    drop_dir: str,
-    fp: FileFingerprint,
-    status: str,
-    error_message: Optional[str] = None,
-) -> None:
-    with get_db_connection() as con:
-        con.execute(
+            [pipeline_name, list(shas)],
+        ).fetchall()
+        return {r[0] for r in rows}
+
+    def pending_files(self, run_id: str, pipeline_name: str) -> List[tuple]:
+        """File PENDING della run: [(file_path, file_sha256, lake_path), ...]."""
+        return self.con.execute(
+            f"""
+            SELECT file_path, file_sha256, lake_path
+            FROM {Schemas.META}.ingestion_log
+            WHERE run_id = ? AND pipeline_name = ? AND status = 'PENDING'
+            """,
+            [str(run_id), pipeline_name],
+        ).fetchall()
+
+    # ---- scritture batch ----
+    def insert_logs(
+        self,
+        run_id: uuid.UUID,
+        pipeline_name: str,
+        drop_dir: str,
+        entries: List[tuple],
+    ) -> None:
+        """Insert batch in meta.ingestion_log: entries = [(FileFingerprint, status, error_message), ...]."""
+        if not entries:
+            return
+        now = _utcnow_naive()
+        self.con.executemany(
             f"""
             INSERT INTO {Schemas.META}.ingestion_log(
               log_id, run_id, pipeline_name,
@@ -176,21 +278,187 @@ def _insert_log(
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """,
             [
-                str(uuid.uuid4()),
-                str(run_id),
-                pipeline_name,
-                drop_dir,
-                fp.file_name,
-                fp.file_path,
-                int(fp.file_size_bytes),
-                fp.file_mtime_utc,
-                fp.sha256,
-                _utcnow_naive(),
-                status,
-                error_message,
+                [
+                    str(uuid.uuid4()),
+                    str(run_id),
+                    pipeline_name,
+                    drop_dir,
+                    fp.file_name,
+                    fp.file_path,
+                    int(fp.file_size_bytes),
+                    fp.file_mtime_utc,
+                    fp.sha256,
+                    now,
+                    status,
+                    error_message,
+                ]
+                for fp, status, error_message in entries
             ],
         )
 
+    def set_lake_paths(self, run_id: str, pipeline_name: str, results: List[tuple]) -> None:
+        """
+        results = [(file_sha256, lake_path, written), ...]
+        written=False (parquet già presente) non sovrascrive lake_written_at se già valorizzato.
+        """
+        if not results:
+            return
+        now = _utcnow_naive()
+        self.con.executemany(
+            f"""
+            UPDATE {Schemas.META}.ingestion_log
+            SET lake_path = ?,
+                lake_written_at = CASE WHEN ? THEN ? ELSE COALESCE(lake_written_at, ?) END
+            WHERE run_id = ? AND pipeline_name = ? AND file_sha256 = ?
+            """,
+            [
+                [str(lake_path), bool(written), now, now, str(run_id), pipeline_name, sha]
+                for sha, lake_path, written in results
+            ],
+        )
+
+    def register_lake_files(self, entries: List[tuple]) -> None:
+        """
+        Manifest lake: entries = [(file_path, source_sha256, dataset, layout, event_year, event_month,
+        row_count, size_bytes), ...]. Riscrivere lo stesso file aggiorna la riga.
+        """
+        if not entries:
+            return
+        now = _utcnow_naive()
+        self.con.executemany(
+            f"""
+            INSERT OR REPLACE INTO {Schemas.META}.lake_files
+              (file_path, source_sha256, dataset, layout, event_year, event_month, row_count, size_bytes, written_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            [[*e, now] for e in entries],
+        )
+
+    def lake_files_by_sha(self, shas: List[str], layout: str) -> Dict[str, List[str]]:
+        """File del manifest per sha (solo sha già nel lake per quel layout): {sha: [file_path, ...]}."""
+        if not shas:
+            return {}
+        rows = self.con.execute(
+            f"""
+            SELECT source_sha256, file_path
+            FROM {Schemas.META}.lake_files
+            WHERE layout = ? AND source_sha256 IN (SELECT unnest(?::VARCHAR[]))
+            ORDER BY source_sha256, file_path
+            """,
+            [layout, list(shas)],
+        ).fetchall()
+        out: Dict[str, List[str]] = {}
+        for sha, path in rows:
+            out.setdefault(sha, []).append(path)
+        return out
+
+    def lake_files(self, layout: str) -> List[tuple]:
+        """Manifest di un layout: [(file_path, source_sha256, dataset, event_year, event_month, row_count, size_bytes), ...]."""
+        return self.con.execute(
+            f"""
+            SELECT file_path, source_sha256, dataset, event_year, event_month, row_count, size_bytes
+            FROM {Schemas.META}.lake_files
+            WHERE layout = ?
+            ORDER BY dataset, event_year, event_month, file_path, source_sha256
+            """,
+            [layout],
+        ).fetchall()
+
+    def unregistered_lake_paths(self) -> List[tuple]:
+        """lake_path di ingestion_log non presenti nel manifest (parquet scritti prima del manifest)."""
+        return self.con.execute(
+            f"""
+            SELECT DISTINCT l.file_sha256, l.lake_path
+            FROM {Schemas.META}.ingestion_log l
+            WHERE l.lake_path IS NOT NULL
+              AND NOT EXISTS (
+                SELECT 1 FROM {Schemas.META}.lake_files f WHERE f.file_path = l.lake_path
+              )
+            """
+        ).fetchall()
+
+    def replace_lake_files(
+        self, old_paths: List[str], entries: List[tuple], lake_paths: Dict[str, str], pipeline_name: str
+    ) -> None:
+        """
+        Swap atomico dopo una compaction: via i file vecchi dal manifest, dentro i nuovi
+        (stesso formato di register_lake_files) e lake_path aggiornato in ingestion_log
+        per gli sha coinvolti della pipeline. Tutto in una transazione.
+        """
+        now = _utcnow_naive()
+        with self.transaction():
+            self.con.execute(
+                f"DELETE FROM {Schemas.META}.lake_files WHERE file_path IN (SELECT unnest(?::VARCHAR[]))",
+                [list(old_paths)],
+            )
+            self.con.executemany(
+                f"""
+                INSERT INTO {Schemas.META}.lake_files
+                  (file_path, source_sha256, dataset, layout, event_year, event_month, row_count, size_bytes, written_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                [[*e, now] for e in entries],
+            )
+            self.con.executemany(
+                f"""
+                UPDATE {Schemas.META}.ingestion_log
+                SET lake_path = ?
+                WHERE pipeline_name = ? AND file_sha256 = ? AND lake_path IS NOT NULL
+                """,
+                [[path, pipeline_name, sha] for sha, path in lake_paths.items()],
+            )
+
+    # ---- gold versions ----
+    def publish_gold_version(self, note: Optional[str] = None) -> int:
+        with self.transaction():
+            version = self.con.execute(
+                f"SELECT COALESCE(MAX(version), 0) + 1 FROM {Schemas.META}.gold_versions"
+            ).fetchone()[0]
+            self.con.execute(
+                f"INSERT INTO {Schemas.META}.gold_versions VALUES (?, ?, ?)",
+                [version, _utcnow_naive(), note],
+            )
+        return int(version)
+
+    def mark_done(self, run_id: str, pipeline_name: str, file_sha256s: List[str]) -> None:
+        """
+        - status DONE in ingestion_log per questa run_id
+        - upsert in ingested_contents (così la prossima detect può fare SKIPPED)
+        """
+        if not file_sha256s:
+            return
+        now = _utcnow_naive()
+        with self.transaction():
+            self.con.execute(
+                f"""
+                UPDATE {Schemas.META}.ingestion_log
+                SET status = 'DONE', error_message = NULL
+                WHERE run_id = ? AND pipeline_name = ?
+                  AND file_sha256 IN (SELECT unnest(?::VARCHAR[]))
+                """,
+                [str(run_id), pipeline_name, list(file_sha256s)],
+            )
+
+            # upsert: first_success_at resta il primo, last_success_at si aggiorna
+            self.con.executemany(
+                f"""
+                INSERT INTO {Schemas.META}.ingested_contents
+                  (pipeline_name, content_sha256, first_success_at, last_success_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (pipeline_name, content_sha256)
+                DO UPDATE SET last_success_at = excluded.last_success_at
+                """,
+                [[pipeline_name, sha, now, now] for sha in dict.fromkeys(file_sha256s)],
+            )
+
+
+def _fingerprint_or_error(path: Path, known: Optional[Dict[str, tuple]] = None):
+    """Per il pool: ritorna (FileFingerprint, None) oppure (None, errore)."""
+    try:
+        return _fingerprint_file(path, known), None
+    except Exception as e:
+        return None, e
+
 
 @task(name="Phase2 - Detect & log client drop", retries=0)
 def detect_and_log_client_drop(
@@ -210,7 +478,6 @@ def detect_and_log_client_drop(
     Ritorna summary counts per flow control.
     """
     logger = get_run_logger()
-    run_id = _start_run(pipeline_name=pipeline_name, trigger_type=trigger_type, notes=notes)
 
     pending = 0
     skipped = 0
@@ -219,60 +486,73 @@ def detect_and_log_client_drop(
     drop_path = Path(drop_dir)
     resolved_drop = str(drop_path.resolve())
 
-    try:
-        files = _scan_drop_zone(drop_path)
-        logger.info(f"Drop zone: {resolved_drop} | CSV trovati: {len(files)}")
-
-        for f in files:
-            try:
-                fp = _fingerprint_file(f)
-
-                if fp.sha256 and _is_already_successfully_ingested(pipeline_name, fp.sha256):
-                    _insert_log(
-                        run_id=run_id,
-                        pipeline_name=pipeline_name,
-                        drop_dir=resolved_drop,
-                        fp=fp,
-                        status="SKIPPED",
-                        error_message="already_ingested",
+    # una sola connessione per tutto lo step (prima: 3 aperture per file)
+    with MetaRepository.open() as repo:
+        run_id = repo.start_run(pipeline_name=pipeline_name, trigger_type=trigger_type, notes=notes)
+
+        try:
+            files = _scan_drop_zone(drop_path)
+            logger.info(f"Drop zone: {resolved_drop} | CSV trovati: {len(files)}")
+
+            # pre-check economico (size+mtime vs ultima riga loggata): SHA-256 solo sui file cambiati
+            known = {} if DROP_FORCE_REHASH else repo.last_logged_fingerprints(pipeline_name)
+
+            # hashing in parallelo (hashlib rilascia il GIL sui chunk grandi)
+            with ThreadPoolExecutor(max_workers=max(1, PHASE2_MAX_WORKERS)) as pool:
+                results = list(pool.map(lambda f: _fingerprint_or_error(f, known), files))
+
+            reused = sum(
+                1 for fp, _ in results
+                if fp is not None
+                and fp.file_path in known
+                and known[fp.file_path][:2] == (fp.file_size_bytes, fp.file_mtime_utc)
+                and known[fp.file_path][2]
+            )
+            logger.info(f"Fingerprint | sha riusati (size+mtime invariati)={reused} hash calcolati={len(files) - reused}")
+
+            already = repo.already_ingested_shas(
+                pipeline_name, [fp.sha256 for fp, _ in results if fp is not None and fp.sha256]
+            )
+
+            entries = []
+            for f, (fp, err) in zip(files, results):
+                if err is not None:
+                    # fingerprint fallito su questo file
+                    dummy = FileFingerprint(
+                        file_name=f.name,
+                        file_path=str(f.resolve()),
+                        file_size_bytes=0,
+                        file_mtime_utc=_utcnow_naive(),
+                        sha256="",
                     )
+                    entries.append((dummy, "FAILED", str(err)))
+                    failed += 1
+                elif fp.sha256 in already:
+                    entries.append((fp, "SKIPPED", "already_ingested"))
                     skipped += 1
                 else:
-                    _insert_log(
-                        run_id=run_id,
-                        pipeline_name=pipeline_name,
-                        drop_dir=resolved_drop,
-                        fp=fp,
-                        status="PENDING",
-                        error_message=None,
-                    )
+                    entries.append((fp, "PENDING", None))
                     pending += 1
 
-            except Exception as e:
-                # fingerprint/log fallito su questo file
-                dummy = FileFingerprint(
-                    file_name=f.name,
-                    file_path=str(f.resolve()),
-                    file_size_bytes=0,
-                    file_mtime_utc=_utcnow_naive(),
-                    sha256="",
-                )
-                _insert_log(
-                    run_id=run_id,
-                    pipeline_name=pipeline_name,
-                    drop_dir=resolved_drop,
-                    fp=dummy,
-                    status="FAILED",
-                    error_message=str(e),
-                )
-                failed += 1
-
-        # Run success anche se pending=0: è un no-op voluto
-        _finish_run(run_id, status="SUCCESS")
-
-    except Exception:
-        _finish_run(run_id, status="FAILED")
-        raise
+            # metadati in un solo batch a fine scansione
+            repo.insert_logs(run_id=run_id, pipeline_name=pipeline_name, drop_dir=resolved_drop, entries=entries)
+
+            # Run success anche se pending=0: è un no-op voluto
+            repo.finish_run(run_id, status="SUCCESS")
+
+        except Exception:
+            repo.finish_run(run_id, status="FAILED")
+            raise
 
     logger.info(f"STEP1 summary | PENDING={pending} SKIPPED={skipped} FAILED={failed}")
     return {"run_id": str(run_id), "pending": pending, "skipped": skipped, "failed": failed, "files": len(files)}
+
+
+@task(name="publish_gold_version")
+def publish_gold_version(note: Optional[str] = None) -> int:
+    """Nuova versione del gold (da chiamare dopo il gate gold): invalida le cache della dashboard."""
+    logger = get_run_logger()
+    with MetaRepository.open() as repo:
+        version = repo.publish_gold_version(note)
+    logger.info(f"Pubblicata gold version {version}")
+    return version
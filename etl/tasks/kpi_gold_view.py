@@ -1,8 +1,303 @@
 from prefect import task, get_run_logger
 from etl.utils import get_db_connection, Schemas
+from etl.tasks.gold import DELTA_FACT_MONTHS
+
+
+# KPI cube: fact pre-aggregata al grain (year, month, call_type_group, call_type, neighborhood, battalion).
+# Per ogni misura: conteggio non-null, somma e somma dei quadrati => media e dev. standard
+# ricomponibili a qualsiasi livello di filtro (SUM delle parti), senza toccare la fact.
+KPI_CUBE = f"{Schemas.GOLD}.kpi_cube"
+
+CUBE_DIMENSIONS = ["year", "month", "call_type_group", "call_type", "neighborhood", "battalion"]
+CUBE_MEASURES = ["response_time", "dispatch_delay", "travel_time"]
+
+
+# Istogramma log-scala del response time (sketch mergeable): bucket 0 = [0, 1) sec,
+# bucket b >= 1 = [base^(b-1), base^b). Con base 1.05 il quantile stimato (centro geometrico
+# del bucket) ha errore relativo <= ~2.5%. Grain = dimensioni filtrabili in dashboard:
+# percentili per qualunque combinazione di filtri = SUM(n) per bucket + cumulata.
+KPI_RESPONSE_HIST = f"{Schemas.GOLD}.kpi_response_hist"
+HIST_DIMENSIONS = ["year", "month", "call_type_group", "neighborhood"]
+HIST_BASE = 1.05
+RESPONSE_PERCENTILES = {"p50_response_time_sec": 0.5, "p90_response_time_sec": 0.9, "p95_response_time_sec": 0.95}
+
+# KPI per una combinazione qualsiasi dei filtri dashboard (NULL = tutti): table macro, così
+# formula delle medie (avg_sql) e dei percentili (hist_quantiles_sql) restano solo qui e non
+# nelle dashboard. Parametri comuni, colonne presenti sia nel cube sia nell'istogramma.
+KPI_SUMMARY_MACRO = f"{Schemas.GOLD}.kpi_summary"
+KPI_RESPONSE_MONTH_MACRO = f"{Schemas.GOLD}.kpi_response_time_month"
+KPI_RESPONSE_PCTL_MACRO = f"{Schemas.GOLD}.kpi_response_pctl"
+_KPI_MACRO_FILTERS = {
+    "p_year": "year",
+    "p_month": "month",
+    "p_call_type_group": "call_type_group",
+    "p_neighborhood": "neighborhood",
+}
+
+
+# Opzioni dei filtri dashboard: solo i valori referenziati dalla fact, una riga per (filtro, valore)
+# con conteggio e prima/ultima data. Le dashboard caricano i dropdown con una sola lettura piccola.
+FILTER_OPTIONS = f"{Schemas.GOLD}.filter_options"
+FILTER_COLUMNS = {
+    "year": "d.year",
+    "call_type_group": "it.call_type_group",
+    "neighborhood": "l.neighborhood",
+    "battalion": "l.battalion",
+    "city": "l.city",
+}
+
+# Stesse opzioni per la dashboard sulle calls silver (mock_up.py): valori grezzi di
+# silver.calls_clean, gli stessi su cui filtra (list_contains su city/battalion, call_date),
+# non quelli normalizzati delle dims. Riga filter_name = 'all': intervallo di call_date.
+CALLS_FILTER_OPTIONS = f"{Schemas.GOLD}.calls_filter_options"
+CALLS_FILTER_SOURCE = f"{Schemas.SILVER}.calls_clean"
+CALLS_FILTER_COLUMNS = ["call_type_group", "city", "battalion"]
+
+
+def hist_bucket_value_sql(bucket: str) -> str:
+    """Valore rappresentativo del bucket (0 per il bucket [0, 1))."""
+    return f"CASE WHEN {bucket} = 0 THEN 0.0 ELSE power({HIST_BASE}, {bucket} - 0.5) END"
+
+
+def hist_quantiles_sql(quantiles: dict[str, float], group_cols: list[str] | None = None, where: str = "") -> str:
+    """
+    SELECT dei quantili stimati da gold.kpi_response_hist, es. {"p90": 0.9}.
+    group_cols: colonne di raggruppamento (sottoinsieme di HIST_DIMENSIONS), None = totale.
+    """
+    group_cols = group_cols or []
+    keys = ", ".join(group_cols)
+    part = f"PARTITION BY {keys}" if group_cols else ""
+    pctl = ",\n".join(
+        f"{hist_bucket_value_sql(f'MIN(bucket) FILTER (WHERE cum >= {q} * total)')} AS {name}"
+        for name, q in quantiles.items()
+    )
+    return f"""
+    WITH h AS (
+        SELECT {keys + "," if keys else ""} bucket, SUM(n) AS n
+        FROM {KPI_RESPONSE_HIST}
+        {where}
+        GROUP BY ALL
+    ),
+    c AS (
+        SELECT
+            *,
+            SUM(n) OVER ({part} ORDER BY bucket) AS cum,
+            SUM(n) OVER ({part}) AS total
+        FROM h
+    )
+    SELECT
+        {keys + "," if keys else ""}
+        CAST(MAX(total) AS BIGINT) AS n_incidents,
+        {pctl}
+    FROM c
+    {f"GROUP BY {keys}" if keys else ""}
+    """
+
+
+def avg_sql(measure: str) -> str:
+    """Media ricomposta dal cube (NULL se nessun valore non-null), es. avg_sql("response_time")."""
+    return f"SUM(sum_{measure}) / NULLIF(SUM(n_{measure}), 0)"
+
+
+def _table_exists(con, schema: str, table: str) -> bool:
+    row = con.execute(
+        """
+        SELECT 1
+        FROM information_schema.tables
+        WHERE table_schema = ? AND table_name = ?
+        LIMIT 1
+        """,
+        [schema, table],
+    ).fetchone()
+    return row is not None
+
+
+# LEFT JOIN su dim_incident_type / dim_location: una fact senza tipo o location resta nei
+# conteggi mensili (celle con dimensioni NULL), come nelle viste che univano solo dim_date.
+def _cube_select_sql(month_filter: str = "") -> str:
+    measures = ",\n".join(
+        f"""
+        COUNT(f.{m}_sec) AS n_{m},
+        CAST(SUM(f.{m}_sec) AS BIGINT) AS sum_{m},
+        SUM(CAST(f.{m}_sec AS DOUBLE) * f.{m}_sec) AS sumsq_{m}"""
+        for m in CUBE_MEASURES
+    )
+    return f"""
+    SELECT
+        d.year,
+        d.month,
+        it.call_type_group,
+        it.call_type,
+        l.neighborhood,
+        l.battalion,
+        COUNT(*) AS n_incidents,
+        {measures}
+    FROM gold.fact_incident f
+    JOIN gold.dim_date d ON d.date_id = f.date_id
+    LEFT JOIN gold.dim_incident_type it ON it.incident_type_id = f.incident_type_id
+    LEFT JOIN gold.dim_location l ON l.location_id = f.location_id
+    {f"WHERE {month_filter}" if month_filter else ""}
+    GROUP BY ALL
+    """
+
+
+def _hist_select_sql(month_filter: str = "") -> str:
+    return f"""
+    SELECT
+        d.year,
+        d.month,
+        it.call_type_group,
+        l.neighborhood,
+        CAST(
+            CASE WHEN f.response_time_sec < 1 THEN 0
+            ELSE floor(ln(f.response_time_sec) / ln({HIST_BASE})) + 1
+            END AS SMALLINT
+        ) AS bucket,
+        COUNT(*) AS n
+    FROM gold.fact_incident f
+    JOIN gold.dim_date d ON d.date_id = f.date_id
+    LEFT JOIN gold.dim_incident_type it ON it.incident_type_id = f.incident_type_id
+    LEFT JOIN gold.dim_location l ON l.location_id = f.location_id
+    WHERE f.response_time_sec IS NOT NULL
+    {f"AND {month_filter}" if month_filter else ""}
+    GROUP BY ALL
+    """
+
+
+def _filter_options_select_sql() -> str:
+    # una sola scansione della fact: un grouping set per filtro
+    exprs = list(FILTER_COLUMNS.values())
+    filter_name = " ".join(f"WHEN GROUPING({e}) = 0 THEN '{name}'" for name, e in FILTER_COLUMNS.items())
+    value = ", ".join(f"CAST({e} AS VARCHAR)" for e in exprs)
+    grouping_sets = ", ".join(f"({e})" for e in exprs)
+    return f"""
+    SELECT * FROM (
+        SELECT
+            CASE {filter_name} END AS filter_name,
+            TRIM(COALESCE({value})) AS value,
+            COUNT(*) AS n_incidents,
+            MIN(d.date) AS first_date,
+            MAX(d.date) AS last_date
+        FROM gold.fact_incident f
+        JOIN gold.dim_date d ON d.date_id = f.date_id
+        LEFT JOIN gold.dim_incident_type it ON it.incident_type_id = f.incident_type_id
+        LEFT JOIN gold.dim_location l ON l.location_id = f.location_id
+        GROUP BY GROUPING SETS ({grouping_sets})
+    )
+    WHERE value IS NOT NULL AND value <> ''
+    """
+
+
+def _calls_filter_options_select_sql() -> str:
+    filter_name = " ".join(f"WHEN GROUPING({c}) = 0 THEN '{c}'" for c in CALLS_FILTER_COLUMNS)
+    value = ", ".join(f"CAST({c} AS VARCHAR)" for c in CALLS_FILTER_COLUMNS)
+    grouping_sets = ", ".join(f"({c})" for c in CALLS_FILTER_COLUMNS)
+    return f"""
+    SELECT * FROM (
+        SELECT
+            CASE {filter_name} ELSE 'all' END AS filter_name,
+            COALESCE({value}) AS value,
+            COUNT(*) AS n_calls,
+            MIN(call_date) AS first_date,
+            MAX(call_date) AS last_date
+        FROM {CALLS_FILTER_SOURCE}
+        GROUP BY GROUPING SETS ({grouping_sets}, ())
+    )
+    WHERE filter_name = 'all' OR value IS NOT NULL
+    """
+
+
+def _in_delta_months(alias: str) -> str:
+    return f"""
+    EXISTS (
+        SELECT 1 FROM {DELTA_FACT_MONTHS} m
+        WHERE m.year = {alias}.year AND m.month = {alias}.month
+    )
+    """
+
+
+@task(name="gold_kpi_cube")
+def build_kpi_cube(incremental: bool = False) -> None:
+    """
+    gold.kpi_cube + gold.kpi_response_hist (stessa sorgente, stessi mesi).
+
+    Incrementale: ricalcola solo i mesi della fact riscritti dall'ultima build_fact_incident
+    (DELTA_FACT_MONTHS). Se la tabella dei mesi non esiste la fact è stata ricostruita => full.
+    """
+    logger = get_run_logger()
+
+    with get_db_connection() as con:
+        con.execute(f"CREATE SCHEMA IF NOT EXISTS {Schemas.GOLD}")
+        has_delta_months = _table_exists(con, Schemas.GOLD, "_delta_fact_months")
+
+        if (
+            incremental
+            and has_delta_months
+            and _table_exists(con, Schemas.GOLD, "kpi_cube")
+            and _table_exists(con, Schemas.GOLD, "kpi_response_hist")
+        ):
+            n_months = con.execute(
+                f"SELECT COUNT(*) FROM (SELECT DISTINCT year, month FROM {DELTA_FACT_MONTHS})"
+            ).fetchone()[0]
+
+            con.execute("BEGIN TRANSACTION")
+            try:
+                con.execute(f"DELETE FROM {KPI_CUBE} c WHERE {_in_delta_months('c')}")
+                con.execute(f"INSERT INTO {KPI_CUBE} BY NAME {_cube_select_sql(_in_delta_months('d'))}")
+                con.execute(f"DELETE FROM {KPI_RESPONSE_HIST} h WHERE {_in_delta_months('h')}")
+                con.execute(
+                    f"INSERT INTO {KPI_RESPONSE_HIST} BY NAME {_hist_select_sql(_in_delta_months('d'))}"
+                )
+                con.execute(f"DELETE FROM {DELTA_FACT_MONTHS}")
+                con.execute("COMMIT")
+            except Exception:
+                con.execute("ROLLBACK")
+                raise
+
+            logger.info(
+                f"Aggiornati {KPI_CUBE} e {KPI_RESPONSE_HIST} in incrementale (mesi ricalcolati: {n_months:,})"
+            )
+            return
+
+        con.execute(f"CREATE OR REPLACE TABLE {KPI_CUBE} AS {_cube_select_sql()} ORDER BY year, month")
+        con.execute(
+            f"CREATE OR REPLACE TABLE {KPI_RESPONSE_HIST} AS {_hist_select_sql()} ORDER BY year, month, bucket"
+        )
+        if has_delta_months:
+            # mesi già coperti dalla full
+            con.execute(f"DELETE FROM {DELTA_FACT_MONTHS}")
+
+        n = con.execute(f"SELECT COUNT(*) FROM {KPI_CUBE}").fetchone()[0]
+        n_hist = con.execute(f"SELECT COUNT(*) FROM {KPI_RESPONSE_HIST}").fetchone()[0]
+        logger.info(f"Creati {KPI_CUBE} (righe: {n:,}) e {KPI_RESPONSE_HIST} (righe: {n_hist:,})")
+
+
+@task(name="gold_filter_options")
+def build_filter_options() -> None:
+    """
+    gold.filter_options ricostruita dalla fact (piccola: una riga per valore di filtro)
+    e gold.calls_filter_options da silver.calls_clean (se presente).
+    """
+    logger = get_run_logger()
+
+    with get_db_connection() as con:
+        con.execute(f"CREATE SCHEMA IF NOT EXISTS {Schemas.GOLD}")
+        n = con.execute(
+            f"CREATE OR REPLACE TABLE {FILTER_OPTIONS} AS {_filter_options_select_sql()} ORDER BY filter_name, value"
+        ).fetchone()[0]
+        logger.info(f"Creata {FILTER_OPTIONS} (righe: {n:,})")
+
+        if _table_exists(con, Schemas.SILVER, "calls_clean"):
+            n = con.execute(
+                f"CREATE OR REPLACE TABLE {CALLS_FILTER_OPTIONS} AS {_calls_filter_options_select_sql()} "
+                "ORDER BY filter_name, value"
+            ).fetchone()[0]
+            logger.info(f"Creata {CALLS_FILTER_OPTIONS} (righe: {n:,})")
+
 
 @task(name="gold_create_kpi_views")
 def create_kpi_views() -> None:
+    """Viste KPI sopra gold.kpi_cube (aggregati di migliaia di righe, non della fact)."""
     logger = get_run_logger()
 
     with get_db_connection() as con:
@@ -10,47 +305,84 @@ def create_kpi_views() -> None:
 
         # Q1 - Avg response time (trend mensile)
         con.execute("DROP VIEW IF EXISTS gold.v_kpi_response_time_month")
-        con.execute("""
+        con.execute(f"""
         CREATE VIEW gold.v_kpi_response_time_month AS
         SELECT
-            d.year,
-            d.month,
-            AVG(f.response_time_sec) AS avg_response_time_sec,
-            COUNT(*) AS n_incidents
-        FROM gold.fact_incident f
-        JOIN gold.dim_date d ON d.date_id = f.date_id
-        WHERE f.response_time_sec IS NOT NULL
+            year,
+            month,
+            {avg_sql("response_time")} AS avg_response_time_sec,
+            CAST(SUM(n_response_time) AS BIGINT) AS n_incidents
+        FROM {KPI_CUBE}
         GROUP BY 1,2
+        HAVING SUM(n_response_time) > 0
         ORDER BY 1,2
         """)
 
         # Q2 - Incident count per mese
         con.execute("DROP VIEW IF EXISTS gold.v_kpi_incident_volume_month")
-        con.execute("""
+        con.execute(f"""
         CREATE VIEW gold.v_kpi_incident_volume_month AS
         SELECT
-            d.year,
-            d.month,
-            COUNT(*) AS incident_count
-        FROM gold.fact_incident f
-        JOIN gold.dim_date d ON d.date_id = f.date_id
+            year,
+            month,
+            CAST(SUM(n_incidents) AS BIGINT) AS incident_count
+        FROM {KPI_CUBE}
         GROUP BY 1,2
         ORDER BY 1,2
         """)
 
         # Q3 - Top incident types
         con.execute("DROP VIEW IF EXISTS gold.v_kpi_top_incident_type")
-        con.execute("""
+        con.execute(f"""
         CREATE VIEW gold.v_kpi_top_incident_type AS
         SELECT
-            it.call_type_group,
-            it.call_type,
-            COUNT(*) AS incident_count,
-            AVG(f.response_time_sec) AS avg_response_time_sec
-        FROM gold.fact_incident f
-        JOIN gold.dim_incident_type it ON it.incident_type_id = f.incident_type_id
+            call_type_group,
+            call_type,
+            CAST(SUM(n_incidents) AS BIGINT) AS incident_count,
+            {avg_sql("response_time")} AS avg_response_time_sec
+        FROM {KPI_CUBE}
         GROUP BY 1,2
         ORDER BY incident_count DESC
         """)
 
-        logger.info("Create KPI views in gold.*")
+        # Q4 - Percentili response time per mese e quartiere (dall'istogramma, non dalla fact)
+        con.execute("DROP VIEW IF EXISTS gold.v_kpi_response_pctl_month")
+        con.execute(f"""
+        CREATE VIEW gold.v_kpi_response_pctl_month AS
+        {hist_quantiles_sql(RESPONSE_PERCENTILES, ["year", "month", "neighborhood"])}
+        ORDER BY 1,2,3
+        """)
+
+        # Q5 - KPI filtrati: gold.kpi_summary / kpi_response_time_month / kpi_response_pctl(year, month, ctg, neigh)
+        # (parametri p_*: i nomi delle colonne dentro la macro verrebbero sostituiti)
+        macro_params = ", ".join(_KPI_MACRO_FILTERS)
+        macro_where = "WHERE " + "\n AND ".join(
+            f"({param} IS NULL OR {col} = {param})" for param, col in _KPI_MACRO_FILTERS.items()
+        )
+        con.execute(f"""
+        CREATE OR REPLACE MACRO {KPI_SUMMARY_MACRO}({macro_params}) AS TABLE
+        SELECT
+            CAST(COALESCE(SUM(n_incidents), 0) AS BIGINT) AS total_incidents,
+            {", ".join(f"{avg_sql(m)} AS avg_{m}_sec" for m in CUBE_MEASURES)}
+        FROM {KPI_CUBE}
+        {macro_where}
+        """)
+        con.execute(f"""
+        CREATE OR REPLACE MACRO {KPI_RESPONSE_MONTH_MACRO}({macro_params}) AS TABLE
+        SELECT
+            year,
+            month,
+            {avg_sql("response_time")} AS avg_response_time_sec,
+            CAST(SUM(n_response_time) AS BIGINT) AS n_incidents
+        FROM {KPI_CUBE}
+        {macro_where}
+        GROUP BY 1,2
+        HAVING SUM(n_response_time) > 0
+        ORDER BY 1,2
+        """)
+        con.execute(f"""
+        CREATE OR REPLACE MACRO {KPI_RESPONSE_PCTL_MACRO}({macro_params}) AS TABLE
+        {hist_quantiles_sql(RESPONSE_PERCENTILES, where=macro_where)}
+        """)
+
+        logger.info("Create KPI views in gold.* (sopra gold.kpi_cube / gold.kpi_response_hist)")
@@ -0,0 +1,138 @@
+"""Schema registry del Data Lake: tipi DuckDB per le colonne (sanitizzate) dei dataset SF.
+
+Il writer del lake legge i CSV tutti VARCHAR e applica questi tipi con cast NON stretti:
+un valore non convertibile diventa NULL nella colonna tipizzata e il valore originale
+finisce nella colonna `_rejects` (lista di struct {column, value}), così non si perde nulla.
+Le colonne non in registry restano VARCHAR.
+
+Timestamp/date usano gli stessi parser del silver (silver_sql), con il formato rilevato
+sul campione del file provato per primo.
+"""
+from etl.tasks.silver_sql import detect_formats, parse_date_sql, parse_ts_sql
+
+
+REJECTS_COL = "_rejects"
+REJECTS_TYPE = "STRUCT(\"column\" VARCHAR, \"value\" VARCHAR)[]"
+
+# varianti di naming Phase1/Phase2 incluse (stesso tipo)
+LAKE_SCHEMAS: dict[str, dict[str, str]] = {
+    "fire_calls": {
+        "call_number": "BIGINT",
+        "incident_number": "BIGINT",
+        "call_date": "DATE",
+        "watch_date": "DATE",
+        "received_dt_tm": "TIMESTAMP",
+        "received_dttm": "TIMESTAMP",
+        "entry_dt_tm": "TIMESTAMP",
+        "entry_dttm": "TIMESTAMP",
+        "dispatch_dt_tm": "TIMESTAMP",
+        "dispatch_dttm": "TIMESTAMP",
+        "response_dt_tm": "TIMESTAMP",
+        "response_dttm": "TIMESTAMP",
+        "on_scene_dt_tm": "TIMESTAMP",
+        "on_scene_dttm": "TIMESTAMP",
+        "transport_dt_tm": "TIMESTAMP",
+        "transport_dttm": "TIMESTAMP",
+        "hospital_dt_tm": "TIMESTAMP",
+        "hospital_dttm": "TIMESTAMP",
+        "available_dt_tm": "TIMESTAMP",
+        "available_dttm": "TIMESTAMP",
+        "zipcode_of_incident": "INTEGER",
+        "supervisor_district": "INTEGER",
+        "number_of_alarms": "INTEGER",
+        "unit_sequence_in_call_dispatch": "INTEGER",
+    },
+    "fire_incidents": {
+        "incident_number": "BIGINT",
+        "call_number": "BIGINT",
+        "exposure_number": "INTEGER",
+        "incident_date": "DATE",
+        "alarm_dt_tm": "TIMESTAMP",
+        "arrival_dt_tm": "TIMESTAMP",
+        "close_dt_tm": "TIMESTAMP",
+        "zipcode": "INTEGER",
+        "supervisor_district": "INTEGER",
+        "number_of_alarms": "INTEGER",
+        "suppression_units": "INTEGER",
+        "suppression_personnel": "INTEGER",
+        "ems_units": "INTEGER",
+        "ems_personnel": "INTEGER",
+        "other_units": "INTEGER",
+        "other_personnel": "INTEGER",
+        "estimated_property_loss": "BIGINT",
+        "estimated_contents_loss": "BIGINT",
+        "fire_fatalities": "BIGINT",
+        "fire_injuries": "BIGINT",
+        "civilian_fatalities": "BIGINT",
+        "civilian_injuries": "BIGINT",
+    },
+}
+
+
+def _q(col: str) -> str:
+    return f'"{col}"'
+
+
+def _cast_sql(col: str, col_type: str, fmt: str | None) -> str:
+    if col_type == "TIMESTAMP":
+        return f"CAST({parse_ts_sql(col, fmt)} AS TIMESTAMP)"
+    if col_type == "DATE":
+        return f"CAST({parse_date_sql(col, fmt)} AS DATE)"
+    return f"try_cast({col} AS {col_type})"
+
+
+def typed_projection(
+    con, relation: str, dataset: str, cols: list[str], sample_relation: str | None = None
+) -> tuple[str, dict[str, str]]:
+    """
+    SELECT tipizzata sopra `relation` (colonne VARCHAR `cols`, già sanitizzate).
+
+    Ritorna (sql, {colonna: tipo}) con le colonne nello stesso ordine + REJECTS_COL.
+    Dataset senza registry (o senza colonne in registry): passthrough, nessun _rejects.
+    `sample_relation`: relazione equivalente più leggera per il campione dei formati
+    (es. senza window functions, che impedirebbero il LIMIT anticipato).
+    """
+    schema = LAKE_SCHEMAS.get(dataset, {})
+    typed = {c: schema[c] for c in cols if c in schema}
+    if not typed:
+        return f"SELECT * FROM {relation}", {}
+
+    # formato dominante sul campione del file (stesso sniffing del silver)
+    formats = {
+        c: fmt
+        for c, (fmt, _, _) in detect_formats(
+            con,
+            sample_relation or relation,
+            [c for c, t in typed.items() if t == "TIMESTAMP"],
+            [c for c, t in typed.items() if t == "DATE"],
+        ).items()
+    }
+
+    # livello 1: valore grezzo + tipizzato (parsing una volta sola), livello 2: rejects dal confronto
+    inner = ",\n".join(
+        [_q(c) for c in cols]
+        + [f"{_cast_sql(_q(c), t, formats.get(c))} AS {_q('__typed_' + c)}" for c, t in typed.items()]
+    )
+    failed = {c: f"({_q(c)} IS NOT NULL AND {_q('__typed_' + c)} IS NULL)" for c in typed}
+    entries = ", ".join(
+        f"CASE WHEN {cond} THEN {{'column': '{c}', 'value': {_q(c)}}} END" for c, cond in failed.items()
+    )
+    rejects = f"""
+      CASE WHEN {" OR ".join(failed.values())}
+      THEN list_filter([{entries}], x -> x IS NOT NULL)
+      END
+    """
+    outer = ",\n".join(
+        [f"{_q('__typed_' + c)} AS {_q(c)}" if c in typed else _q(c) for c in cols]
+        + [f"CAST({rejects} AS {REJECTS_TYPE}) AS {REJECTS_COL}"]
+    )
+    sql = f"""
+    SELECT
+      {outer}
+    FROM (
+      SELECT
+        {inner}
+      FROM {relation}
+    )
+    """
+    return sql, typed
@@ -1,32 +1,13 @@
 from prefect import task, get_run_logger
 
 from etl.utils import get_db_connection, Schemas
-
-
-def _parse_ts_sql(col: str) -> str:
-    """Parsing timestamp robusto (DuckDB).
-
-    `col` deve essere un identificatore SQL (nome colonna già sanitizzato).
-    """
-    return f"""
-    COALESCE(
-        try_strptime({col}, '%m/%d/%Y %I:%M:%S %p'),
-        try_strptime({col}, '%m/%d/%Y %H:%M:%S'),
-        try_strptime({col}, '%Y-%m-%d %H:%M:%S'),
-        try_cast({col} AS TIMESTAMP)
-    )
-    """
-
-
-def _parse_date_sql(col: str) -> str:
-    """Parsing date robusto (DuckDB)."""
-    return f"""
-    COALESCE(
-        try_strptime({col}, '%m/%d/%Y'),
-        try_strptime({col}, '%Y-%m-%d'),
-        try_cast({col} AS DATE)
-    )
-    """
+from etl.tasks.silver_sql import (
+    calls_metrics_sql,
+    dedup_qualify_sql,
+    detect_formats,
+    parse_date_sql,
+    parse_ts_sql,
+)
 
 
 def _table_columns(con, schema: str, table: str) -> set[str]:
@@ -55,13 +36,16 @@ def clean_silver() -> None:
     with get_db_connection() as con:
         con.execute(f"CREATE SCHEMA IF NOT EXISTS {Schemas.SILVER}")
 
+        # Full rebuild: eventuali chiavi delta della Phase2 non sono più valide
+        con.execute(f"DROP TABLE IF EXISTS {Schemas.SILVER}._delta_call_number")
+        con.execute(f"DROP TABLE IF EXISTS {Schemas.SILVER}._delta_incident_number")
+
         # Read actual schemas
         calls_cols = _table_columns(con, Schemas.BRONZE, "calls")
         inc_cols = _table_columns(con, Schemas.BRONZE, "incidents")
 
         # Optional Phase2 ordering column
         has_calls_ingested = "_ingested_at_utc" in calls_cols
-        order_calls_ingested = "try_cast(_ingested_at_utc AS TIMESTAMP) DESC," if has_calls_ingested else ""
 
         # -------------------------
         # Resolve bronze.calls names (based on your PRAGMA)
@@ -156,100 +140,121 @@ def clean_silver() -> None:
         # -------------------------
         con.execute("DROP TABLE IF EXISTS silver.calls_clean")
 
+        # Format sniffing su un campione (Phase1: file unico, niente cache per sha)
+        calls_ts_cols = [
+            received_col, entry_col, dispatch_col, response_col,
+            on_scene_col, transport_col, hospital_col, available_col,
+        ]
+        calls_fmt = {
+            c: f for c, (f, _, _) in detect_formats(
+                con, "bronze.calls", calls_ts_cols, ["call_date", "watch_date"]
+            ).items() if f
+        }
+        logger.info(f"silver.calls_clean formati rilevati: {calls_fmt}")
+
+        calls_order = ["COALESCE(received_ts, TIMESTAMP '1900-01-01') DESC"]
+        if has_calls_ingested:
+            calls_order.append("COALESCE(ingested_ts, TIMESTAMP '1900-01-01') DESC")
+        calls_order.append("row_id DESC")
+
         calls_sql = f"""
         CREATE TABLE silver.calls_clean AS
+        WITH base AS (
+            SELECT
+                -- Keys
+                try_cast({call_number_col} AS BIGINT) AS call_number,
+                try_cast({incident_number_col} AS BIGINT) AS incident_number,
+                unit_id,
+
+                -- Type / Priority
+                call_type,
+                call_type_group,
+                try_cast(original_priority AS INTEGER) AS original_priority,
+                try_cast(priority AS INTEGER) AS priority,
+                try_cast(final_priority AS INTEGER) AS final_priority,
+                als_unit,
+
+                -- Dates / Timestamps (parsati UNA volta)
+                {parse_date_sql("call_date", calls_fmt.get("call_date"))}  AS call_date,
+                {parse_date_sql("watch_date", calls_fmt.get("watch_date"))} AS watch_date,
+
+                {parse_ts_sql(received_col, calls_fmt.get(received_col))}   AS received_ts,
+                {parse_ts_sql(entry_col, calls_fmt.get(entry_col))}      AS entry_ts,
+                {parse_ts_sql(dispatch_col, calls_fmt.get(dispatch_col))}   AS dispatch_ts,
+                {parse_ts_sql(response_col, calls_fmt.get(response_col))}   AS response_ts,
+                {parse_ts_sql(on_scene_col, calls_fmt.get(on_scene_col))}   AS on_scene_ts,
+                {parse_ts_sql(transport_col, calls_fmt.get(transport_col))}  AS transport_ts,
+                {parse_ts_sql(hospital_col, calls_fmt.get(hospital_col))}   AS hospital_ts,
+                {parse_ts_sql(available_col, calls_fmt.get(available_col))}  AS available_ts,
+
+                -- Location
+                address,
+                city,
+                try_cast({zipcode_inc_col} AS INTEGER) AS zipcode_of_incident,
+                battalion,
+                station_area,
+                box,
+                try_cast({supervisor_col} AS INTEGER) AS supervisor_district,
+
+                -- Fix da sanitize/typo
+                {neigh_col} AS neighborhoods_analysis_boundaries,
+                location,
+
+                -- Other useful fields
+                call_final_disposition,
+                try_cast({num_alarms_col} AS INTEGER) AS number_of_alarms,
+                unit_type,
+                try_cast({unit_seq_col} AS INTEGER) AS unit_sequence_in_call_dispatch,
+                fire_prevention_district,
+                {calls_rowid_col} AS row_id
+                {", try_cast(_ingested_at_utc AS TIMESTAMP) AS ingested_ts" if has_calls_ingested else ""}
+            FROM bronze.calls
+        )
         SELECT
-            -- Keys
-            try_cast({call_number_col} AS BIGINT) AS call_number,
-            try_cast({incident_number_col} AS BIGINT) AS incident_number,
+            call_number,
+            incident_number,
             unit_id,
 
-            -- Type / Priority
             call_type,
             call_type_group,
-            try_cast(original_priority AS INTEGER) AS original_priority,
-            try_cast(priority AS INTEGER) AS priority,
-            try_cast(final_priority AS INTEGER) AS final_priority,
+            original_priority,
+            priority,
+            final_priority,
             als_unit,
 
-            -- Dates / Timestamps
-            {_parse_date_sql("call_date")}  AS call_date,
-            {_parse_date_sql("watch_date")} AS watch_date,
-
-            {_parse_ts_sql(received_col)}   AS received_ts,
-            {_parse_ts_sql(entry_col)}      AS entry_ts,
-            {_parse_ts_sql(dispatch_col)}   AS dispatch_ts,
-            {_parse_ts_sql(response_col)}   AS response_ts,
-            {_parse_ts_sql(on_scene_col)}   AS on_scene_ts,
-            {_parse_ts_sql(transport_col)}  AS transport_ts,
-            {_parse_ts_sql(hospital_col)}   AS hospital_ts,
-            {_parse_ts_sql(available_col)}  AS available_ts,
-
-            -- Derived metrics (seconds)
-            CASE
-              WHEN {_parse_ts_sql(received_col)} IS NOT NULL
-               AND {_parse_ts_sql(on_scene_col)} IS NOT NULL
-              THEN
-                CASE
-                  WHEN datediff('second', {_parse_ts_sql(received_col)}, {_parse_ts_sql(on_scene_col)}) >= 0
-                  THEN datediff('second', {_parse_ts_sql(received_col)}, {_parse_ts_sql(on_scene_col)})
-                  ELSE NULL
-                END
-              ELSE NULL
-            END AS response_time_sec,
-
-            CASE
-              WHEN {_parse_ts_sql(received_col)} IS NOT NULL
-               AND {_parse_ts_sql(dispatch_col)} IS NOT NULL
-              THEN
-                CASE
-                  WHEN datediff('second', {_parse_ts_sql(received_col)}, {_parse_ts_sql(dispatch_col)}) >= 0
-                  THEN datediff('second', {_parse_ts_sql(received_col)}, {_parse_ts_sql(dispatch_col)})
-                  ELSE NULL
-                END
-              ELSE NULL
-            END AS dispatch_delay_sec,
-
-            CASE
-              WHEN {_parse_ts_sql(dispatch_col)} IS NOT NULL
-               AND {_parse_ts_sql(on_scene_col)} IS NOT NULL
-              THEN
-                CASE
-                  WHEN datediff('second', {_parse_ts_sql(dispatch_col)}, {_parse_ts_sql(on_scene_col)}) >= 0
-                  THEN datediff('second', {_parse_ts_sql(dispatch_col)}, {_parse_ts_sql(on_scene_col)})
-                  ELSE NULL
-                END
-              ELSE NULL
-            END AS travel_time_sec,
-
-            -- Location
+            call_date,
+            watch_date,
+
+            received_ts,
+            entry_ts,
+            dispatch_ts,
+            response_ts,
+            on_scene_ts,
+            transport_ts,
+            hospital_ts,
+            available_ts,
+
+            -- Derived metrics (seconds) sulle colonne già parsate
+            {calls_metrics_sql()},
+
             address,
             city,
-            try_cast({zipcode_inc_col} AS INTEGER) AS zipcode_of_incident,
+            zipcode_of_incident,
             battalion,
             station_area,
             box,
-            try_cast({supervisor_col} AS INTEGER) AS supervisor_district,
-
-            -- Fix da sanitize/typo
-            {neigh_col} AS neighborhoods_analysis_boundaries,
+            supervisor_district,
+            neighborhoods_analysis_boundaries,
             location,
 
-            -- Other useful fields
             call_final_disposition,
-            try_cast({num_alarms_col} AS INTEGER) AS number_of_alarms,
+            number_of_alarms,
             unit_type,
-            try_cast({unit_seq_col} AS INTEGER) AS unit_sequence_in_call_dispatch,
+            unit_sequence_in_call_dispatch,
             fire_prevention_district,
-            {calls_rowid_col} AS row_id
-        FROM bronze.calls
-        QUALIFY ROW_NUMBER() OVER (
-          PARTITION BY try_cast({call_number_col} AS BIGINT)
-          ORDER BY
-            COALESCE({_parse_ts_sql(received_col)}, TIMESTAMP '1900-01-01') DESC,
-            {order_calls_ingested}
-            {calls_rowid_col} DESC
-        ) = 1
+            row_id
+        FROM base
+        {dedup_qualify_sql("call_number", *calls_order)}
         ;
         """
         logger.info("Creo silver.calls_clean ...")
@@ -261,99 +266,107 @@ def clean_silver() -> None:
         # -------------------------
         con.execute("DROP TABLE IF EXISTS silver.incidents_clean")
 
+        inc_fmt = {
+            c: f for c, (f, _, _) in detect_formats(
+                con, "bronze.incidents", [alarm_col, arrival_col, close_col], [inc_incident_date_col]
+            ).items() if f
+        }
+        logger.info(f"silver.incidents_clean formati rilevati: {inc_fmt}")
+
         incidents_sql = f"""
         CREATE TABLE silver.incidents_clean AS
-        SELECT
-            -- Keys
-            try_cast({inc_incident_col} AS BIGINT)  AS incident_number,
-            try_cast({inc_call_col} AS BIGINT)      AS call_number,
-            try_cast({inc_exposure_col} AS INTEGER) AS exposure_number,
-
-            -- Date / timestamps
-            {_parse_date_sql(inc_incident_date_col)} AS incident_date,
-            {_parse_ts_sql(alarm_col)}               AS alarm_ts,
-            {_parse_ts_sql(arrival_col)}             AS arrival_ts,
-            {_parse_ts_sql(close_col)}               AS close_ts,
-
-            -- Location
-            address,
-            city,
-            try_cast({inc_zip_col} AS INTEGER) AS zipcode,
-            battalion,
-            station_area,
-            box,
-            try_cast({inc_supervisor_col} AS INTEGER) AS supervisor_district,
-            {inc_neigh_col} AS neighborhood_district,
-            location,
+        WITH base AS (
+            SELECT
+                -- Keys
+                try_cast({inc_incident_col} AS BIGINT)  AS incident_number,
+                try_cast({inc_call_col} AS BIGINT)      AS call_number,
+                try_cast({inc_exposure_col} AS INTEGER) AS exposure_number,
+
+                -- Date / timestamps
+                {parse_date_sql(inc_incident_date_col, inc_fmt.get(inc_incident_date_col))} AS incident_date,
+                {parse_ts_sql(alarm_col, inc_fmt.get(alarm_col))}               AS alarm_ts,
+                {parse_ts_sql(arrival_col, inc_fmt.get(arrival_col))}             AS arrival_ts,
+                {parse_ts_sql(close_col, inc_fmt.get(close_col))}               AS close_ts,
+
+                -- Location
+                address,
+                city,
+                try_cast({inc_zip_col} AS INTEGER) AS zipcode,
+                battalion,
+                station_area,
+                box,
+                try_cast({inc_supervisor_col} AS INTEGER) AS supervisor_district,
+                {inc_neigh_col} AS neighborhood_district,
+                location,
+
+                -- Measures / severity
+                try_cast({inc_numberof_alarms_col} AS INTEGER) AS number_of_alarms,
+                try_cast(suppression_units AS INTEGER) AS suppression_units,
+                try_cast(suppression_personnel AS INTEGER) AS suppression_personnel,
+                try_cast({inc_ems_units_col} AS INTEGER) AS ems_units,
+                try_cast({inc_ems_personnel_col} AS INTEGER) AS ems_personnel,
+                try_cast(other_units AS INTEGER) AS other_units,
+                try_cast(other_personnel AS INTEGER) AS other_personnel,
 
-            -- Measures / severity
-            try_cast({inc_numberof_alarms_col} AS INTEGER) AS number_of_alarms,
-            try_cast(suppression_units AS INTEGER) AS suppression_units,
-            try_cast(suppression_personnel AS INTEGER) AS suppression_personnel,
-            try_cast({inc_ems_units_col} AS INTEGER) AS ems_units,
-            try_cast({inc_ems_personnel_col} AS INTEGER) AS ems_personnel,
-            try_cast(other_units AS INTEGER) AS other_units,
-            try_cast(other_personnel AS INTEGER) AS other_personnel,
-
-            CASE
-              WHEN try_cast(estimated_property_loss AS BIGINT) < 0 THEN NULL
-              ELSE try_cast(estimated_property_loss AS BIGINT)
-            END AS estimated_property_loss,
-            CASE
-              WHEN try_cast(estimated_contents_loss AS BIGINT) < 0 THEN NULL
-              ELSE try_cast(estimated_contents_loss AS BIGINT)
-            END AS estimated_contents_loss,
-
-            try_cast(fire_fatalities AS BIGINT) AS fire_fatalities,
-            try_cast(fire_injuries AS BIGINT) AS fire_injuries,
-            try_cast(civilian_fatalities AS BIGINT) AS civilian_fatalities,
-            try_cast(civilian_injuries AS BIGINT) AS civilian_injuries,
-
-            -- Situation / attributes
-            primary_situation,
-            mutual_aid,
-            action_taken_primary,
-            action_taken_secondary,
-            action_taken_other,
-            detector_alerted_occupants,
-            property_use,
-            {inc_area_fire_origin_col} AS area_of_fire_origin,
-            ignition_cause,
-            ignition_factor_primary,
-            ignition_factor_secondary,
-            heat_source,
-            item_first_ignited,
-            {inc_human_factors_col} AS human_factors_associated_with_ignition,
-            structure_type,
-            structure_status,
-            {inc_floor_fire_origin_col} AS floor_of_fire_origin,
-            fire_spread,
-            no_flame_spead,
-
-            try_cast({inc_floors_min_col} AS INTEGER) AS floors_min_damage,
-            try_cast({inc_floors_sig_col} AS INTEGER) AS floors_significant_damage,
-            try_cast({inc_floors_heavy_col} AS INTEGER) AS floors_heavy_damage,
-            try_cast({inc_floors_ext_col} AS INTEGER) AS floors_extreme_damage,
-
-            detectors_present,
-            detector_type,
-            detector_operation,
-            detector_effectiveness,
-            detector_failure_reason,
-
-            {aes_present_col} AS automatic_extinguishing_system_present,
-            {aes_type_col} AS automatic_extinguishing_system_type,
-            {aes_perf_col} AS automatic_extinguishing_system_performance,
-            {aes_fail_col} AS automatic_extinguishing_system_failure_reason,
-            try_cast({inc_sprinkler_heads_col} AS INTEGER) AS sprinkler_heads_operating,
-
-            first_unit_on_scene
-        FROM bronze.incidents
-        QUALIFY ROW_NUMBER() OVER (
-          PARTITION BY try_cast({inc_incident_col} AS BIGINT)
-          ORDER BY
-            COALESCE({_parse_ts_sql(alarm_col)}, TIMESTAMP '1900-01-01') DESC
-        ) = 1
+                CASE
+                  WHEN try_cast(estimated_property_loss AS BIGINT) < 0 THEN NULL
+                  ELSE try_cast(estimated_property_loss AS BIGINT)
+                END AS estimated_property_loss,
+                CASE
+                  WHEN try_cast(estimated_contents_loss AS BIGINT) < 0 THEN NULL
+                  ELSE try_cast(estimated_contents_loss AS BIGINT)
+                END AS estimated_contents_loss,
+
+                try_cast(fire_fatalities AS BIGINT) AS fire_fatalities,
+                try_cast(fire_injuries AS BIGINT) AS fire_injuries,
+                try_cast(civilian_fatalities AS BIGINT) AS civilian_fatalities,
+                try_cast(civilian_injuries AS BIGINT) AS civilian_injuries,
+
+                -- Situation / attributes
+                primary_situation,
+                mutual_aid,
+                action_taken_primary,
+                action_taken_secondary,
+                action_taken_other,
+                detector_alerted_occupants,
+                property_use,
+                {inc_area_fire_origin_col} AS area_of_fire_origin,
+                ignition_cause,
+                ignition_factor_primary,
+                ignition_factor_secondary,
+                heat_source,
+                item_first_ignited,
+                {inc_human_factors_col} AS human_factors_associated_with_ignition,
+                structure_type,
+                structure_status,
+                {inc_floor_fire_origin_col} AS floor_of_fire_origin,
+                fire_spread,
+                no_flame_spead,
+
+                try_cast({inc_floors_min_col} AS INTEGER) AS floors_min_damage,
+                try_cast({inc_floors_sig_col} AS INTEGER) AS floors_significant_damage,
+                try_cast({inc_floors_heavy_col} AS INTEGER) AS floors_heavy_damage,
+                try_cast({inc_floors_ext_col} AS INTEGER) AS floors_extreme_damage,
+
+                detectors_present,
+                detector_type,
+                detector_operation,
+                detector_effectiveness,
+                detector_failure_reason,
+
+                {aes_present_col} AS automatic_extinguishing_system_present,
+                {aes_type_col} AS automatic_extinguishing_system_type,
+                {aes_perf_col} AS automatic_extinguishing_system_performance,
+                {aes_fail_col} AS automatic_extinguishing_system_failure_reason,
+                try_cast({inc_sprinkler_heads_col} AS INTEGER) AS sprinkler_heads_operating,
+
+                first_unit_on_scene
+            FROM bronze.incidents
+        )
+        -- dedup sulle colonne già parsate di base (alarm_ts parsato una volta)
+        SELECT *
+        FROM base
+        {dedup_qualify_sql("incident_number", "COALESCE(alarm_ts, TIMESTAMP '1900-01-01') DESC")}
         ;
         """
         logger.info("Creo silver.incidents_clean ...")
@@ -1,23 +1,48 @@
 from prefect import task, get_run_logger
 from etl.utils import get_db_connection, Schemas
 
-# riuso gli helper già presenti in silver.py (stesso progetto)
-from etl.tasks.silver import _parse_date_sql, _parse_ts_sql
-
-
-def _table_cols(con, schema: str, table: str) -> set[str]:
+from etl.tasks.silver_sql import (
+    calls_metrics_sql,
+    dedup_qualify_sql,
+    formats_for_shas,
+    parse_date_sql,
+    parse_ts_sql,
+)
+
+# colonne timestamp / date per tabella bronze (varianti di naming Phase1/Phase2)
+_CALLS_TS_CANDIDATES = [
+    ("received_dt_tm", "received_dttm"),
+    ("entry_dt_tm", "entry_dttm"),
+    ("dispatch_dt_tm", "dispatch_dttm"),
+    ("response_dt_tm", "response_dttm"),
+    ("on_scene_dt_tm", "on_scene_dttm"),
+    ("transport_dt_tm", "transport_dttm"),
+    ("hospital_dt_tm", "hospital_dttm"),
+    ("available_dt_tm", "available_dttm"),
+]
+_CALLS_DATE_CANDIDATES = [("call_date",), ("watch_date",)]
+_INC_TS_CANDIDATES = [
+    ("alarm_dt_tm", "alarmdttm"),
+    ("arrival_dt_tm", "arrivaldttm"),
+    ("close_dt_tm", "closedttm"),
+]
+_INC_DATE_CANDIDATES = [("incident_date", "incidentdate")]
+
+
+def _table_cols(con, schema: str, table: str) -> dict[str, str]:
+    """{colonna: data_type}: bronze da lake tipizzato ha colonne già DATE/TIMESTAMP/INTEGER."""
     rows = con.execute(
         """
-        SELECT column_name
+        SELECT column_name, data_type
         FROM information_schema.columns
         WHERE table_schema = ? AND table_name = ?
         """,
         [schema, table],
     ).fetchall()
-    return {r[0] for r in rows}
+    return {r[0]: r[1] for r in rows}
 
 
-def _pick(cols: set[str], *candidates: str) -> str | None:
+def _pick(cols: dict[str, str], *candidates: str) -> str | None:
     """Ritorna il primo candidato presente in cols, altrimenti None."""
     for c in candidates:
         if c in cols:
@@ -25,195 +50,173 @@ def _pick(cols: set[str], *candidates: str) -> str | None:
     return None
 
 
-def _pick_or_null(cols: set[str], *candidates: str) -> str:
+def _pick_or_null(cols: dict[str, str], *candidates: str) -> str:
     """Ritorna un identificatore colonna se esiste, altrimenti NULL."""
     c = _pick(cols, *candidates)
     return c if c else "NULL"
 
 
-@task(name="Clean Silver (PHASE 2)", retries=0)
-def clean_silver_phase2(
-    memory_limit: str = "8GB",
-    temp_directory: str = "data/tmp_duckdb",
-    threads: int = 4,
-) -> None:
-    """
-    Silver PHASE 2:
-    - Robust a differenze naming tra Phase1/Phase2 (dttm vs dt_tm, rowid vs row_id, ecc.)
-    - Dedup con QUALIFY ROW_NUMBER()
-    - PRAGMA anti-OOM (spill su disco)
-    """
-    logger = get_run_logger()
+def _table_exists(con, schema: str, table: str) -> bool:
+    row = con.execute(
+        """
+        SELECT 1
+        FROM information_schema.tables
+        WHERE table_schema = ? AND table_name = ? AND table_type = 'BASE TABLE'
+        LIMIT 1
+        """,
+        [schema, table],
+    ).fetchone()
+    return row is not None
 
-    with get_db_connection() as con:
-        # ---- PRAGMA anti-OOM ----
-        con.execute(f"PRAGMA temp_directory='{temp_directory}';")
-        con.execute(f"PRAGMA memory_limit='{memory_limit}';")
-        con.execute(f"PRAGMA threads={int(threads)};")
-        con.execute("PRAGMA preserve_insertion_order=false;")
-        con.execute("PRAGMA threads=1;")
 
+def _picked(cols: dict[str, str], candidates: list[tuple[str, ...]]) -> list[str]:
+    # solo colonne ancora stringa: quelle tipizzate non hanno formati da rilevare
+    return [c for c in (_pick(cols, *cands) for cands in candidates) if c and cols[c] == "VARCHAR"]
 
-        con.execute(f"CREATE SCHEMA IF NOT EXISTS {Schemas.SILVER}")
 
-        # =====================================================================
-        # SILVER: CALLS
-        # =====================================================================
-        con.execute("DROP TABLE IF EXISTS silver.calls_clean")
+def _sniff_formats(con, table: str, cols: dict[str, str], ts_cands, date_cands, shas: list[str]) -> dict[str, str]:
+    """Formati rilevati (cache meta.ts_formats) per gli sha in scope di bronze.<table>."""
+    if "_source_sha256" not in cols:
+        return {}
+    return formats_for_shas(
+        con,
+        f"bronze.{table}",
+        _picked(cols, ts_cands),
+        _picked(cols, date_cands),
+        shas,
+    )
 
-        calls_cols = _table_cols(con, "bronze", "calls")
 
-        # timestamp columns: Phase1 usa *_dttm, Phase2 usa *_dt_tm
-        received_col = _pick(calls_cols, "received_dt_tm", "received_dttm")
-        entry_col = _pick(calls_cols, "entry_dt_tm", "entry_dttm")
-        dispatch_col = _pick(calls_cols, "dispatch_dt_tm", "dispatch_dttm")
-        response_col = _pick(calls_cols, "response_dt_tm", "response_dttm")
-        on_scene_col = _pick(calls_cols, "on_scene_dt_tm", "on_scene_dttm")
-        transport_col = _pick(calls_cols, "transport_dt_tm", "transport_dttm")
-        hospital_col = _pick(calls_cols, "hospital_dt_tm", "hospital_dttm")
-        available_col = _pick(calls_cols, "available_dt_tm", "available_dttm")
-
-        if not received_col:
-            # senza received non possiamo deduplicare correttamente => errore esplicito
-            raise RuntimeError(
-                "bronze.calls non contiene né received_dt_tm né received_dttm. "
-                "Controlla naming/ingest Bronze."
-            )
+def _bronze_shas(con, table: str, cols: dict[str, str]) -> list[str]:
+    if "_source_sha256" not in cols:
+        return []
+    rows = con.execute(
+        f"SELECT DISTINCT _source_sha256 FROM bronze.{table} WHERE _source_sha256 IS NOT NULL"
+    ).fetchall()
+    return [r[0] for r in rows]
 
-        # altre colonne con varianti frequenti
-        neighborhoods_col = _pick_or_null(
-            calls_cols,
-            "neighborhoods_analysis_boundaries",
-            "neighborhooods_analysis_boundaries",
-            "neighborhooods___analysis_boundaries",
-        )
-        rowid_col = _pick_or_null(calls_cols, "rowid", "row_id")
-
-        calls_sql = f"""
-        CREATE TABLE silver.calls_clean AS
-        WITH base AS (
-            SELECT
-                -- Keys
-                try_cast(call_number AS BIGINT) AS call_number,
-                try_cast(incident_number AS BIGINT) AS incident_number,
-                {_pick_or_null(calls_cols, "unit_id")} AS unit_id,
-        
-                -- Type / Priority
-                {_pick_or_null(calls_cols, "call_type")} AS call_type,
-                {_pick_or_null(calls_cols, "call_type_group")} AS call_type_group,
-                try_cast({_pick_or_null(calls_cols, "original_priority")} AS INTEGER) AS original_priority,
-                try_cast({_pick_or_null(calls_cols, "priority")} AS INTEGER) AS priority,
-                try_cast({_pick_or_null(calls_cols, "final_priority")} AS INTEGER) AS final_priority,
-                {_pick_or_null(calls_cols, "als_unit")} AS als_unit,
-        
-                -- Dates
-                {_parse_date_sql("call_date")}  AS call_date,
-                {_parse_date_sql("watch_date")} AS watch_date,
-        
-                -- Parsed timestamps (calcolati UNA volta)
-                {_parse_ts_sql(received_col)}    AS received_ts,
-                {_parse_ts_sql(entry_col)}       AS entry_ts,
-                {_parse_ts_sql(dispatch_col)}    AS dispatch_ts,
-                {_parse_ts_sql(response_col)}    AS response_ts,
-                {_parse_ts_sql(on_scene_col)}    AS on_scene_ts,
-                {_parse_ts_sql(transport_col)}   AS transport_ts,
-                {_parse_ts_sql(hospital_col)}    AS hospital_ts,
-                {_parse_ts_sql(available_col)}   AS available_ts,
-        
-                -- Location
-                {_pick_or_null(calls_cols, "address")} AS address,
-                {_pick_or_null(calls_cols, "city")} AS city,
-                try_cast({_pick_or_null(calls_cols, "zipcode_of_incident")} AS INTEGER) AS zipcode_of_incident,
-                {_pick_or_null(calls_cols, "battalion")} AS battalion,
-                {_pick_or_null(calls_cols, "station_area")} AS station_area,
-                {_pick_or_null(calls_cols, "box")} AS box,
-                try_cast({_pick_or_null(calls_cols, "supervisor_district")} AS INTEGER) AS supervisor_district,
-                {neighborhoods_col} AS neighborhoods_analysis_boundaries,
-                {_pick_or_null(calls_cols, "location")} AS location,
-        
-                -- Other useful fields
-                {_pick_or_null(calls_cols, "call_final_disposition")} AS call_final_disposition,
-                try_cast({_pick_or_null(calls_cols, "number_of_alarms")} AS INTEGER) AS number_of_alarms,
-                {_pick_or_null(calls_cols, "unit_type")} AS unit_type,
-                try_cast({_pick_or_null(calls_cols, "unit_sequence_in_call_dispatch")} AS INTEGER) AS unit_sequence_in_call_dispatch,
-                {_pick_or_null(calls_cols, "fire_prevention_district")} AS fire_prevention_district,
-                {rowid_col} AS rowid,
-        
-                -- Ingest ts (una volta)
-                try_cast(_ingested_at_utc AS TIMESTAMP) AS ingested_ts
-        
-            FROM bronze.calls
-        )
-        SELECT
-            *,
-            -- Derived metrics (seconds) usando le colonne già parse
-            CASE
-              WHEN received_ts IS NOT NULL AND on_scene_ts IS NOT NULL
-              THEN
-                CASE
-                  WHEN datediff('second', received_ts, on_scene_ts) >= 0
-                  THEN datediff('second', received_ts, on_scene_ts)
-                  ELSE NULL
-                END
-              ELSE NULL
-            END AS response_time_sec,
-        
-            CASE
-              WHEN received_ts IS NOT NULL AND dispatch_ts IS NOT NULL
-              THEN
-                CASE
-                  WHEN datediff('second', received_ts, dispatch_ts) >= 0
-                  THEN datediff('second', received_ts, dispatch_ts)
-                  ELSE NULL
-                END
-              ELSE NULL
-            END AS dispatch_delay_sec,
-        
-            CASE
-              WHEN dispatch_ts IS NOT NULL AND on_scene_ts IS NOT NULL
-              THEN
-                CASE
-                  WHEN datediff('second', dispatch_ts, on_scene_ts) >= 0
-                  THEN datediff('second', dispatch_ts, on_scene_ts)
-                  ELSE NULL
-                END
-              ELSE NULL
-            END AS travel_time_sec
-        
-        FROM base
-        QUALIFY ROW_NUMBER() OVER (
-          PARTITION BY call_number
-          ORDER BY
-            COALESCE(received_ts, TIMESTAMP '1900-01-01') DESC,
-            COALESCE(ingested_ts, TIMESTAMP '1900-01-01') DESC,
-            rowid DESC
-        ) = 1;
-        """
-        
 
-        logger.info("Creating silver.calls_clean (PHASE2) ...")
-        con.execute(calls_sql)
-        logger.info("silver.calls_clean created.")
+def _calls_clean_sql(calls_cols: dict[str, str], key_filter: str = "", formats: dict[str, str] | None = None) -> str:
+    """SELECT di silver.calls_clean a partire da bronze.calls.
 
-        # =====================================================================
-        # SILVER: INCIDENTS
-        # =====================================================================
-        con.execute("DROP TABLE IF EXISTS silver.incidents_clean")
+    `key_filter` è una clausola WHERE opzionale applicata a bronze.calls prima del
+    parsing (usata dalla modalità incrementale per limitarsi alle chiavi toccate).
+    `formats` mappa colonna -> formato rilevato (format sniffing), provato per primo.
+    `calls_cols` mappa colonna -> tipo: le colonne già DATE/TIMESTAMP (lake tipizzato) non
+    passano dal parsing stringa, i try_cast su colonne già numeriche sono no-op.
+    """
+    fmt = formats or {}
+    # timestamp columns: Phase1 usa *_dttm, Phase2 usa *_dt_tm
+    received_col = _pick(calls_cols, "received_dt_tm", "received_dttm")
+    entry_col = _pick(calls_cols, "entry_dt_tm", "entry_dttm")
+    dispatch_col = _pick(calls_cols, "dispatch_dt_tm", "dispatch_dttm")
+    response_col = _pick(calls_cols, "response_dt_tm", "response_dttm")
+    on_scene_col = _pick(calls_cols, "on_scene_dt_tm", "on_scene_dttm")
+    transport_col = _pick(calls_cols, "transport_dt_tm", "transport_dttm")
+    hospital_col = _pick(calls_cols, "hospital_dt_tm", "hospital_dttm")
+    available_col = _pick(calls_cols, "available_dt_tm", "available_dttm")
+
+    if not received_col:
+        # senza received non possiamo deduplicare correttamente => errore esplicito
+        raise RuntimeError(
+            "bronze.calls non contiene né received_dt_tm né received_dttm. "
+            "Controlla naming/ingest Bronze."
+        )
 
-        inc_cols = _table_cols(con, "bronze", "incidents")
+    # altre colonne con varianti frequenti
+    neighborhoods_col = _pick_or_null(
+        calls_cols,
+        "neighborhoods_analysis_boundaries",
+        "neighborhooods_analysis_boundaries",
+        "neighborhooods___analysis_boundaries",
+    )
+    rowid_col = _pick_or_null(calls_cols, "rowid", "row_id")
+
+    return f"""
+    WITH base AS (
+        SELECT
+            -- Keys
+            try_cast(call_number AS BIGINT) AS call_number,
+            try_cast(incident_number AS BIGINT) AS incident_number,
+            {_pick_or_null(calls_cols, "unit_id")} AS unit_id,
+    
+            -- Type / Priority
+            {_pick_or_null(calls_cols, "call_type")} AS call_type,
+            {_pick_or_null(calls_cols, "call_type_group")} AS call_type_group,
+            try_cast({_pick_or_null(calls_cols, "original_priority")} AS INTEGER) AS original_priority,
+            try_cast({_pick_or_null(calls_cols, "priority")} AS INTEGER) AS priority,
+            try_cast({_pick_or_null(calls_cols, "final_priority")} AS INTEGER) AS final_priority,
+            {_pick_or_null(calls_cols, "als_unit")} AS als_unit,
+    
+            -- Dates
+            {parse_date_sql("call_date", fmt.get("call_date"), calls_cols.get("call_date"))}  AS call_date,
+            {parse_date_sql("watch_date", fmt.get("watch_date"), calls_cols.get("watch_date"))} AS watch_date,
+    
+            -- Parsed timestamps (calcolati UNA volta)
+            {parse_ts_sql(received_col, fmt.get(received_col), calls_cols.get(received_col))}    AS received_ts,
+            {parse_ts_sql(entry_col, fmt.get(entry_col), calls_cols.get(entry_col))}       AS entry_ts,
+            {parse_ts_sql(dispatch_col, fmt.get(dispatch_col), calls_cols.get(dispatch_col))}    AS dispatch_ts,
+            {parse_ts_sql(response_col, fmt.get(response_col), calls_cols.get(response_col))}    AS response_ts,
+            {parse_ts_sql(on_scene_col, fmt.get(on_scene_col), calls_cols.get(on_scene_col))}    AS on_scene_ts,
+            {parse_ts_sql(transport_col, fmt.get(transport_col), calls_cols.get(transport_col))}   AS transport_ts,
+            {parse_ts_sql(hospital_col, fmt.get(hospital_col), calls_cols.get(hospital_col))}    AS hospital_ts,
+            {parse_ts_sql(available_col, fmt.get(available_col), calls_cols.get(available_col))}   AS available_ts,
+    
+            -- Location
+            {_pick_or_null(calls_cols, "address")} AS address,
+            {_pick_or_null(calls_cols, "city")} AS city,
+            try_cast({_pick_or_null(calls_cols, "zipcode_of_incident")} AS INTEGER) AS zipcode_of_incident,
+            {_pick_or_null(calls_cols, "battalion")} AS battalion,
+            {_pick_or_null(calls_cols, "station_area")} AS station_area,
+            {_pick_or_null(calls_cols, "box")} AS box,
+            try_cast({_pick_or_null(calls_cols, "supervisor_district")} AS INTEGER) AS supervisor_district,
+            {neighborhoods_col} AS neighborhoods_analysis_boundaries,
+            {_pick_or_null(calls_cols, "location")} AS location,
+    
+            -- Other useful fields
+            {_pick_or_null(calls_cols, "call_final_disposition")} AS call_final_disposition,
+            try_cast({_pick_or_null(calls_cols, "number_of_alarms")} AS INTEGER) AS number_of_alarms,
+            {_pick_or_null(calls_cols, "unit_type")} AS unit_type,
+            try_cast({_pick_or_null(calls_cols, "unit_sequence_in_call_dispatch")} AS INTEGER) AS unit_sequence_in_call_dispatch,
+            {_pick_or_null(calls_cols, "fire_prevention_district")} AS fire_prevention_district,
+            {rowid_col} AS rowid,
+    
+            -- Ingest ts (una volta)
+            try_cast(_ingested_at_utc AS TIMESTAMP) AS ingested_ts
+    
+        FROM bronze.calls
+        {key_filter}
+    )
+    SELECT
+        *,
+        -- Derived metrics (seconds) usando le colonne già parse
+        {calls_metrics_sql()}
+
+    FROM base
+    {dedup_qualify_sql(
+        "call_number",
+        "COALESCE(received_ts, TIMESTAMP '1900-01-01') DESC",
+        "COALESCE(ingested_ts, TIMESTAMP '1900-01-01') DESC",
+        "rowid DESC",
+    )}
+    """
 
-        # keys / timestamps: supporto naming con e senza underscore
-        inc_incident = _pick(inc_cols, "incident_number", "incidentnumber")
-        inc_call = _pick(inc_cols, "call_number", "callnumber")
-        inc_exposure = _pick(inc_cols, "exposure_number", "exposurenumber")
 
-        inc_incident_date = _pick(inc_cols, "incident_date", "incidentdate")
-        inc_alarm = _pick(inc_cols, "alarm_dt_tm", "alarmdttm", "alarm_dt_tm")
-        inc_arrival = _pick(inc_cols, "arrival_dt_tm", "arrivaldttm")
-        inc_close = _pick(inc_cols, "close_dt_tm", "closedttm")
+def _incidents_clean_sql(inc_cols: dict[str, str], key_filter: str = "", formats: dict[str, str] | None = None) -> str:
+    """SELECT di silver.incidents_clean a partire da bronze.incidents (vedi _calls_clean_sql)."""
+    fmt = formats or {}
+    # keys / timestamps: supporto naming con e senza underscore
+    inc_incident = _pick(inc_cols, "incident_number", "incidentnumber")
+    inc_call = _pick(inc_cols, "call_number", "callnumber")
+    inc_exposure = _pick(inc_cols, "exposure_number", "exposurenumber")
+
+    inc_incident_date = _pick(inc_cols, "incident_date", "incidentdate")
+    inc_alarm = _pick(inc_cols, "alarm_dt_tm", "alarmdttm", "alarm_dt_tm")
+    inc_arrival = _pick(inc_cols, "arrival_dt_tm", "arrivaldttm")
+    inc_close = _pick(inc_cols, "close_dt_tm", "closedttm")
 
-        incidents_sql = f"""
-        CREATE TABLE silver.incidents_clean AS
+    return f"""
+    WITH base AS (
         SELECT
             -- Keys
             try_cast({inc_incident} AS BIGINT) AS incident_number,
@@ -221,10 +224,10 @@ def clean_silver_phase2(
             try_cast({_pick_or_null(inc_cols, inc_exposure)} AS INTEGER) AS exposure_number,
 
             -- Date / timestamps
-            {_parse_date_sql(inc_incident_date)} AS incident_date,
-            {_parse_ts_sql(inc_alarm)}           AS alarm_ts,
-            {_parse_ts_sql(inc_arrival)}         AS arrival_ts,
-            {_parse_ts_sql(inc_close)}           AS close_ts,
+            {parse_date_sql(inc_incident_date, fmt.get(inc_incident_date), inc_cols.get(inc_incident_date))} AS incident_date,
+            {parse_ts_sql(inc_alarm, fmt.get(inc_alarm), inc_cols.get(inc_alarm))}           AS alarm_ts,
+            {parse_ts_sql(inc_arrival, fmt.get(inc_arrival), inc_cols.get(inc_arrival))}         AS arrival_ts,
+            {parse_ts_sql(inc_close, fmt.get(inc_close), inc_cols.get(inc_close))}           AS close_ts,
 
             -- Location
             {_pick_or_null(inc_cols, "address")} AS address,
@@ -263,19 +266,217 @@ def clean_silver_phase2(
 
             -- Type / situation
             {_pick_or_null(inc_cols, "primary_situation", "primarysituation")} AS primary_situation,
-            {_pick_or_null(inc_cols, "mutual_aid", "mutualaid")} AS mutual_aid
+            {_pick_or_null(inc_cols, "mutual_aid", "mutualaid")} AS mutual_aid,
+
+            -- Ingest ts (una volta, solo per il dedup)
+            try_cast(_ingested_at_utc AS TIMESTAMP) AS ingested_ts
 
         FROM bronze.incidents
-        QUALIFY ROW_NUMBER() OVER (
-          PARTITION BY try_cast({inc_incident} AS BIGINT), try_cast({inc_call} AS BIGINT)
-          ORDER BY
-            COALESCE({_parse_ts_sql(inc_alarm)}, TIMESTAMP '1900-01-01') DESC,
-            try_cast(_ingested_at_utc AS TIMESTAMP) DESC
-        ) = 1;
-        """
+        {key_filter}
+    )
+    -- dedup sulle colonne già parsate di base (alarm_ts parsato una volta)
+    SELECT * EXCLUDE (ingested_ts)
+    FROM base
+    {dedup_qualify_sql(
+        "incident_number, call_number",
+        "COALESCE(alarm_ts, TIMESTAMP '1900-01-01') DESC",
+        "ingested_ts DESC",
+    )}
+    """
+
 
-        logger.info("Creating silver.incidents_clean (PHASE2) ...")
-        con.execute(incidents_sql)
-        logger.info("silver.incidents_clean created.")
+@task(name="Clean Silver (PHASE 2)", retries=0)
+def clean_silver_phase2(
+    memory_limit: str = "8GB",
+    temp_directory: str = "data/tmp_duckdb",
+    threads: int = 4,
+    run_id: str | None = None,
+    pipeline_name: str = "phase2_incremental",
+) -> dict:
+    """
+    Silver PHASE 2:
+    - Robust a differenze naming tra Phase1/Phase2 (dttm vs dt_tm, rowid vs row_id, ecc.)
+    - Dedup con QUALIFY ROW_NUMBER()
+    - PRAGMA anti-OOM (spill su disco)
+
+    Modalità:
+    - FULL (run_id=None o silver non ancora presente): DROP/CREATE da tutto il bronze
+    - INCREMENTAL (run_id valorizzato): solo le chiavi (call_number / incident_number)
+      toccate dagli sha ingeriti nella run vengono ri-deduplicate e sostituite in silver
+      (DELETE + INSERT nella stessa transazione). Le chiavi toccate si accumulano in
+      silver._delta_call_number / silver._delta_incident_number per gli step a valle
+      (gold incrementale) finché clear_silver_delta_keys() non le svuota.
+    """
+    logger = get_run_logger()
+
+    with get_db_connection() as con:
+        # ---- PRAGMA anti-OOM ----
+        con.execute(f"PRAGMA temp_directory='{temp_directory}';")
+        con.execute(f"PRAGMA memory_limit='{memory_limit}';")
+        con.execute(f"PRAGMA threads={int(threads)};")
+        con.execute("PRAGMA preserve_insertion_order=false;")
+        con.execute("PRAGMA threads=1;")
+
+
+        con.execute(f"CREATE SCHEMA IF NOT EXISTS {Schemas.SILVER}")
+
+        calls_cols = _table_cols(con, "bronze", "calls")
+        inc_cols = _table_cols(con, "bronze", "incidents")
+
+        incremental = (
+            run_id is not None
+            and _table_exists(con, Schemas.SILVER, "calls_clean")
+            and _table_exists(con, Schemas.SILVER, "incidents_clean")
+        )
+
+        if not incremental:
+            # =================================================================
+            # FULL REBUILD
+            # =================================================================
+            con.execute(f"DROP TABLE IF EXISTS {Schemas.SILVER}._delta_call_number")
+            con.execute(f"DROP TABLE IF EXISTS {Schemas.SILVER}._delta_incident_number")
+
+            # format sniffing su tutti gli sha presenti in bronze (gli sha già visti sono in cache)
+            calls_fmt = _sniff_formats(
+                con, "calls", calls_cols, _CALLS_TS_CANDIDATES, _CALLS_DATE_CANDIDATES,
+                _bronze_shas(con, "calls", calls_cols),
+            )
+            inc_fmt = _sniff_formats(
+                con, "incidents", inc_cols, _INC_TS_CANDIDATES, _INC_DATE_CANDIDATES,
+                _bronze_shas(con, "incidents", inc_cols),
+            )
+            logger.info(f"Silver PHASE2 formati rilevati | calls={calls_fmt} incidents={inc_fmt}")
+
+            con.execute("DROP TABLE IF EXISTS silver.calls_clean")
+            logger.info("Creating silver.calls_clean (PHASE2) ...")
+            con.execute(f"CREATE TABLE silver.calls_clean AS {_calls_clean_sql(calls_cols, formats=calls_fmt)}")
+            logger.info("silver.calls_clean created.")
+
+            con.execute("DROP TABLE IF EXISTS silver.incidents_clean")
+            logger.info("Creating silver.incidents_clean (PHASE2) ...")
+            con.execute(f"CREATE TABLE silver.incidents_clean AS {_incidents_clean_sql(inc_cols, formats=inc_fmt)}")
+            logger.info("silver.incidents_clean created.")
+
+            logger.info("Silver PHASE2 clean + dedup completato (FULL).")
+            return {"mode": "full", "calls_keys": None, "incidents_keys": None}
+
+        # =====================================================================
+        # INCREMENTAL: solo chiavi toccate dagli sha della run
+        # =====================================================================
+        con.execute(
+            f"""
+            CREATE OR REPLACE TEMP TABLE _run_shas AS
+            SELECT DISTINCT file_sha256 AS sha
+            FROM {Schemas.META}.ingestion_log
+            WHERE run_id = ? AND pipeline_name = ? AND status = 'DONE'
+            """,
+            [run_id, pipeline_name],
+        )
+
+        inc_incident = _pick(inc_cols, "incident_number", "incidentnumber")
+
+        # format sniffing solo sui file nuovi della run (gli altri sono già in cache);
+        # le righe di sha più vecchi con formato diverso passano comunque dal fallback
+        run_shas = [r[0] for r in con.execute("SELECT sha FROM _run_shas").fetchall()]
+        calls_fmt = _sniff_formats(
+            con, "calls", calls_cols, _CALLS_TS_CANDIDATES, _CALLS_DATE_CANDIDATES, run_shas
+        )
+        inc_fmt = _sniff_formats(
+            con, "incidents", inc_cols, _INC_TS_CANDIDATES, _INC_DATE_CANDIDATES, run_shas
+        )
+
+        # le chiavi si accumulano finché clear_silver_delta_keys() non le consuma
+        # (una run gold fallita non perde le chiavi della run precedente)
+        con.execute(
+            f"CREATE TABLE IF NOT EXISTS {Schemas.SILVER}._delta_call_number (call_number BIGINT)"
+        )
+        con.execute(
+            f"CREATE TABLE IF NOT EXISTS {Schemas.SILVER}._delta_incident_number (incident_number BIGINT)"
+        )
+        con.execute(
+            f"""
+            CREATE OR REPLACE TEMP TABLE _run_call_number AS
+            SELECT DISTINCT try_cast(call_number AS BIGINT) AS call_number
+            FROM bronze.calls
+            WHERE _source_sha256 IN (SELECT sha FROM _run_shas)
+              AND try_cast(call_number AS BIGINT) IS NOT NULL
+            """
+        )
+        con.execute(
+            f"""
+            CREATE OR REPLACE TEMP TABLE _run_incident_number AS
+            SELECT DISTINCT try_cast({inc_incident} AS BIGINT) AS incident_number
+            FROM bronze.incidents
+            WHERE _source_sha256 IN (SELECT sha FROM _run_shas)
+              AND try_cast({inc_incident} AS BIGINT) IS NOT NULL
+            """
+        )
+        con.execute(
+            f"""
+            INSERT INTO {Schemas.SILVER}._delta_call_number
+            SELECT call_number FROM _run_call_number
+            WHERE call_number NOT IN (SELECT call_number FROM {Schemas.SILVER}._delta_call_number)
+            """
+        )
+        con.execute(
+            f"""
+            INSERT INTO {Schemas.SILVER}._delta_incident_number
+            SELECT incident_number FROM _run_incident_number
+            WHERE incident_number NOT IN (SELECT incident_number FROM {Schemas.SILVER}._delta_incident_number)
+            """
+        )
+
+        calls_keys = con.execute("SELECT COUNT(*) FROM _run_call_number").fetchone()[0]
+        incidents_keys = con.execute("SELECT COUNT(*) FROM _run_incident_number").fetchone()[0]
+        logger.info(f"Silver PHASE2 incremental | calls_keys={calls_keys} incidents_keys={incidents_keys}")
+
+        calls_filter = (
+            "WHERE try_cast(call_number AS BIGINT) IN "
+            f"(SELECT call_number FROM {Schemas.SILVER}._delta_call_number)"
+        )
+        incidents_filter = (
+            f"WHERE try_cast({inc_incident} AS BIGINT) IN "
+            f"(SELECT incident_number FROM {Schemas.SILVER}._delta_incident_number)"
+        )
+
+        con.execute("BEGIN TRANSACTION")
+        try:
+            # MERGE = DELETE delle chiavi toccate + INSERT della nuova versione dedup
+            con.execute(
+                f"""
+                DELETE FROM silver.calls_clean
+                WHERE call_number IN (SELECT call_number FROM {Schemas.SILVER}._delta_call_number)
+                """
+            )
+            con.execute(f"INSERT INTO silver.calls_clean BY NAME {_calls_clean_sql(calls_cols, calls_filter, calls_fmt)}")
+
+            con.execute(
+                f"""
+                DELETE FROM silver.incidents_clean
+                WHERE incident_number IN (SELECT incident_number FROM {Schemas.SILVER}._delta_incident_number)
+                """
+            )
+            con.execute(
+                f"INSERT INTO silver.incidents_clean BY NAME {_incidents_clean_sql(inc_cols, incidents_filter, inc_fmt)}"
+            )
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+
+        logger.info("Silver PHASE2 clean + dedup completato (INCREMENTAL).")
+        return {"mode": "incremental", "calls_keys": int(calls_keys), "incidents_keys": int(incidents_keys)}
+
+
+@task(name="Clear Silver delta keys (PHASE 2)", retries=0)
+def clear_silver_delta_keys() -> None:
+    """Svuota le chiavi delta dopo che tutti gli step a valle (gold) le hanno consumate."""
+    logger = get_run_logger()
+
+    with get_db_connection() as con:
+        if _table_exists(con, Schemas.SILVER, "_delta_call_number"):
+            con.execute(f"DELETE FROM {Schemas.SILVER}._delta_call_number")
+        if _table_exists(con, Schemas.SILVER, "_delta_incident_number"):
+            con.execute(f"DELETE FROM {Schemas.SILVER}._delta_incident_number")
 
-        logger.info("Silver PHASE2 clean + dedup completato.")
+    logger.info("Silver delta keys svuotate.")
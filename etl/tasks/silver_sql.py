@@ -0,0 +1,252 @@
+"""SQL builder condivisi tra silver Phase 1 (silver.py) e Phase 2 (silver_phase_2.py).
+
+Tutte le funzioni ritornano frammenti SQL DuckDB: i timestamp vengono parsati UNA volta
+in una CTE `base` e le metriche / il dedup lavorano sulle colonne già parsate.
+
+Format sniffing: ogni colonna timestamp usa in pratica un solo formato, quindi lo si
+rileva su un campione (cache in meta.ts_formats per _source_sha256) e si emette un
+singolo try_strptime; la catena COALESCE completa resta solo come fallback per le
+righe che non matchano.
+"""
+from datetime import datetime, timezone
+
+from etl.utils import Schemas
+
+
+TS_FORMATS = [
+    "%m/%d/%Y %I:%M:%S %p",
+    "%m/%d/%Y %H:%M:%S",
+    "%Y-%m-%d %H:%M:%S",
+]
+DATE_FORMATS = [
+    "%m/%d/%Y",
+    "%Y-%m-%d",
+    "%Y/%m/%d",     # Fire_Incidents "Incident Date"
+]
+
+# righe campionate per colonna e quota minima di match per "eleggere" un formato
+FORMAT_SAMPLE_ROWS = 5_000
+FORMAT_MIN_MATCH_RATIO = 0.5
+
+TS_FORMATS_DDL = f"""
+CREATE SCHEMA IF NOT EXISTS {Schemas.META};
+
+CREATE TABLE IF NOT EXISTS {Schemas.META}.ts_formats (
+  source_sha256     VARCHAR NOT NULL,
+  table_name        VARCHAR NOT NULL,
+  column_name       VARCHAR NOT NULL,
+  ts_format         VARCHAR,            -- NULL = nessun formato dominante (solo fallback)
+  sample_rows       BIGINT NOT NULL,
+  matched_rows      BIGINT NOT NULL,
+  detected_at       TIMESTAMP NOT NULL,
+  PRIMARY KEY (source_sha256, table_name, column_name)
+);
+"""
+
+
+def _fallback_chain(col: str, formats: list[str], cast_type: str, skip: str | None) -> str:
+    parts = [f"try_strptime({col}, '{f}')" for f in formats if f != skip]
+    parts.append(f"try_cast({col} AS {cast_type})")
+    return ",\n        ".join(parts)
+
+
+def is_temporal_type(col_type: str | None) -> bool:
+    """True se la colonna è già tipizzata (lake tipizzato): niente parsing da stringa."""
+    return bool(col_type) and (col_type == "DATE" or col_type.startswith("TIMESTAMP"))
+
+
+def parse_ts_sql(col: str, fmt: str | None = None, col_type: str | None = None) -> str:
+    """Parsing timestamp robusto (DuckDB).
+
+    `col` deve essere un identificatore SQL (nome colonna già sanitizzato).
+    Se `fmt` è noto (format sniffing) viene provato per primo: DuckDB valuta gli
+    argomenti successivi del COALESCE solo sulle righe ancora NULL.
+    Se `col_type` è già DATE/TIMESTAMP (lake tipizzato) basta un CAST.
+    """
+    if is_temporal_type(col_type):
+        return f"CAST({col} AS TIMESTAMP)"
+    first = f"try_strptime({col}, '{fmt}'),\n        " if fmt else ""
+    return f"""
+    COALESCE(
+        {first}{_fallback_chain(col, TS_FORMATS, "TIMESTAMP", fmt)}
+    )
+    """
+
+
+def parse_date_sql(col: str, fmt: str | None = None, col_type: str | None = None) -> str:
+    """Parsing date robusto (DuckDB). Stessa logica di parse_ts_sql per `fmt` e `col_type`.
+
+    Il COALESCE della catena ha tipo TIMESTAMP: anche la colonna tipizzata esce TIMESTAMP.
+    """
+    if is_temporal_type(col_type):
+        return f"CAST({col} AS TIMESTAMP)"
+    first = f"try_strptime({col}, '{fmt}'),\n        " if fmt else ""
+    return f"""
+    COALESCE(
+        {first}{_fallback_chain(col, DATE_FORMATS, "DATE", fmt)}
+    )
+    """
+
+
+def _utcnow_naive() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def detect_formats(
+    con,
+    relation: str,
+    ts_cols: list[str],
+    date_cols: list[str],
+    where: str = "",
+    params: list | None = None,
+    sample_n: int = FORMAT_SAMPLE_ROWS,
+) -> dict[str, tuple[str | None, int, int]]:
+    """Campiona `relation` e ritorna {colonna: (formato vincente | None, righe campione, righe matchate)}.
+
+    Un'unica query: per ogni colonna conta i valori non nulli e i match di ogni formato candidato.
+    """
+    candidates = [(c, f) for c in ts_cols if c for f in TS_FORMATS]
+    candidates += [(c, f) for c in date_cols if c for f in DATE_FORMATS]
+    cols = sorted({c for c, _ in candidates})
+    if not cols:
+        return {}
+
+    exprs = [f"count({c})" for c in cols]
+    exprs += [f"count(try_strptime({c}, '{f}'))" for c, f in candidates]
+
+    row = con.execute(
+        f"""
+        WITH sample AS (
+            SELECT {", ".join(cols)}
+            FROM {relation}
+            {where}
+            LIMIT {int(sample_n)}
+        )
+        SELECT {", ".join(exprs)}
+        FROM sample
+        """,
+        params or [],
+    ).fetchone()
+
+    non_null = dict(zip(cols, row[: len(cols)]))
+    best: dict[str, tuple[str | None, int]] = {c: (None, 0) for c in cols}
+    for (c, f), matched in zip(candidates, row[len(cols):]):
+        if matched > best[c][1]:
+            best[c] = (f, matched)
+
+    out = {}
+    for c in cols:
+        fmt, matched = best[c]
+        total = int(non_null[c] or 0)
+        if not total or matched < total * FORMAT_MIN_MATCH_RATIO:
+            fmt = None
+        out[c] = (fmt, total, int(matched))
+    return out
+
+
+def formats_for_shas(
+    con,
+    table: str,
+    ts_cols: list[str],
+    date_cols: list[str],
+    shas: list[str],
+) -> dict[str, str]:
+    """Formato per colonna sugli sha in scope, con cache in meta.ts_formats.
+
+    - sha non ancora in cache: sniffing sul campione di quello sha e salvataggio
+    - scelta finale: formato con più righe matchate tra gli sha in scope
+    `table` è il nome completo della tabella/vista bronze (es. "bronze.calls").
+    Nessuna colonna stringa da parsare (lake tipizzato): niente da rilevare.
+    """
+    if not any(ts_cols) and not any(date_cols):
+        return {}
+    con.execute(TS_FORMATS_DDL)
+
+    cached = {
+        r[0]
+        for r in con.execute(
+            f"""
+            SELECT DISTINCT source_sha256
+            FROM {Schemas.META}.ts_formats
+            WHERE table_name = ?
+            """,
+            [table],
+        ).fetchall()
+    }
+
+    now = _utcnow_naive()
+    for sha in shas:
+        if sha in cached:
+            continue
+        detected = detect_formats(
+            con,
+            table,
+            ts_cols,
+            date_cols,
+            where="WHERE _source_sha256 = ?",
+            params=[sha],
+        )
+        con.executemany(
+            f"""
+            INSERT OR REPLACE INTO {Schemas.META}.ts_formats
+              (source_sha256, table_name, column_name, ts_format, sample_rows, matched_rows, detected_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            [[sha, table, c, fmt, total, matched, now] for c, (fmt, total, matched) in detected.items()],
+        )
+
+    if not shas:
+        return {}
+
+    rows = con.execute(
+        f"""
+        SELECT column_name, ts_format
+        FROM {Schemas.META}.ts_formats
+        WHERE table_name = ?
+          AND source_sha256 IN (SELECT unnest(?::VARCHAR[]))
+          AND ts_format IS NOT NULL
+        GROUP BY column_name, ts_format
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY column_name ORDER BY SUM(matched_rows) DESC) = 1
+        """,
+        [table, list(shas)],
+    ).fetchall()
+    return {c: f for c, f in rows}
+
+
+def seconds_between_sql(start_col: str, end_col: str) -> str:
+    """Durata in secondi tra due timestamp già parsati; NULL se manca un estremo o se negativa."""
+    return f"""
+    CASE
+      WHEN {start_col} IS NOT NULL AND {end_col} IS NOT NULL
+      THEN
+        CASE
+          WHEN datediff('second', {start_col}, {end_col}) >= 0
+          THEN datediff('second', {start_col}, {end_col})
+          ELSE NULL
+        END
+      ELSE NULL
+    END
+    """
+
+
+def calls_metrics_sql() -> str:
+    """Metriche derivate di calls_clean, calcolate sulle colonne *_ts della CTE base."""
+    return f"""
+    {seconds_between_sql("received_ts", "on_scene_ts")} AS response_time_sec,
+    {seconds_between_sql("received_ts", "dispatch_ts")} AS dispatch_delay_sec,
+    {seconds_between_sql("dispatch_ts", "on_scene_ts")} AS travel_time_sec
+    """
+
+
+def dedup_qualify_sql(partition_by: str, *order_by: str) -> str:
+    """QUALIFY ROW_NUMBER() = 1: tiene la versione più recente per chiave.
+
+    `order_by` sono espressioni già complete di direzione (es. "rowid DESC").
+    """
+    return f"""
+    QUALIFY ROW_NUMBER() OVER (
+      PARTITION BY {partition_by}
+      ORDER BY
+        {", ".join(order_by)}
+    ) = 1
+    """
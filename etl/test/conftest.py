@@ -0,0 +1,61 @@
+import logging
+import sys
+
+import duckdb
+import pytest
+
+import etl.utils
+
+
+@pytest.fixture
+def warehouse(tmp_path, monkeypatch):
+    """Warehouse DuckDB vuoto in tmp_path (cwd inclusa: temp_directory dei PRAGMA è relativa)."""
+    monkeypatch.chdir(tmp_path)
+    db_path = tmp_path / "warehouse.duckdb"
+    monkeypatch.setattr(etl.utils, "DB_PATH", str(db_path))
+    return db_path
+
+
+@pytest.fixture
+def run_task(monkeypatch):
+    """Esegue il corpo di un @task fuori da una flow run (logger standard al posto di get_run_logger)."""
+
+    def _run(task, **kwargs):
+        module = sys.modules[task.fn.__module__]
+        monkeypatch.setattr(module, "get_run_logger", lambda: logging.getLogger(task.name))
+        return task.fn(**kwargs)
+
+    return _run
+
+
+@pytest.fixture
+def gold_warehouse(warehouse):
+    """Star schema minimo nel warehouse: gennaio 2024, tre fact di cui una senza tipo né location."""
+    con = duckdb.connect(str(warehouse))
+    try:
+        con.execute("CREATE SCHEMA gold")
+        con.execute("""
+        CREATE TABLE gold.dim_date AS
+        SELECT 20240101 AS date_id, DATE '2024-01-01' AS date, 2024 AS year, 1 AS month
+        UNION ALL SELECT 20240102, DATE '2024-01-02', 2024, 1
+        """)
+        con.execute("""
+        CREATE TABLE gold.dim_incident_type AS
+        SELECT 1 AS incident_type_id, 'Structure Fire' AS call_type, 'Fire' AS call_type_group
+        """)
+        con.execute("""
+        CREATE TABLE gold.dim_location AS
+        SELECT 1 AS location_id, 'Mission' AS neighborhood, 'B02' AS battalion, 'San Francisco' AS city
+        """)
+        con.execute("""
+        CREATE TABLE gold.fact_incident AS
+        SELECT * FROM (VALUES
+            (1, 20240101, 1,    1,    300, 60, 240),
+            (2, 20240102, 1,    1,    600, 90, 510),
+            (3, 20240102, NULL, NULL, 450, 30, 420)
+        ) t(incident_id, date_id, incident_type_id, location_id,
+            response_time_sec, dispatch_delay_sec, travel_time_sec)
+        """)
+    finally:
+        con.close()
+    return warehouse
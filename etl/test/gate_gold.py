@@ -70,4 +70,11 @@ def validate_gold_quality() -> None:
             "FAIL: incident_duration_sec negativo in gold.fact_incident",
         )
 
+        # 5) location_key (hash 64 bit) univoca: due location diverse con la stessa chiave = collisione
+        _assert_sql(
+            con,
+            "SELECT COUNT(*) - COUNT(DISTINCT location_key) FROM gold.dim_location;",
+            "FAIL: collisione di location_key in gold.dim_location",
+        )
+
         logger.info("Quality gate GOLD superato.")
@@ -0,0 +1,52 @@
+import duckdb
+
+import etl.tasks.dashboard_export as dashboard_export
+from etl.tasks.kpi_gold_view import build_filter_options, build_kpi_cube, create_kpi_views
+
+
+def _publish(db_path, version: int) -> None:
+    con = duckdb.connect(str(db_path))
+    try:
+        con.execute("CREATE SCHEMA IF NOT EXISTS meta")
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS meta.gold_versions (version BIGINT, published_at TIMESTAMP, note VARCHAR)"
+        )
+        con.execute("INSERT INTO meta.gold_versions VALUES (?, now(), NULL)", [version])
+    finally:
+        con.close()
+
+
+def test_export_skips_hashing_when_gold_version_unchanged(gold_warehouse, run_task, tmp_path, monkeypatch):
+    run_task(build_kpi_cube)
+    run_task(create_kpi_views)
+    run_task(build_filter_options)
+    _publish(gold_warehouse, 1)
+
+    hashed = []
+    content_version = dashboard_export._content_version
+
+    def _counting_content_version(con, schema, name, where=""):
+        hashed.append(f"{schema}.{name}")
+        return content_version(con, schema, name, where)
+
+    monkeypatch.setattr(dashboard_export, "_content_version", _counting_content_version)
+
+    def _export():
+        hashed.clear()
+        dashboard_export.export_dashboard_db(tmp_path / "dashboard.duckdb", gold_warehouse, tmp_path / "bundle")
+        return len(hashed)
+
+    assert _export() > 0
+    # stessa versione gold: nessun full scan
+    assert _export() == 0
+
+    # versione nuova a contenuto invariato: hash una volta, poi la versione risulta esportata
+    _publish(gold_warehouse, 2)
+    assert _export() > 0
+    assert _export() == 0
+
+    con = duckdb.connect(str(tmp_path / "dashboard.duckdb"), read_only=True)
+    try:
+        assert con.execute("SELECT MAX(version) FROM meta.gold_versions").fetchone()[0] == 2
+    finally:
+        con.close()
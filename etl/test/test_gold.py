@@ -0,0 +1,89 @@
+import duckdb
+
+from etl.tasks.gold import build_fact_incident, build_gold_dimensions, build_gold_staging
+
+
+def _insert_silver(con, call_number: int, call_type: str, address: str) -> None:
+    """Una call con il suo incident (incident_number = call_number), stessa data."""
+    con.execute(
+        """
+        INSERT INTO silver.calls_clean BY NAME
+        SELECT ? AS call_number, ? AS incident_number, DATE '2024-01-01' AS call_date,
+               TIMESTAMP '2024-01-01 10:00:00' AS received_ts, ? AS call_type,
+               'Fire' AS call_type_group, 3 AS final_priority, ? AS address, 'SF' AS city
+        """,
+        [call_number, call_number, call_type, address],
+    )
+    con.execute(
+        "INSERT INTO silver.incidents_clean BY NAME SELECT ? AS incident_number, DATE '2024-01-01' AS incident_date",
+        [call_number],
+    )
+
+
+def _create_silver(db_path) -> None:
+    con = duckdb.connect(str(db_path))
+    try:
+        con.execute("CREATE SCHEMA silver")
+        con.execute("""
+        CREATE TABLE silver.calls_clean (
+            call_number BIGINT, incident_number BIGINT, call_date DATE,
+            received_ts TIMESTAMP, dispatch_ts TIMESTAMP, response_ts TIMESTAMP, on_scene_ts TIMESTAMP,
+            response_time_sec DOUBLE, dispatch_delay_sec DOUBLE, travel_time_sec DOUBLE,
+            number_of_alarms INTEGER, call_type VARCHAR, call_type_group VARCHAR, final_priority INTEGER,
+            address VARCHAR, city VARCHAR, zipcode_of_incident INTEGER,
+            neighborhoods_analysis_boundaries VARCHAR, battalion VARCHAR, station_area VARCHAR,
+            supervisor_district INTEGER, fire_prevention_district VARCHAR, box VARCHAR, location VARCHAR
+        )
+        """)
+        con.execute("""
+        CREATE TABLE silver.incidents_clean (
+            incident_number BIGINT, incident_date DATE, close_ts TIMESTAMP,
+            number_of_alarms INTEGER, suppression_units INTEGER, suppression_personnel INTEGER,
+            ems_units INTEGER, ems_personnel INTEGER, other_units INTEGER, other_personnel INTEGER,
+            estimated_property_loss BIGINT, estimated_contents_loss BIGINT, primary_situation VARCHAR,
+            address VARCHAR, city VARCHAR, zipcode INTEGER, neighborhood_district VARCHAR,
+            battalion VARCHAR, station_area VARCHAR, supervisor_district INTEGER, box VARCHAR, location VARCHAR
+        )
+        """)
+        _insert_silver(con, 1, "Structure Fire", "1 Main St")
+        _insert_silver(con, 2, "Vehicle Fire", "2 Main St")
+    finally:
+        con.close()
+
+
+def _build_gold(run_task, incremental: bool) -> None:
+    run_task(build_gold_staging, incremental=incremental)
+    run_task(build_gold_dimensions, incremental=incremental)
+    run_task(build_fact_incident, incremental=incremental)
+
+
+def test_dimension_rebuilt_in_full_rebuilds_fact(warehouse, run_task):
+    _create_silver(warehouse)
+    _build_gold(run_task, incremental=False)
+
+    # delta con un tipo che ordina prima degli esistenti + dim_incident_type persa:
+    # la dim rifatta da zero rinumera gli id delle call già nella fact
+    con = duckdb.connect(str(warehouse))
+    try:
+        _insert_silver(con, 3, "Alarm", "3 Main St")
+        con.execute("CREATE TABLE silver._delta_call_number AS SELECT 3::BIGINT AS call_number")
+        con.execute("CREATE TABLE silver._delta_incident_number AS SELECT 3::BIGINT AS incident_number")
+        con.execute("DROP TABLE gold.dim_incident_type")
+    finally:
+        con.close()
+
+    _build_gold(run_task, incremental=True)
+
+    con = duckdb.connect(str(warehouse), read_only=True)
+    try:
+        rows = con.execute("""
+        SELECT f.call_number, t.call_type = c.call_type, l.address = c.address
+        FROM gold.fact_incident f
+        JOIN silver.calls_clean c USING (call_number)
+        LEFT JOIN gold.dim_incident_type t USING (incident_type_id)
+        LEFT JOIN gold.dim_location l USING (location_id)
+        ORDER BY f.call_number
+        """).fetchall()
+        assert rows == [(1, True, True), (2, True, True), (3, True, True)]
+    finally:
+        con.close()
@@ -0,0 +1,73 @@
+from datetime import date
+
+import duckdb
+
+from etl.tasks.kpi_gold_view import build_filter_options, build_kpi_cube, create_kpi_views
+
+
+def test_kpi_counts_facts_without_type_or_location(gold_warehouse, run_task):
+    run_task(build_kpi_cube)
+    run_task(create_kpi_views)
+    run_task(build_filter_options)
+
+    con = duckdb.connect(str(gold_warehouse), read_only=True)
+    try:
+        assert con.execute(
+            "SELECT incident_count FROM gold.v_kpi_incident_volume_month WHERE year = 2024 AND month = 1"
+        ).fetchone()[0] == 3
+        assert con.execute(
+            "SELECT n_incidents, avg_response_time_sec FROM gold.v_kpi_response_time_month"
+        ).fetchone() == (3, 450.0)
+        assert con.execute(
+            "SELECT n_incidents FROM gold.kpi_response_pctl(NULL, NULL, NULL, NULL)"
+        ).fetchone()[0] == 3
+        assert con.execute(
+            "SELECT * FROM gold.kpi_summary(NULL, NULL, NULL, NULL)"
+        ).fetchone() == (3, 450.0, 60.0, 390.0)
+        assert con.execute(
+            "SELECT * FROM gold.kpi_summary(2024, 1, 'Fire', NULL)"
+        ).fetchone() == (2, 450.0, 75.0, 375.0)
+        assert con.execute(
+            "SELECT * FROM gold.kpi_response_time_month(NULL, NULL, NULL, NULL)"
+        ).fetchall() == [(2024, 1, 450.0, 3)]
+        # la fact senza tipo/location è una cella a sé, non finisce in quelle valorizzate
+        assert con.execute(
+            "SELECT n_incidents FROM gold.kpi_cube WHERE call_type IS NULL AND neighborhood IS NULL"
+        ).fetchone()[0] == 1
+        assert con.execute(
+            "SELECT n_incidents FROM gold.filter_options WHERE filter_name = 'year' AND value = '2024'"
+        ).fetchone()[0] == 3
+    finally:
+        con.close()
+
+
+def test_calls_filter_options_use_raw_silver_values(gold_warehouse, run_task):
+    con = duckdb.connect(str(gold_warehouse))
+    try:
+        # valori grezzi (spazi inclusi) come li filtra mock_up.py; la dim_location ha 'San Francisco'
+        con.execute("CREATE SCHEMA silver")
+        con.execute("""
+        CREATE TABLE silver.calls_clean AS
+        SELECT * FROM (VALUES
+            (TIMESTAMP '2023-12-31 00:00:00', 'Fire',  'SF ', 'B02'),
+            (TIMESTAMP '2024-01-02 00:00:00', 'Alarm', 'SF ', NULL)
+        ) t(call_date, call_type_group, city, battalion)
+        """)
+    finally:
+        con.close()
+
+    run_task(build_filter_options)
+
+    con = duckdb.connect(str(gold_warehouse), read_only=True)
+    try:
+        rows = con.execute(
+            "SELECT filter_name, value, n_calls FROM gold.calls_filter_options "
+            "WHERE filter_name <> 'all' ORDER BY ALL"
+        ).fetchall()
+        assert rows == [("battalion", "B02", 1), ("call_type_group", "Alarm", 1),
+                        ("call_type_group", "Fire", 1), ("city", "SF ", 2)]
+        assert con.execute(
+            "SELECT first_date::DATE, last_date::DATE FROM gold.calls_filter_options WHERE filter_name = 'all'"
+        ).fetchone() == (date(2023, 12, 31), date(2024, 1, 2))
+    finally:
+        con.close()
@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import os
 import re
+import threading
 from contextlib import contextmanager
 
 import duckdb
@@ -17,6 +18,9 @@ DB_PATH = os.getenv("WAREHOUSE_DB_PATH", "data/warehouse.duckdb")
 # Client drop zone (Phase 2)
 CLIENT_DROP_DIR = os.getenv("CLIENT_DROP_DIR", "data/Client_drop")
 
+# Parallelismo Phase 2 (hash / conversione CSV->Parquet dei file della drop zone)
+PHASE2_MAX_WORKERS = int(os.getenv("PHASE2_MAX_WORKERS", str(min(8, os.cpu_count() or 1))))
+
 
 class Schemas:
     BRONZE = "bronze"
@@ -25,14 +29,58 @@ class Schemas:
     META = "meta"
 
 
-@contextmanager
-def get_db_connection(read_only: bool = False):
-    """Context manager per DuckDB."""
-    con = duckdb.connect(DB_PATH, read_only=read_only)
+# Connessione "run-scoped" (vedi shared_db_connection): None = nessuna flow run la sta tenendo aperta
+_SHARED_CON: duckdb.DuckDBPyConnection | None = None
+
+# Task concorrenti nello stesso processo (.submit() di Prefect, thread): la parte CPU
+# (parsing, hashing) gira in parallelo, le scritture sul warehouse una alla volta.
+DB_WRITE_LOCK = threading.Lock()
+
+
+def _apply_pragmas(con) -> None:
     con.execute("PRAGMA temp_directory='data/tmp_duckdb'")
     con.execute("PRAGMA memory_limit='8GB'")
     con.execute("PRAGMA threads=4")
 
+
+@contextmanager
+def shared_db_connection():
+    """
+    Tiene aperto il warehouse per tutta la flow run.
+
+    Dentro questo blocco get_db_connection() non riapre il file (né fa checkpoint
+    a ogni close): restituisce un cursor() della stessa istanza DuckDB.
+    Annidabile: se una connessione condivisa è già aperta viene riusata.
+    """
+    global _SHARED_CON
+    if _SHARED_CON is not None:
+        yield _SHARED_CON
+        return
+
+    con = duckdb.connect(DB_PATH)
+    _apply_pragmas(con)
+    _SHARED_CON = con
+    try:
+        yield con
+    finally:
+        _SHARED_CON = None
+        con.close()
+
+
+@contextmanager
+def get_db_connection(read_only: bool = False):
+    """Context manager per DuckDB.
+
+    Con una shared_db_connection() attiva ritorna un cursor della connessione condivisa
+    (read_only ignorato: l'istanza è già aperta in scrittura). I PRAGMA sono globali
+    all'istanza e un task può averli cambiati (es. silver): li riallineo, costano poco.
+    """
+    if _SHARED_CON is not None:
+        con = _SHARED_CON.cursor()
+    else:
+        con = duckdb.connect(DB_PATH, read_only=read_only)
+    _apply_pragmas(con)
+
     try:
         yield con
     finally: